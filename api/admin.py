@@ -1,10 +1,97 @@
 from django.contrib import admin
-from api.models import Customer, Meter, MeterType, Account_Asset_Link, Consumption, Rate
+from django.db import transaction
+from api import events, rollups, rates
+from api.models import (Customer, Meter, MeterType, Account_Asset_Link, Consumption, Rate, DailyUsage, MonthlyUsage,
+                        SlowOperation, SlowStatement)
 # Register your models here.
 
+
+class ConsumptionAdmin(admin.ModelAdmin):
+    """ Keeps the usage rollups current for reads edited in the admin. """
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            changed = []
+            if change:
+                changed.append(Consumption.objects.values_list('meter_id', 'read_time').get(pk=obj.pk))
+            super().save_model(request, obj, form, change)
+            changed.append((obj.meter_id, obj.read_time))
+            rollups.refresh_reads(changed)
+            if not change:
+                events.publish_consumption([obj])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            rollups.refresh_reads([(obj.meter_id, obj.read_time)])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            changed = list(queryset.values_list('meter_id', 'read_time'))
+            super().delete_queryset(request, queryset)
+            rollups.refresh_reads(changed)
+
+
+class RateAdmin(admin.ModelAdmin):
+    """ Invalidates the rate index in every worker when rates change. """
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rates.invalidate()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rates.invalidate()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        rates.invalidate()
+
+
+class UsageRollupAdmin(admin.ModelAdmin):
+    """ Rollups are derived data; they are browsable but not editable. """
+    list_display = ('meter', 'unit_of_measure', 'usage', 'reads')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class SlowStatementInline(admin.StackedInline):
+    model = SlowStatement
+    fields = ('database', 'duration', 'sql', 'params', 'explain')
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class SlowOperationAdmin(admin.ModelAdmin):
+    """ Recorded slow GraphQL operations with their slowest statements and plans; read only. """
+    list_display = ('created', 'operation_type', 'operation_name', 'fields', 'duration', 'sql_count', 'sql_duration')
+    list_filter = ('operation_type',)
+    search_fields = ('operation_name', 'fields', 'query')
+    date_hierarchy = 'created'
+    inlines = [SlowStatementInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Customer)
 admin.site.register(Meter)
 admin.site.register(MeterType)
 admin.site.register(Account_Asset_Link)
-admin.site.register(Consumption)
-admin.site.register(Rate)
\ No newline at end of file
+admin.site.register(Consumption, ConsumptionAdmin)
+admin.site.register(Rate, RateAdmin)
+admin.site.register(DailyUsage, UsageRollupAdmin)
+admin.site.register(MonthlyUsage, UsageRollupAdmin)
+admin.site.register(SlowOperation, SlowOperationAdmin)
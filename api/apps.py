@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ApiConfig(AppConfig):
+    name = 'api'
+
+    def ready(self):
+        from . import authentication, routers
+        authentication.connect_signals()
+        routers.connect_signals()
@@ -0,0 +1,100 @@
+""" ASGI handler that serves GraphQL requests from a bounded thread pool.
+
+Django 3.0 has no async views, and its ASGI handler runs every request's
+synchronous view code on one shared thread, so a slow export would stall
+all other requests of the process. ``GraphQLASGIHandler`` receives and
+sends on the event loop as usual, but runs the middleware and view of a
+request routed to the ``graphql`` URL on a pool of
+``GRAPHQL_ASGI_THREADS`` threads. Each thread keeps its own database
+connection, so the pool size bounds the connections a process opens. At
+most ``GRAPHQL_ASGI_MAX_PENDING`` GraphQL requests wait for or occupy a
+thread; further ones are answered 503 straight away. WebSocket connections
+to the same URL carry subscriptions, see ``api.subscriptions``. Other URLs
+are served by Django's handler unchanged.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+from django.core.exceptions import RequestAborted
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve, set_script_prefix
+from graphene_django.settings import graphene_settings
+
+from . import routers
+
+
+class GraphQLASGIHandler(ASGIHandler):
+    """ ASGIHandler that runs GraphQL requests on its own bounded thread pool. """
+
+    def __init__(self, threads, max_pending):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='graphql')
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def is_graphql(self, scope):
+        path, root = scope['path'], scope.get('root_path', '')
+        if root and path.startswith(root):
+            path = path[len(root):]
+        try:
+            return resolve(path).url_name == 'graphql'
+        except Resolver404:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            if self.is_graphql(scope):
+                # Imported here because it needs the app registry, which is set up after this module loads.
+                from .subscriptions import Connection
+                await Connection(graphene_settings.SCHEMA, self.executor, scope, receive, send).run()
+            else:
+                await receive()
+                await send({'type': 'websocket.close'})
+            return
+        if scope['type'] != 'http' or not self.is_graphql(scope):
+            return await super().__call__(scope, receive, send)
+
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+        if self.pending >= self.max_pending:
+            await self.send_response(HttpResponse('Too many pending GraphQL requests.', status=503), send)
+            return
+
+        # Only the event loop thread touches the counter.
+        self.pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            response = await loop.run_in_executor(self.executor, self.respond, scope, body_file)
+        finally:
+            self.pending -= 1
+        await self.send_response(response, send)
+
+    def respond(self, scope, body_file):
+        # Runs on a pool thread, which owns the database connection used here.
+        set_script_prefix(self.get_script_prefix(scope))
+        signals.request_started.send(sender=self.__class__, scope=scope)
+        try:
+            request, error_response = self.create_request(scope, body_file)
+            if request is None:
+                return error_response
+            response = self.get_response(request)
+            response._handler_class = self.__class__
+            return response
+        finally:
+            # request_finished is sent when the event loop closes the response, on another
+            # thread, so this pool thread would otherwise keep reading from the route it chose.
+            routers.reset()
+            close_old_connections()
+
+
+def get_asgi_application():
+    """ Set up Django and return the ASGI application. """
+    django.setup(set_prefix=False)
+    return GraphQLASGIHandler(settings.GRAPHQL_ASGI_THREADS, settings.GRAPHQL_ASGI_MAX_PENDING)
@@ -0,0 +1,130 @@
+""" Process-local caches for JWT verification and the users tokens resolve to.
+
+``decode_token`` and ``get_user_by_natural_key`` are installed as the
+``JWT_DECODE_HANDLER`` and ``JWT_GET_USER_BY_NATURAL_KEY_HANDLER`` of
+django-graphql-jwt. A token's signature is verified once; after that its
+cached payload is only checked for expiry. A user is loaded once together
+with their permission set, so ``has_perm`` answers from memory, and each
+request gets its own copy of the cached instance. A request carrying an
+already-seen token therefore makes no authentication queries.
+
+Users, groups and permissions are tied to the cached users by signals. Any
+change clears this process's users, immediately and again once the
+transaction commits, and replaces a generation token in the default cache;
+other workers compare their generation with it at most every
+``AUTH_CACHE_CHECK_SECONDS``, as the rate index does. Token payloads do not
+depend on the database and are kept until they expire or are evicted.
+"""
+import copy
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from graphql_jwt import utils
+from graphql_jwt.settings import jwt_settings
+
+from .lru import LRUCache
+
+GENERATION_KEY = 'api:auth:generation'
+
+_lock = threading.Lock()
+_tokens = None
+_users = None
+_generation = None
+_checked = 0.0
+
+
+def token_cache():
+    global _tokens
+    if _tokens is None:
+        _tokens = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE)
+    return _tokens
+
+
+def user_cache():
+    """ Return this process's user cache, emptied when users or permissions changed anywhere. """
+    global _users, _generation, _checked
+
+    now = time.monotonic()
+    if _users is not None and now - _checked < settings.AUTH_CACHE_CHECK_SECONDS:
+        return _users
+
+    with _lock:
+        generation = cache.get_or_set(GENERATION_KEY, lambda: uuid.uuid4().hex, timeout=None)
+        if _users is None or generation != _generation:
+            _users = LRUCache(settings.AUTH_USER_CACHE_SIZE)
+            _generation = generation
+        _checked = now
+        return _users
+
+
+def check_expiry(payload):
+    if not jwt_settings.JWT_VERIFY_EXPIRATION or 'exp' not in payload:
+        return
+    leeway = jwt_settings.JWT_LEEWAY
+    if isinstance(leeway, timedelta):
+        leeway = leeway.total_seconds()
+    if payload['exp'] < time.time() - leeway:
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+
+def decode_token(token, context=None):
+    """ Verify ``token`` once, then answer from its cached payload until it expires. """
+    tokens = token_cache()
+    payload = tokens.get(token)
+    if payload is None:
+        payload = utils.jwt_decode(token, context)
+        tokens.set(token, payload)
+    else:
+        check_expiry(payload)
+    return dict(payload)
+
+
+def get_user_by_natural_key(username):
+    """ Return a copy of the cached user named ``username``, with permissions loaded. """
+    users = user_cache()
+    user = users.get(username)
+    if user is None:
+        user = utils.get_user_by_natural_key(username)
+        if user is None:
+            return None
+        # Fills the backend's permission caches on the instance.
+        user.get_all_permissions()
+        users.set(username, user)
+    return copy.copy(user)
+
+
+def reset():
+    # Drop this process's users and tell other workers to drop theirs.
+    global _users
+    with _lock:
+        _users = None
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate(update_fields=None, **kwargs):
+    """ Invalidate cached users in every worker now and again once the current transaction commits. """
+    # Logging in only records last_login.
+    if update_fields == frozenset(['last_login']):
+        return
+    # Resetting now keeps this process from serving the old user for the rest of the
+    # transaction; resetting on commit drops copies others reloaded before it committed.
+    reset()
+    transaction.on_commit(reset)
+
+
+def connect_signals():
+    User = get_user_model()
+    for model in (User, Group, Permission):
+        post_save.connect(invalidate, sender=model, dispatch_uid='api.authentication.save')
+        post_delete.connect(invalidate, sender=model, dispatch_uid='api.authentication.delete')
+    for through in (User.groups.through, User.user_permissions.through, Group.permissions.through):
+        m2m_changed.connect(invalidate, sender=through, dispatch_uid='api.authentication.m2m')
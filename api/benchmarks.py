@@ -0,0 +1,312 @@
+""" Timed runs of representative GraphQL operations.
+
+``OPERATIONS`` covers the API's main paths: paged reads, filtered reads,
+mutations, the bulk ingestion mutation and usage aggregations. A ``Sample``
+picks the meter, customer and time ranges they query from whatever data is
+loaded, normally a fleet from ``api.synthetic``.
+
+``Runner`` sends each operation through ``CachedGraphQLView`` as a POST with
+``Cache-Control: no-cache``, so parsing, cost analysis, middleware and
+resolvers are measured but the response cache is not. Requests carry a JWT,
+so authentication is measured too. Each iteration runs in a savepoint that
+is rolled back, so mutations leave the data as they found it and every
+iteration works on the same rows. An operation with ``pages``
+follows ``pageInfo.endCursor`` through that many pages and is timed as a
+whole.
+
+Results are plain JSON, tagged with the commit they were measured at, so runs
+can be stored and compared with ``compare``.
+"""
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from .models import Account_Asset_Link, Consumption, Customer, Meter
+from .pagination import estimate_count
+
+Operation = namedtuple('Operation', 'name group query variables pages budget')
+Operation.__new__.__defaults__ = (1, None)
+
+# Limits checked by ``api.budgets``: SQL statements and rows per run, and p95 seconds.
+Budget = namedtuple('Budget', 'statements rows p95')
+
+CONSUMPTION_PAGE = """
+    query ConsumptionPage($meter: ID!, $after: String) {
+        consumptionRead(meter: $meter, first: 100, after: $after) {
+            edges { node { id readTime reading unitOfMeasure } }
+            pageInfo { hasNextPage endCursor }
+        }
+    }
+"""
+
+OPERATIONS = (
+    Operation('consumption_page', 'paged reads', CONSUMPTION_PAGE, lambda s: {'meter': s.meter_id},
+              budget=Budget(1, 101, 0.5)),
+    Operation('consumption_pages', 'paged reads', CONSUMPTION_PAGE, lambda s: {'meter': s.meter_id}, pages=10,
+              budget=Budget(10, 1010, 2.5)),
+    Operation('meter_page', 'paged reads', """
+        query MeterPage {
+            meterRead(first: 100) {
+                edges { node { meterSerial meterType { meterVendor meterModel } } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    """, lambda s: {}, budget=Budget(1, 101, 0.25)),
+    Operation('consumption_range', 'filtered reads', """
+        query ConsumptionRange($meter: ID!, $range: String!) {
+            consumptionRead(meter: $meter, readTime_Range: $range, first: 100) {
+                edges { node { readTime reading unitOfMeasure } }
+            }
+        }
+    """, lambda s: {'meter': s.meter_id, 'range': s.time_range(days=7)}, budget=Budget(1, 101, 0.5)),
+    Operation('customer_search', 'filtered reads', """
+        query CustomerSearch($name: String!) {
+            customerRead(firstName_Istartswith: $name, first: 50) {
+                totalCount
+                edges { node { firstName lastName } }
+            }
+        }
+    """, lambda s: {'name': s.customer_prefix}, budget=Budget(3, 53, 0.1)),
+    Operation('daily_usage_range', 'filtered reads', """
+        query DailyUsageRange($meter: ID!, $range: String!) {
+            dailyUsageRead(meter: $meter, day_Range: $range, first: 100) {
+                edges { node { day usage unitOfMeasure } }
+            }
+        }
+    """, lambda s: {'meter': s.meter_id, 'range': s.day_range(days=90)}, budget=Budget(1, 101, 0.5)),
+    Operation('customer_create', 'mutations', """
+        mutation CustomerCreate($input: CustomerCreateInput!) {
+            customerCreate(input: $input) { customer { id } }
+        }
+    """, lambda s: {'input': {'firstName': 'Bench', 'lastName': 'Mark'}}, budget=Budget(1, 1, 0.1)),
+    Operation('consumption_create', 'mutations', """
+        mutation ConsumptionCreate($input: ConsumptionCreateInput!) {
+            consumptionCreate(input: $input) { consumption { id } }
+        }
+    """, lambda s: {'input': s.next_reads(1, node_ids=False)[0]}, budget=Budget(8, 4, 0.1)),
+    Operation('consumption_bulk_create', 'bulk', """
+        mutation ConsumptionBulkCreate($input: ConsumptionBulkCreateInput!) {
+            consumptionBulkCreate(input: $input) { createdCount errors { index message } }
+        }
+    """, lambda s: {'input': {'reads': s.next_reads(s.bulk_size)}}, budget=Budget(10, 512, 0.75)),
+    Operation('consumption_usage_hour', 'aggregations', """
+        query ConsumptionUsage($meter: ID!, $start: DateTime!, $end: DateTime!) {
+            consumptionUsage(meter: $meter, start: $start, end: $end, interval: HOUR) { bucketStart usage unit }
+        }
+    """, lambda s: dict(s.period(days=2), meter=s.meter_id), budget=Budget(1, 48, 0.1)),
+    Operation('consumption_usage_day', 'aggregations', """
+        query ConsumptionUsage($meter: ID!, $start: DateTime!, $end: DateTime!) {
+            consumptionUsage(meter: $meter, start: $start, end: $end, interval: DAY) { bucketStart usage unit }
+        }
+    """, lambda s: dict(s.period(days=30), meter=s.meter_id), budget=Budget(1, 31, 0.1)),
+    Operation('fleet_usage_month', 'aggregations', """
+        query FleetUsage($start: Date!, $end: Date!) {
+            fleetUsage(start: $start, end: $end, interval: MONTH) { bucketStart usage unit }
+        }
+    """, lambda s: s.period(days=365, dates=True), budget=Budget(1, 26, 0.1)),
+    Operation('customer_bill', 'aggregations', """
+        query CustomerBill($customer: ID!, $start: Date!, $end: Date!) {
+            customerBill(customer: $customer, periodStart: $start, periodEnd: $end) {
+                total
+                lines { meter { meterSerial } rate usage amount }
+            }
+        }
+    """, lambda s: dict(s.period(days=30, dates=True), customer=s.customer_id), budget=Budget(3, 5, 0.1)),
+)
+
+GROUPS = tuple(sorted(set(operation.group for operation in OPERATIONS)))
+
+
+class Sample:
+    """ The meter, customer and time ranges the operations query, chosen from the loaded data. """
+
+    def __init__(self, prefix='', bulk_size=500):
+        meters = Meter.objects.filter(meter_serial__startswith=prefix).order_by('pk')
+        meter_id = Consumption.objects.filter(meter__in=meters.values('pk')).order_by('meter_id') \
+            .values_list('meter_id', flat=True).first()
+        if meter_id is None:
+            raise ValueError('No meter{} has consumption records.'.format(
+                ' starting with {}'.format(prefix) if prefix else ''))
+        reads = Consumption.objects.filter(meter_id=meter_id)
+        self.meter_pk = meter_id
+        self.meter_id = to_global_id('MeterTy', meter_id)
+        self.first_read = reads.order_by('read_time').values_list('read_time', flat=True).first()
+        self.last_read, self.last_reading, self.unit = reads.order_by('-read_time').values_list(
+            'read_time', 'reading', 'unit_of_measure').first()
+
+        link = Account_Asset_Link.objects.filter(meter_id=meter_id).select_related('customer').first()
+        customer = link.customer if link else Customer.objects.order_by('pk').first()
+        self.customer_id = to_global_id('CustomerType', customer.pk) if customer else None
+        self.customer_prefix = customer.first_name[:2] if customer else 'A'
+        self.bulk_size = min(bulk_size, settings.CONSUMPTION_BULK_MAX_ROWS)
+
+    def period(self, days, dates=False):
+        """ The ``days`` before the last read, as start and end. """
+        end = self.last_read
+        start = max(end - timedelta(days=days), self.first_read)
+        if dates:
+            return {'start': timezone.localdate(start).isoformat(), 'end': timezone.localdate(end).isoformat()}
+        return {'start': start.isoformat(), 'end': end.isoformat()}
+
+    def time_range(self, days):
+        period = self.period(days)
+        return '{},{}'.format(period['start'], period['end'])
+
+    def day_range(self, days):
+        period = self.period(days, dates=True)
+        return '{},{}'.format(period['start'], period['end'])
+
+    def next_reads(self, count, node_ids=True):
+        """ ``count`` hourly reads following the meter's last read. """
+        meter = {'meter': self.meter_id} if node_ids else {'meter': self.meter_pk}
+        return [dict(meter, readTime=(self.last_read + timedelta(hours=n + 1)).isoformat(),
+                     reading=self.last_reading + n + 1, unitOfMeasure=self.unit)
+                for n in range(count)]
+
+
+def percentile(ordered, percent):
+    """ Nearest-rank percentile of an ascending list. """
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.mean(ordered),
+        'p95': percentile(ordered, 95),
+        'max': ordered[-1],
+    }
+
+
+class Runner:
+    """ Runs operations through the GraphQL view as a superuser and times them.
+
+    Used as a context manager: the superuser is created in a transaction that
+    is rolled back on exit, taking every write of the run with it.
+    """
+
+    def __init__(self, schema, iterations=20, warmup=2):
+        from .views import CachedGraphQLView
+        self.view = CachedGraphQLView.as_view(schema=schema)
+        self.capturing_view = CachedGraphQLView.as_view(schema=schema, capture_statements=True)
+        self.factory = RequestFactory()
+        self.iterations = iterations
+        self.warmup = warmup
+
+    def __enter__(self):
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        user = get_user_model().objects.create_superuser('benchmark-{}'.format(uuid.uuid4().hex[:8]), '', None)
+        self.authorization = '{} {}'.format(jwt_settings.JWT_AUTH_HEADER_PREFIX, get_token(user))
+        return self
+
+    def __exit__(self, *exc_info):
+        transaction.set_rollback(True)
+        self.atomic.__exit__(*exc_info)
+
+    def request(self, query, variables, capture=False):
+        request = self.factory.post('/graphql/', json.dumps({'query': query, 'variables': variables}),
+                                    content_type='application/json', HTTP_CACHE_CONTROL='no-cache',
+                                    HTTP_AUTHORIZATION=self.authorization)
+        request.user = AnonymousUser()
+        started = time.perf_counter()
+        response = (self.capturing_view if capture else self.view)(request)
+        elapsed = time.perf_counter() - started
+        return json.loads(response.content), elapsed, request.graphql_trace, len(response.content)
+
+    def once(self, operation, variables, capture=False):
+        # One timed iteration: every page of the operation, rolled back if it writes. With ``capture``,
+        # the SQL statements of every page are kept too.
+        totals = {'seconds': 0.0, 'queries': 0, 'sql_seconds': 0.0, 'bytes': 0, 'errors': [], 'statements': []}
+        with transaction.atomic():
+            after = None
+            for _ in range(operation.pages):
+                body, elapsed, trace, size = self.request(operation.query, dict(variables, **(
+                    {'after': after} if after else {})), capture)
+                totals['seconds'] += elapsed
+                totals['queries'] += trace.queries
+                totals['sql_seconds'] += trace.sql_time
+                totals['bytes'] += size
+                totals['statements'].extend(trace.statements or ())
+                totals['errors'].extend(error['message'] for error in body.get('errors', ()))
+                page_info = next(iter((body.get('data') or {}).values()), None) or {}
+                page_info = page_info.get('pageInfo') if isinstance(page_info, dict) else None
+                if not page_info or not page_info['hasNextPage']:
+                    break
+                after = page_info['endCursor']
+            transaction.set_rollback(True)
+        return totals
+
+    def run(self, operation, sample):
+        variables = operation.variables(sample)
+        for _ in range(self.warmup):
+            self.once(operation, variables)
+        runs = [self.once(operation, variables) for _ in range(self.iterations)]
+        return {
+            'group': operation.group,
+            'iterations': len(runs),
+            'seconds': summarize([run['seconds'] for run in runs]),
+            'sql_seconds': summarize([run['sql_seconds'] for run in runs]),
+            'queries': max(run['queries'] for run in runs),
+            'response_bytes': max(run['bytes'] for run in runs),
+            'errors': sorted(set(error for run in runs for error in run['errors'])),
+        }
+
+
+def git(*args):
+    try:
+        return subprocess.run(('git',) + args, cwd=settings.BASE_DIR, capture_output=True, text=True,
+                              check=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    """ Where and on what the results were measured. """
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created': timezone.now().isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': '{} {}'.format(connection.vendor, connection.pg_version
+                                   if connection.vendor == 'postgresql' else ''),
+        'cpus': os.cpu_count(),
+    }
+
+
+def data_scale():
+    """ Estimated row counts of the benchmarked tables. """
+    return {name: estimate_count(model.objects.all())
+            for name, model in (('customers', Customer), ('meters', Meter), ('reads', Consumption))}
+
+
+def compare(before, after):
+    """ Yield (operation, median before, median after, change) for operations in both result sets. """
+    for name, result in after['operations'].items():
+        previous = before.get('operations', {}).get(name)
+        if previous is None:
+            continue
+        old, new = previous['seconds']['median'], result['seconds']['median']
+        yield name, old, new, (new - old) / old if old else None
@@ -0,0 +1,84 @@
+""" Billing engine: prices metered usage against effective rates.
+
+Usage comes from the DailyUsage rollups, so a billing period is a range of
+whole days ``[period_start, period_end)``. A rate applies to every day from
+``effective_start`` through ``effective_end`` inclusive; an empty end means
+the rate is still in effect. Each day is priced at the rate in the meter's
+unit of measure when one covers it, otherwise at a rate in the other unit
+with the usage converted. Splitting at rate changes, conversion and pricing
+all happen in one SQL statement for any number of customers.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connections, router
+
+from .models import Account_Asset_Link, DailyUsage, Rate
+
+LITERS_PER_GALLON = Decimal('3.785411784')
+
+BillLine = namedtuple('BillLine', 'customer_id meter_id rate_id rate unit first_day last_day usage amount')
+
+BILL_LINES_SQL = """
+    SELECT l.customer_id, d.meter_id, r.id, r.rate, COALESCE(r.unit_of_measure, d.unit_of_measure),
+           MIN(d.day), MAX(d.day),
+           SUM(CASE
+               WHEN r.unit_of_measure IS NULL OR r.unit_of_measure = d.unit_of_measure THEN d.usage
+               WHEN d.unit_of_measure = 'L' THEN d.usage / %(liters_per_gallon)s
+               ELSE d.usage * %(liters_per_gallon)s
+           END) AS usage
+    FROM {link} l
+    JOIN {daily} d ON d.meter_id = l.meter_id AND d.day >= %(start)s AND d.day < %(end)s
+    LEFT JOIN LATERAL (
+        SELECT rate.id, rate.rate, rate.unit_of_measure
+        FROM {rate} rate
+        WHERE rate.effective_start <= d.day
+          AND (rate.effective_end IS NULL OR rate.effective_end >= d.day)
+        ORDER BY rate.unit_of_measure = d.unit_of_measure DESC, rate.effective_start DESC
+        LIMIT 1
+    ) r ON true
+    {customer_filter}
+    GROUP BY l.customer_id, d.meter_id, r.id, r.rate, COALESCE(r.unit_of_measure, d.unit_of_measure)
+    ORDER BY l.customer_id, d.meter_id, MIN(d.day)
+"""
+
+
+def bill_lines(period_start, period_end, customer_ids=None):
+    """ Return BillLine entries for ``[period_start, period_end)``.
+
+    One line is produced per customer, meter and applicable rate. Days with
+    no rate in effect are returned with ``rate`` None and ``amount`` None so
+    they can be flagged rather than silently billed at zero. Amounts are
+    rounded to cents per line.
+    """
+    connection = connections[router.db_for_read(DailyUsage)]
+    qn = connection.ops.quote_name
+    sql = BILL_LINES_SQL.format(
+        link=qn(Account_Asset_Link._meta.db_table),
+        daily=qn(DailyUsage._meta.db_table),
+        rate=qn(Rate._meta.db_table),
+        customer_filter='WHERE l.customer_id = ANY(%(customers)s)' if customer_ids is not None else '',
+    )
+    params = {
+        'start': period_start,
+        'end': period_end,
+        'customers': list(customer_ids) if customer_ids is not None else None,
+        'liters_per_gallon': LITERS_PER_GALLON,
+    }
+
+    lines = []
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for customer_id, meter_id, rate_id, rate, unit, first_day, last_day, usage in cursor.fetchall():
+            amount = None
+            if rate is not None:
+                amount = (usage * rate).quantize(Decimal('0.01'))
+            lines.append(BillLine(customer_id, meter_id, rate_id, rate, unit, first_day, last_day, usage, amount))
+    return lines
+
+
+def customer_bill(customer_id, period_start, period_end):
+    """ Return ``(lines, total)`` for one customer's billing period. """
+    lines = bill_lines(period_start, period_end, [customer_id])
+    total = sum((line.amount for line in lines if line.amount is not None), Decimal('0.00'))
+    return lines, total
@@ -0,0 +1,118 @@
+""" SQL and latency budgets for the benchmarked GraphQL operations.
+
+Every operation in ``api.benchmarks.OPERATIONS`` declares a ``Budget``: the
+most SQL statements one run may issue, the most rows those statements may
+return, and a p95 wall time. Budgets hold for ``REFERENCE_FLEET``, a small
+synthetic fleet, so row counts are reproducible and a resolver that starts
+querying per node shows up as extra statements rather than a slower run.
+
+``measure`` runs an operation through the benchmark ``Runner``, whose
+``OperationTrace`` captures each statement with its row count. Savepoint
+statements and reads of the database cache, which shared caches make on a
+timer, are not counted. ``check``
+compares a measurement with its budget and, when a limit is exceeded,
+explains the failure with a diff between the SQL recorded in ``BASELINE``
+and the SQL just captured, so a new N+1 reads as a block of added lines.
+
+``api/tests/test_budgets.py`` enforces the statement and row budgets, which
+are reproducible. The p95, which depends on the machine, is enforced by
+``check_budgets``, which also writes a JSON report of the budgets and
+rewrites ``BASELINE`` with ``--update-baseline`` once a change in queries is
+intended.
+"""
+import difflib
+import json
+import os
+import re
+
+from django.conf import settings
+
+from .synthetic import Fleet
+
+REFERENCE_FLEET = {'customers': 20, 'meters': 24, 'years': 1, 'cadence': 'mixed', 'seed': 11}
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_budgets.json')
+
+TRANSACTION_RE = re.compile(r'\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+ROWS_RE = re.compile(r'(\([^()]*\))(, \1)+')
+PARAMS_RE = re.compile(r'%s(, %s)+')
+
+
+def cache_tables():
+    return ['"{}"'.format(cache['LOCATION']) for cache in settings.CACHES.values()
+            if cache['BACKEND'] == 'django.core.cache.backends.db.DatabaseCache']
+
+
+def reference_fleet():
+    return Fleet(**REFERENCE_FLEET)
+
+
+def normalize(sql):
+    """ ``sql`` on one line, with repeated VALUES rows and parameter lists collapsed. """
+    sql = ' '.join(sql.split())
+    sql = ROWS_RE.sub(r'\1, ...', sql)
+    return PARAMS_RE.sub('%s, ...', sql)
+
+
+def counted(statement):
+    return not TRANSACTION_RE.match(statement.sql) and not any(table in statement.sql for table in cache_tables())
+
+
+def measure(runner, operation, sample):
+    """ Time ``operation`` with ``runner``, then run it once more capturing its SQL. """
+    timing = runner.run(operation, sample)
+    captured = runner.once(operation, operation.variables(sample), capture=True)
+    statements = [statement for statement in captured['statements'] if counted(statement)]
+    return {
+        'group': operation.group,
+        'budget': operation.budget._asdict() if operation.budget else None,
+        'statements': len(statements),
+        'rows': sum(statement.rows for statement in statements),
+        'p95': timing['seconds']['p95'],
+        'errors': timing['errors'],
+        'sql': [normalize(statement.sql) for statement in statements],
+    }
+
+
+def load_baseline(path=BASELINE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def sql_diff(expected, actual):
+    return '\n'.join(difflib.unified_diff(expected, actual, 'baseline', 'captured', lineterm=''))
+
+
+def check(name, measurement, baseline, latency=True):
+    """ Return the ways ``measurement`` breaks its budget, each explained with the SQL behind it.
+    Without ``latency``, the p95 is not checked. """
+    budget = measurement['budget']
+    if budget is None:
+        return ['{} declares no budget.'.format(name)]
+    failures = ['{}: {}'.format(name, error) for error in measurement['errors']]
+    over_sql = measurement['statements'] > budget['statements'] or measurement['rows'] > budget['rows']
+    if measurement['statements'] > budget['statements']:
+        failures.append('{} ran {} SQL statements, over its budget of {}.'.format(
+            name, measurement['statements'], budget['statements']))
+    if measurement['rows'] > budget['rows']:
+        failures.append('{} fetched {} rows, over its budget of {}.'.format(name, measurement['rows'], budget['rows']))
+    if latency and measurement['p95'] > budget['p95']:
+        failures.append('{} took {:.1f} ms at p95, over its budget of {:.1f} ms.'.format(
+            name, measurement['p95'] * 1000, budget['p95'] * 1000))
+    if over_sql:
+        expected = baseline.get(name)
+        if expected is None:
+            failures.append('No baseline SQL recorded for {}; captured:\n{}'.format(
+                name, '\n'.join(measurement['sql'])))
+        else:
+            failures.append(sql_diff(expected, measurement['sql']) or 'The SQL matches the baseline.')
+    return failures
+
+
+def write_baseline(measurements, path=BASELINE):
+    with open(path, 'w') as f:
+        json.dump({name: measurement['sql'] for name, measurement in sorted(measurements.items())}, f, indent=2)
+        f.write('\n')
@@ -0,0 +1,201 @@
+""" Static cost analysis of GraphQL operations, run before they execute.
+
+The cost of an operation estimates the objects it resolves. Every object,
+list or connection field costs its weight, 1 unless ``FIELD_WEIGHTS`` says
+otherwise, once per parent object it is resolved for; leaf fields are free
+unless weighted, as ``totalCount`` is. A connection resolves ``first`` or
+``last`` nodes, or ``RELAY_CONNECTION_MAX_LIMIT`` when neither is given, as
+every connection field pages by its ``max_limit`` then (see ``api.pagination``),
+so everything selected below its ``edges`` is multiplied by that page size.
+Other lists are multiplied by an estimate of their length: the buckets a
+usage query spans, or ``DEFAULT_LIST_SIZE``. Introspection fields are free.
+
+An operation is rejected before execution when it nests fields deeper than
+``GRAPHQL_MAX_DEPTH``, asks a connection for more than
+``RELAY_CONNECTION_MAX_LIMIT`` records, or costs more than
+``GRAPHQL_MAX_COST``. Over-budget operations are rejected rather than
+trimmed so that a response never silently holds less than was asked for;
+the error and the ``cost`` response extension say what the operation cost.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from graphene_django.settings import graphene_settings
+from graphql.error import GraphQLError
+from graphql.language.ast import (EnumValue, Field, FragmentSpread, InlineFragment, IntValue, OperationDefinition,
+                                  StringValue, Variable)
+from graphql.type.definition import GraphQLList, GraphQLNonNull, GraphQLUnionType, get_named_type, is_leaf_type
+
+# Weights of fields that do not cost one object each, keyed by Type.field or by field name alone.
+# Edges and page info wrap the nodes, which are counted instead.
+FIELD_WEIGHTS = {
+    'edges': 0,
+    'pageInfo': 0,
+    'totalCount': 10,
+    'Query.consumptionUsage': 10,
+    'Query.fleetUsage': 50,
+    'Query.customerBill': 50,
+}
+
+DEFAULT_LIST_SIZE = 10
+
+INTERVAL_SECONDS = {'HOUR': 3600, 'DAY': 86400, 'WEEK': 7 * 86400, 'MONTH': 31 * 86400}
+
+
+class CostError(GraphQLError):
+    """ The operation exceeds a depth, page size or cost limit. """
+
+
+def argument_value(node, variables):
+    if isinstance(node, Variable):
+        return (variables or {}).get(node.name.value)
+    if isinstance(node, IntValue):
+        return int(node.value)
+    if isinstance(node, (StringValue, EnumValue)):
+        return node.value
+    return None
+
+
+def usage_buckets(args):
+    """ Estimate the buckets a usage query returns from its range and interval. """
+    start, end, interval = args.get('start'), args.get('end'), args.get('interval')
+    if isinstance(start, str):
+        start = parse_datetime(start) or parse_date(start)
+    if isinstance(end, str):
+        end = parse_datetime(end) or parse_date(end)
+    if not isinstance(start, datetime.date) or not isinstance(end, datetime.date) \
+            or str(interval).upper() not in INTERVAL_SECONDS:
+        return DEFAULT_LIST_SIZE
+    if not isinstance(start, datetime.datetime):
+        start = datetime.datetime.combine(start, datetime.time())
+    if not isinstance(end, datetime.datetime):
+        end = datetime.datetime.combine(end, datetime.time())
+    span = (end.replace(tzinfo=None) - start.replace(tzinfo=None)).total_seconds()
+    return max(int(span // INTERVAL_SECONDS[str(interval).upper()]) + 1, 1)
+
+
+# Length estimates of list fields, from their arguments.
+LIST_SIZES = {
+    'Query.consumptionUsage': usage_buckets,
+    'Query.fleetUsage': usage_buckets,
+}
+
+
+def is_list(graphql_type):
+    if isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return isinstance(graphql_type, GraphQLList)
+
+
+class CostAnalysis:
+    """ Cost and depth of one operation of a document. """
+
+    def __init__(self, schema, document_ast, variables=None, operation_name=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {}
+        self.operation = None
+        self.errors = []
+        for definition in document_ast.definitions:
+            if isinstance(definition, OperationDefinition):
+                if operation_name is None or definition.name and definition.name.value == operation_name:
+                    self.operation = self.operation or definition
+            else:
+                self.fragments[definition.name.value] = definition
+
+        self.max_page = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        self.cost, self.depth = 0, 0
+        if self.operation is not None:
+            root = {
+                'query': schema.get_query_type,
+                'mutation': schema.get_mutation_type,
+                'subscription': schema.get_subscription_type,
+            }[self.operation.operation]()
+            if root is not None:
+                self.cost, self.depth = self.selection_cost(root, self.operation.selection_set, 1, None, ())
+
+    def fields(self, parent_type, selection_set, fragments):
+        # Yield (type, Field node) pairs, expanding fragments on the types they apply to.
+        for selection in selection_set.selections:
+            if isinstance(selection, Field):
+                yield parent_type, selection
+            elif isinstance(selection, FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is not None and name not in fragments:
+                    yield from self.fields(self.schema.get_type(fragment.type_condition.name.value) or parent_type,
+                                           fragment.selection_set, fragments + (name,))
+            elif isinstance(selection, InlineFragment):
+                condition = selection.type_condition
+                yield from self.fields(self.schema.get_type(condition.name.value) if condition else parent_type,
+                                       selection.selection_set, fragments)
+
+    def selection_cost(self, parent_type, selection_set, multiplier, page, fragments):
+        """ Return the cost and depth of a selection set resolved ``multiplier`` times. """
+        cost = depth = 0
+        for field_type, node in self.fields(parent_type, selection_set, fragments):
+            field_cost, field_depth = self.field_cost(field_type, node, multiplier, page, fragments)
+            cost += field_cost
+            depth = max(depth, field_depth)
+        return cost, depth
+
+    def field_cost(self, parent_type, node, multiplier, page, fragments):
+        name = node.name.value
+        if name.startswith('__') or isinstance(parent_type, GraphQLUnionType):
+            return 0, 0
+        definition = getattr(parent_type, 'fields', {}).get(name)
+        if definition is None:
+            return 0, 0
+
+        key = '{}.{}'.format(parent_type.name, name)
+        named = get_named_type(definition.type)
+        weight = FIELD_WEIGHTS.get(key, FIELD_WEIGHTS.get(name, 0 if is_leaf_type(named) else 1))
+        args = {argument.name.value: argument_value(argument.value, self.variables) for argument in node.arguments}
+
+        child_page = None
+        if 'first' in definition.args or 'last' in definition.args:
+            child_page = self.page_size(node, name, args)
+        count = multiplier
+        if is_list(definition.type):
+            if page is not None:
+                count = multiplier * page
+            else:
+                size = LIST_SIZES.get(key)
+                count = multiplier * (size(args) if size else DEFAULT_LIST_SIZE)
+
+        cost = count * weight
+        if node.selection_set is None or is_leaf_type(named):
+            return cost, 1
+        child_cost, child_depth = self.selection_cost(named, node.selection_set, count, child_page, fragments)
+        return cost + child_cost, child_depth + 1
+
+    def page_size(self, node, name, args):
+        sizes = [args[arg] for arg in ('first', 'last') if isinstance(args.get(arg), int)]
+        for arg in ('first', 'last'):
+            value = args.get(arg)
+            if isinstance(value, int) and self.max_page and value > self.max_page:
+                self.errors.append(CostError(
+                    'Requesting {} records on the `{}` connection exceeds the `{}` limit of {} records.'.format(
+                        value, name, arg, self.max_page), [node]))
+        return min(sizes) if sizes else self.max_page or DEFAULT_LIST_SIZE
+
+    def extension(self):
+        return {
+            'requested': self.cost,
+            'maximum': settings.GRAPHQL_MAX_COST,
+            'depth': self.depth,
+            'maxDepth': settings.GRAPHQL_MAX_DEPTH,
+        }
+
+    def check(self):
+        """ Return errors for every limit the operation exceeds. """
+        errors = list(self.errors)
+        if settings.GRAPHQL_MAX_DEPTH and self.depth > settings.GRAPHQL_MAX_DEPTH:
+            errors.append(CostError('Operation depth {} exceeds the maximum depth of {}.'.format(
+                self.depth, settings.GRAPHQL_MAX_DEPTH)))
+        if settings.GRAPHQL_MAX_COST and self.cost > settings.GRAPHQL_MAX_COST:
+            errors.append(CostError(
+                'Operation cost {} exceeds the maximum cost of {}. Request fewer records with `first` or `last`, '
+                'or select fewer nested connections.'.format(self.cost, settings.GRAPHQL_MAX_COST)))
+        return errors
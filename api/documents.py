@@ -0,0 +1,116 @@
+""" Parsed and validated GraphQL document cache, and persisted queries.
+
+``CachingBackend`` keys documents by the SHA-256 of their text. A cached
+document skips both parsing and validation; documents that fail validation
+are not cached. The cache is a bounded LRU of
+``GRAPHQL_DOCUMENT_CACHE_SIZE`` documents per process, and counts hits,
+misses and evictions.
+
+Persisted queries are read from the JSON manifest at
+``GRAPHQL_PERSISTED_QUERIES``, either a ``{sha256: query}`` mapping or an
+Apollo persisted query manifest. They are parsed and validated once when the
+manifest is loaded and are never evicted. Clients send the hash in
+``extensions.persistedQuery.sha256Hash`` instead of the query text.
+"""
+import hashlib
+import json
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+from .lru import LRUCache
+
+
+def document_id(query):
+    """ Return the SHA-256 hex digest identifying ``query``. """
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def reject(errors, **kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+class CachingBackend(GraphQLCoreBackend):
+    """ A graphql-core backend that reuses parsed, validated documents. """
+
+    def __init__(self, cache, persisted=None, executor=None):
+        super().__init__(executor=executor)
+        self.cache = cache
+        self.persisted = persisted if persisted is not None else {}
+
+    def build(self, schema, document_string):
+        # Parse and validate once; invalid documents execute to their validation errors.
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+        if errors:
+            run = partial(reject, errors)
+        else:
+            run = partial(execute, schema, document_ast, **self.execute_params)
+        document = GraphQLDocument(schema=schema, document_string=document_string,
+                                   document_ast=document_ast, execute=run)
+        return document, not errors
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super().document_from_string(schema, document_string)
+
+        key = document_id(document_string)
+        document = self.persisted.get(key) or self.cache.get(key)
+        if document is not None and document.schema is schema:
+            return document
+
+        document, valid = self.build(schema, document_string)
+        if valid:
+            self.cache.set(key, document)
+        return document
+
+    def load_persisted(self, schema, queries):
+        """ Register ``{sha256: query}`` as persisted documents of ``schema``. """
+        for key, query in queries.items():
+            if document_id(query) != key:
+                raise ImproperlyConfigured('Persisted query {} does not match its SHA-256 hash.'.format(key))
+            document, valid = self.build(schema, query)
+            if not valid:
+                raise ImproperlyConfigured('Persisted query {} is not valid against the schema.'.format(key))
+            self.persisted[key] = document
+
+    def stats(self):
+        return dict(self.cache.stats(), persisted=len(self.persisted))
+
+
+def read_manifest(path):
+    """ Return ``{sha256: query}`` from a manifest file. """
+    with open(path) as handle:
+        manifest = json.load(handle)
+    if isinstance(manifest, dict) and 'operations' in manifest:
+        return {operation['id']: operation['body'] for operation in manifest['operations']}
+    return manifest
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(schema):
+    """ Return the process-wide CachingBackend, loading persisted queries on first use. """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = CachingBackend(LRUCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE))
+            if settings.GRAPHQL_PERSISTED_QUERIES:
+                backend.load_persisted(schema, read_manifest(settings.GRAPHQL_PERSISTED_QUERIES))
+            _backend = backend
+        return _backend
+
+
+def backend_stats():
+    """ Stats of the process-wide CachingBackend, or an empty dict before it is first used. """
+    backend = _backend
+    return backend.stats() if backend is not None else {}
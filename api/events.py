@@ -0,0 +1,223 @@
+""" Fan-out of newly ingested meter reads to GraphQL subscriptions.
+
+Ingest paths call ``publish_consumption`` with the reads they created. Each
+read is published on the channel of its meter, so a subscription only hears
+about the meter it asked for.
+
+With ``SUBSCRIPTION_BROKER = 'local'`` events are handed to this process's
+listeners once the transaction commits, which suits a single server process.
+With ``'postgres'`` they are sent with ``pg_notify``, which PostgreSQL also
+delivers on commit, and every process serving subscriptions runs a thread
+that LISTENs and hands them to its own listeners, until ``stop_listener``.
+Notifications are batched to stay under PostgreSQL's payload limit.
+
+Listeners are called on the publishing or listening thread and must not
+block; ``observe`` passes events on through the subscriber's context.
+"""
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from functools import partial
+
+import psycopg2
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from rx import Observable
+
+from .billing import LITERS_PER_GALLON
+from .models import Consumption
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'water_graph_events'
+NOTIFY_MAX_BYTES = 7000
+
+_lock = threading.Lock()
+_listeners = defaultdict(set)
+# The LISTEN thread and the event that stops it.
+_listener = None
+
+
+def consumption_channel(meter_id):
+    return 'consumption:{}'.format(meter_id)
+
+
+def listen(channel, callback):
+    """ Call ``callback(event)`` for every event on ``channel``; returns a function that stops it. """
+    if settings.SUBSCRIPTION_BROKER == 'postgres':
+        start_listener()
+    with _lock:
+        _listeners[channel].add(callback)
+
+    def stop():
+        with _lock:
+            _listeners[channel].discard(callback)
+            if not _listeners[channel]:
+                del _listeners[channel]
+    return stop
+
+
+def dispatch(messages):
+    # Hand (channel, event) pairs to this process's listeners.
+    for channel, event in messages:
+        with _lock:
+            callbacks = list(_listeners.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('Subscription listener failed for %s', channel)
+
+
+def payloads(messages):
+    # Pack messages into as few notification payloads as fit PostgreSQL's limit.
+    packed, batch, size = [], [], 2
+    for message in messages:
+        encoded = json.dumps(message, cls=DjangoJSONEncoder, separators=(',', ':'))
+        if batch and size + len(encoded) + 1 > NOTIFY_MAX_BYTES:
+            packed.append('[' + ','.join(batch) + ']')
+            batch, size = [], 2
+        batch.append(encoded)
+        size += len(encoded) + 1
+    if batch:
+        packed.append('[' + ','.join(batch) + ']')
+    return packed
+
+
+def notify(messages):
+    # All payloads go in one statement.
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload',
+                       [NOTIFY_CHANNEL, payloads(messages)])
+
+
+def publish(messages):
+    """ Publish (channel, event) pairs once the current transaction commits. """
+    messages = list(messages)
+    if not messages:
+        return
+    if settings.SUBSCRIPTION_BROKER == 'postgres':
+        notify(messages)
+    else:
+        transaction.on_commit(partial(dispatch, messages))
+
+
+def consumption_event(consumption):
+    return {
+        'id': consumption.pk,
+        'meter_id': consumption.meter_id,
+        'read_time': consumption.read_time,
+        'reading': consumption.reading,
+        'unit_of_measure': consumption.unit_of_measure,
+    }
+
+
+def publish_consumption(consumptions):
+    """ Publish newly created Consumption rows to subscribers of their meters. """
+    publish((consumption_channel(c.meter_id), consumption_event(c)) for c in consumptions)
+
+
+def consumption_from_event(event):
+    """ Return an unsaved Consumption carrying the values of a published read. """
+    read_time = event['read_time']
+    if isinstance(read_time, str):
+        read_time = parse_datetime(read_time)
+    return Consumption(pk=event['id'], meter_id=event['meter_id'], read_time=read_time,
+                       reading=event['reading'], unit_of_measure=event['unit_of_measure'])
+
+
+def liters(reading, unit_of_measure):
+    return float(reading * LITERS_PER_GALLON) if unit_of_measure == 'G' else float(reading)
+
+
+class UsageRate:
+    """ Liters per hour used by one meter between each read and the one before it.
+
+    The previous read is remembered between calls and only queried when the
+    new read does not follow it, e.g. for the first read seen.
+    """
+
+    def __init__(self, meter_id):
+        self.meter_id = meter_id
+        self.previous = None
+
+    def __call__(self, consumption):
+        previous = self.previous
+        if previous is None or previous.read_time >= consumption.read_time:
+            previous = (Consumption.objects.filter(meter_id=self.meter_id, read_time__lt=consumption.read_time)
+                        .only('read_time', 'reading', 'unit_of_measure').order_by('-read_time').first())
+        self.previous = consumption
+        if previous is None:
+            return None
+
+        used = liters(consumption.reading, consumption.unit_of_measure)
+        if consumption.unit_of_measure == previous.unit_of_measure and consumption.reading >= previous.reading:
+            used -= liters(previous.reading, previous.unit_of_measure)
+        # Otherwise the register rolled over or the meter was replaced, as in api.usage.
+        return used / ((consumption.read_time - previous.read_time).total_seconds() / 3600)
+
+
+def observe(context, channel):
+    """ Return an Observable of the events on ``channel``.
+
+    When the context has a ``deliver(on_next, event)`` method, events are
+    passed through it so the subscriber decides where they are processed.
+    """
+    deliver = getattr(context, 'deliver', None)
+
+    def subscribe(observer):
+        if deliver is None:
+            return listen(channel, observer.on_next)
+        return listen(channel, partial(deliver, observer.on_next))
+
+    return Observable.create(subscribe)
+
+
+def listen_forever(stopping):
+    # Relay notifications into dispatch(), reconnecting after failures, until ``stopping`` is set.
+    params = connection.get_connection_params()
+    while not stopping.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(**params)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+            while not stopping.is_set():
+                if select.select([conn], [], [], 1) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    dispatch(tuple(message) for message in json.loads(conn.notifies.pop(0).payload))
+        except Exception:
+            logger.exception('Lost the subscription notification connection; reconnecting')
+            stopping.wait(1)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_listener():
+    global _listener
+    with _lock:
+        if _listener is None:
+            stopping = threading.Event()
+            thread = threading.Thread(target=listen_forever, args=(stopping,), name='subscription-listener',
+                                      daemon=True)
+            thread.start()
+            _listener = (thread, stopping)
+
+
+def stop_listener():
+    """ Stop the LISTEN thread and close its connection; the next ``listen`` starts it again. """
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        thread, stopping = listener
+        stopping.set()
+        thread.join()
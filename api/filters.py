@@ -0,0 +1,73 @@
+""" FilterSets for connection fields that need more than ``filter_fields``. """
+import django_filters
+import graphene
+from django_filters.fields import BaseRangeField
+from graphene_django.forms.converter import convert_form_field
+
+from .models import Consumption, DailyUsage, MonthlyUsage
+
+
+class StringRangeField(BaseRangeField):
+    """ Form field of a ``StringRangeFilter``. """
+
+
+@convert_form_field.register(StringRangeField)
+def convert_string_range_field(field):
+    # django-filter parses the bounds from a comma separated string.
+    return graphene.String(description=field.help_text, required=field.required)
+
+
+class StringRangeFilter(django_filters.BaseRangeFilter):
+    """ Range filter exposed as a ``"start,end"`` String argument. Other ``in`` and
+    ``range`` filters keep the argument types graphene-django gives them. """
+    base_field_class = StringRangeField
+
+
+class DateTimeRangeFilter(StringRangeFilter, django_filters.IsoDateTimeFilter):
+    """ Range filter taking an ISO 8601 ``"start,end"`` string.
+
+    graphene-django derives the argument type of generated range lookups from
+    the model field, which turns them into a single DateTime that can never
+    hold both bounds. Declaring the filter exposes it as a String instead.
+    """
+
+
+class DateRangeFilter(StringRangeFilter, django_filters.DateFilter):
+    """ Range filter taking an ISO 8601 ``"start,end"`` date string. """
+
+
+class ConsumptionFilter(django_filters.FilterSet):
+    read_time__range = DateTimeRangeFilter(field_name='read_time', lookup_expr='range')
+
+    class Meta:
+        model = Consumption
+        fields = {
+            'meter': ['exact'],
+            'read_time': ['exact', 'year', 'month', 'day'],
+            'reading': ['exact', 'range'],
+            'unit_of_measure': ['exact'],
+        }
+
+
+class DailyUsageFilter(django_filters.FilterSet):
+    day__range = DateRangeFilter(field_name='day', lookup_expr='range')
+
+    class Meta:
+        model = DailyUsage
+        fields = {
+            'meter': ['exact'],
+            'day': ['exact', 'gte', 'lt'],
+            'unit_of_measure': ['exact'],
+        }
+
+
+class MonthlyUsageFilter(django_filters.FilterSet):
+    month__range = DateRangeFilter(field_name='month', lookup_expr='range')
+
+    class Meta:
+        model = MonthlyUsage
+        fields = {
+            'meter': ['exact'],
+            'month': ['exact', 'gte', 'lt'],
+            'unit_of_measure': ['exact'],
+        }
@@ -0,0 +1,134 @@
+""" Bulk ingestion of meter reads into the Consumption table. """
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from graphql_relay import from_global_id
+
+from . import events, rollups
+from .models import Meter, Consumption
+
+RowError = namedtuple('RowError', 'index message')
+
+MEASURE_CODES = frozenset(code for code, _ in Consumption.MEASURE)
+
+
+def meter_id_from_global_id(node_id):
+    # Decode a relay global ID, returning None when it is not a Meter node.
+    try:
+        type_name, pk = from_global_id(node_id)
+    except Exception:
+        return None
+    if type_name != 'MeterTy' or not pk.isdigit():
+        return None
+    return int(pk)
+
+
+def resolve_meters(rows):
+    """ Map every meter reference in rows to a Meter primary key.
+
+    Rows may reference a meter by relay global ID (``meter``) or by serial
+    number (``meter_serial``). All references are resolved with at most two
+    queries, no matter how many rows are passed in.
+    """
+    node_ids = {}
+    serials = set()
+    for row in rows:
+        if row.get('meter'):
+            node_ids[row['meter']] = meter_id_from_global_id(row['meter'])
+        elif row.get('meter_serial'):
+            serials.add(row['meter_serial'])
+
+    wanted = set(pk for pk in node_ids.values() if pk is not None)
+    known = set(Meter.objects.filter(pk__in=wanted).values_list('pk', flat=True)) if wanted else set()
+    by_node_id = dict((node_id, pk) for node_id, pk in node_ids.items() if pk in known)
+
+    by_serial = dict(Meter.objects.filter(meter_serial__in=serials).values_list('meter_serial', 'pk')) \
+        if serials else {}
+
+    return by_node_id, by_serial
+
+
+def build_consumption(rows):
+    """ Validate rows and build unsaved Consumption instances.
+
+    Returns a tuple of ``(instances, errors)`` where errors is a list of
+    RowError entries indexed by the position of the offending row.
+    """
+    by_node_id, by_serial = resolve_meters(rows)
+    candidates = []
+    instances = []
+    errors = []
+    seen = set()
+
+    for index, row in enumerate(rows):
+        if row.get('meter'):
+            meter_id = by_node_id.get(row['meter'])
+            reference = row['meter']
+        else:
+            meter_id = by_serial.get(row.get('meter_serial'))
+            reference = row.get('meter_serial')
+
+        if not reference:
+            errors.append(RowError(index, 'Either meter or meterSerial is required.'))
+            continue
+        if meter_id is None:
+            errors.append(RowError(index, 'Unknown meter: {}'.format(reference)))
+            continue
+        if row['unit_of_measure'] not in MEASURE_CODES:
+            errors.append(RowError(index, 'Invalid unit of measure: {}'.format(row['unit_of_measure'])))
+            continue
+        if row['reading'] < 0:
+            errors.append(RowError(index, 'Reading must not be negative.'))
+            continue
+
+        key = (meter_id, row['read_time'])
+        if key in seen:
+            errors.append(RowError(index, 'Duplicate read for meter {} at {}'.format(reference, row['read_time'])))
+            continue
+        seen.add(key)
+
+        candidates.append((index, reference, Consumption(
+            meter_id=meter_id,
+            read_time=row['read_time'],
+            reading=row['reading'],
+            unit_of_measure=row['unit_of_measure'],
+        )))
+
+    # Reads already stored would violate the (meter, read_time) constraint and
+    # abort the whole batch, so report them up front with a single lookup.
+    existing = set()
+    if candidates:
+        existing = set(Consumption.objects.filter(
+            meter_id__in=set(c.meter_id for _, _, c in candidates),
+            read_time__in=set(c.read_time for _, _, c in candidates),
+        ).values_list('meter_id', 'read_time'))
+
+    for index, reference, consumption in candidates:
+        if (consumption.meter_id, consumption.read_time) in existing:
+            errors.append(RowError(index, 'A read for meter {} at {} already exists.'.format(
+                reference, consumption.read_time)))
+        else:
+            instances.append(consumption)
+
+    errors.sort(key=lambda e: e.index)
+    return instances, errors
+
+
+def bulk_create_consumption(rows, batch_size=None):
+    """ Insert rows in a single transaction using multi-row INSERTs.
+
+    Invalid rows are skipped and reported; valid rows are written together
+    and the usage rollups they affect are refreshed in the same transaction.
+    Returns a tuple of ``(created, errors)``.
+    """
+    if batch_size is None:
+        batch_size = settings.CONSUMPTION_BULK_BATCH_SIZE
+
+    instances, errors = build_consumption(rows)
+    with transaction.atomic():
+        created = Consumption.objects.bulk_create(instances, batch_size=batch_size)
+        rollups.refresh_reads((c.meter_id, c.read_time) for c in created)
+        events.publish_consumption(created)
+
+    return created, errors
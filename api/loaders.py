@@ -0,0 +1,204 @@
+""" Per-request DataLoaders for foreign key and reverse foreign key fields.
+
+Importing this module replaces graphene-django's converters for
+``ForeignKey`` and reverse relations, so it must be imported before the
+DjangoObjectTypes are declared. Forward relations resolve through a loader
+that fetches every parent's related object with one ``IN (...)`` query.
+Reverse relations without filter arguments fetch each parent's page of
+children with one query, so a level of the response costs one round trip
+however many edges it has. A page without ``first`` or ``last`` holds the
+connection's ``max_limit`` children. Fields with their own resolver, and
+reverse connections given filter arguments or ``last``, resolve as before. Relations already
+joined or prefetched by ``api.optimizer`` are used as they are.
+
+Loaders live on the request, so results are shared by every field resolved
+for it and never outlive it.
+"""
+from collections import defaultdict
+from functools import partial
+
+from django.db import connection, models
+from django.db.models import Count
+from graphene import Dynamic, Field
+from graphene.types.resolver import attr_resolver, dict_or_attr_resolver
+from graphene_django.converter import convert_django_field
+from graphene_django.filter.fields import DjangoFilterConnectionField
+from graphene_django.fields import DjangoConnectionField, DjangoListField
+from graphql_relay.connection.arrayconnection import get_offset_with_default
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .pagination import Page, UncountedMixin
+
+PAGE_SQL = """
+    SELECT related.* FROM unnest(%s) AS parent(id)
+    CROSS JOIN LATERAL (
+        SELECT * FROM {table} r WHERE r.{column} = parent.id ORDER BY r.{pk} LIMIT %s
+    ) related
+"""
+
+
+class ObjectLoader(DataLoader):
+    """ Loads model instances by primary key. """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        objects = self.model._default_manager.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class RelatedLoader(DataLoader):
+    """ Loads the first ``limit`` children of parent primary keys through a foreign key, in primary key order. """
+
+    def __init__(self, field, limit):
+        super().__init__()
+        self.field = field
+        self.limit = limit
+
+    def batch_load_fn(self, keys):
+        model = self.field.model
+        qn = connection.ops.quote_name
+        queryset = model._default_manager.raw(
+            PAGE_SQL.format(table=qn(model._meta.db_table), column=qn(self.field.column),
+                            pk=qn(model._meta.pk.column)),
+            [list(keys), self.limit],
+        )
+
+        children = defaultdict(list)
+        for child in queryset:
+            children[getattr(child, self.field.attname)].append(child)
+        return Promise.resolve([children[key] for key in keys])
+
+
+class CountLoader(DataLoader):
+    """ Counts the children of parent primary keys with one grouped query. """
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+
+    def batch_load_fn(self, keys):
+        counts = dict(
+            self.field.model._default_manager.filter(**{self.field.name + '__in': keys})
+            .values_list(self.field.attname).annotate(Count('pk')).order_by()
+        )
+        return Promise.resolve([counts.get(key, 0) for key in keys])
+
+
+def get_loader(info, key, factory):
+    """ Return the loader registered under ``key`` for this request, creating it on first use. """
+    context = info.context
+    loaders = getattr(context, 'dataloaders', None)
+    if loaders is None:
+        loaders = context.dataloaders = {}
+    if key not in loaders:
+        loaders[key] = factory()
+    return loaders[key]
+
+
+def is_default_resolver(resolver):
+    return isinstance(resolver, partial) and resolver.func in (attr_resolver, dict_or_attr_resolver)
+
+
+def page_limit(args):
+    # Rows needed to answer a forward page and tell whether another follows it.
+    return get_offset_with_default(args.get('after'), -1) + 1 + args['first'] + 1
+
+
+class RelatedObjectField(Field):
+    """ A foreign key field resolved through an ObjectLoader. """
+
+    def __init__(self, _type, model_field, *args, **kwargs):
+        super().__init__(_type, *args, **kwargs)
+        self.model_field = model_field
+
+    def get_resolver(self, parent_resolver):
+        if self.resolver or not is_default_resolver(parent_resolver):
+            return super().get_resolver(parent_resolver)
+        return self.load
+
+    def load(self, root, info, **args):
+        if self.model_field.is_cached(root):
+            return getattr(root, self.model_field.name)
+        key = getattr(root, self.model_field.attname)
+        if key is None:
+            return None
+        model = self.model_field.related_model
+        return get_loader(info, model, partial(ObjectLoader, model)).load(key)
+
+
+class RelatedConnectionMixin:
+    """ Resolves a reverse foreign key connection through a RelatedLoader. """
+
+    def __init__(self, _type, model_field, *args, **kwargs):
+        super().__init__(_type, *args, **kwargs)
+        self.model_field = model_field
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, *extra, **kwargs):
+        # Pages built by the loader are final; everything else is filtered as usual.
+        if Promise.is_thenable(iterable):
+            return iterable
+        return super().resolve_queryset(connection, iterable, info, args, *extra, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        if is_default_resolver(parent_resolver):
+            parent_resolver = partial(self.load, parent_resolver)
+        return super().get_resolver(parent_resolver)
+
+    def load(self, parent_resolver, root, info, **args):
+        # Filtered pages, and pages counted back from the end, are sliced from the queryset.
+        if set(args) & set(getattr(self, 'filtering_args', ())) or args.get('first') is None:
+            return parent_resolver(root, info, **args)
+        prefetched = getattr(root, '_prefetched_objects_cache', {}).get(self.model_field.remote_field.get_cache_name())
+        if prefetched is not None:
+            return Promise.resolve(list(prefetched))
+        limit = page_limit(args)
+        loader = get_loader(info, (self.model_field, limit), partial(RelatedLoader, self.model_field, limit))
+        return loader.load(root.pk).then(lambda rows: Page(rows, partial(self.count, root.pk)))
+
+    def count(self, key, info, exact):
+        # A limited page holds only part of the children, so count them separately.
+        return get_loader(info, ('count', self.model_field), partial(CountLoader, self.model_field)).load(key)
+
+
+class RelatedConnectionField(RelatedConnectionMixin, UncountedMixin, DjangoConnectionField):
+    pass
+
+
+class RelatedFilterConnectionField(RelatedConnectionMixin, UncountedMixin, DjangoFilterConnectionField):
+    pass
+
+
+@convert_django_field.register(models.ForeignKey)
+def convert_foreign_key(field, registry=None):
+    model = field.related_model
+
+    def dynamic_type():
+        _type = registry.get_type_for_model(model)
+        if not _type:
+            return
+        return RelatedObjectField(_type, field, description=field.help_text, required=not field.null)
+
+    return Dynamic(dynamic_type)
+
+
+@convert_django_field.register(models.ManyToOneRel)
+def convert_reverse_foreign_key(field, registry=None):
+    model = field.related_model
+
+    def dynamic_type():
+        _type = registry.get_type_for_model(model)
+        if not _type:
+            return
+        if _type._meta.connection:
+            if _type._meta.filter_fields or _type._meta.filterset_class:
+                return RelatedFilterConnectionField(_type, field.field, required=True,
+                                                    description=field.field.help_text)
+            return RelatedConnectionField(_type, field.field, required=True, description=field.field.help_text)
+        return DjangoListField(_type, required=True, description=field.field.help_text)
+
+    return Dynamic(dynamic_type)
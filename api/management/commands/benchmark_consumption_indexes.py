@@ -0,0 +1,122 @@
+""" Compare query plans for consumptionRead with and without the consumption indexes. """
+import datetime
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Min
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import to_global_id
+
+from api.models import Meter, Consumption
+
+QUERY = """
+    query ConsumptionRead($meter: ID!, $range: String!, $first: Int!){
+        consumptionRead(meter: $meter, readTime_Range: $range, first: $first){
+            edges{
+                node{
+                    id
+                    readTime
+                    reading
+                }
+            }
+        }
+    }
+"""
+
+# Restores the indexing from 0001_initial: only the primary key and the meter foreign key index.
+BASELINE_SQL = [
+    'ALTER TABLE api_consumption DROP CONSTRAINT consumption_meter_read_time_uniq',
+    'DROP INDEX consumption_read_time_brin',
+    'CREATE INDEX api_consumption_meter_id_29d23808 ON api_consumption (meter_id)',
+]
+
+
+class SchemaContext:
+    # Minimal request stand-in so permission checks pass during the benchmark.
+    def __init__(self):
+        self.user = get_user_model()(is_active=True, is_superuser=True)
+        self.META = {}
+
+
+class Command(BaseCommand):
+    help = """Show planner cost of the consumptionRead(meter:, readTime_Range:) query before
+    and after the consumption indexes. Index changes are rolled back."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meter', help='Meter serial. Defaults to the meter with the most reads.')
+        parser.add_argument('--days', type=int, default=7, help='Length of the read_time range.')
+        parser.add_argument('--first', type=int, default=100, help='Page size requested.')
+        parser.add_argument('--json', action='store_true', help='Write machine readable results.')
+
+    def handle(self, *args, **options):
+        from water_graph.schema import schema
+
+        meters = Meter.objects.annotate(reads=Count('consumption')).order_by('-reads')
+        if options['meter']:
+            meters = meters.filter(meter_serial=options['meter'])
+        meter = meters.first()
+        if meter is None or not meter.reads:
+            raise CommandError('No meter with consumption records found.')
+
+        start = Consumption.objects.filter(meter=meter).aggregate(start=Min('read_time'))['start']
+        end = start + datetime.timedelta(days=options['days'])
+        variables = {
+            'meter': to_global_id('MeterTy', meter.pk),
+            'range': '{},{}'.format(start.isoformat(), end.isoformat()),
+            'first': options['first'],
+        }
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_consumption')
+
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute(QUERY, variables=variables, context_value=SchemaContext())
+        if result.errors:
+            raise CommandError('consumptionRead failed: {}'.format(result.errors))
+        statements = [q['sql'] for q in captured.captured_queries if 'api_consumption' in q['sql']]
+
+        after = [self.explain(sql) for sql in statements]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for sql in BASELINE_SQL:
+                    cursor.execute(sql)
+            before = [self.explain(sql) for sql in statements]
+            transaction.set_rollback(True)
+
+        results = {
+            'meter': meter.meter_serial,
+            'range': variables['range'],
+            'statements': [
+                {'sql': sql, 'before': b, 'after': a}
+                for sql, b, a in zip(statements, before, after)
+            ],
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write('consumptionRead for meter {} over {}'.format(meter.meter_serial, variables['range']))
+        for entry in results['statements']:
+            self.stdout.write('')
+            self.stdout.write(entry['sql'])
+            for label in ('before', 'after'):
+                plan = entry[label]
+                self.stdout.write('  {:<6} cost {:>10.2f}  {}'.format(label, plan['cost'], plan['nodes']))
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0][0]['Plan']
+        return {'cost': plan['Total Cost'], 'nodes': ' > '.join(self.node_names(plan))}
+
+    def node_names(self, plan):
+        name = plan['Node Type']
+        if 'Index Name' in plan:
+            name = '{} using {}'.format(name, plan['Index Name'])
+        names = [name]
+        for child in plan.get('Plans', []):
+            names.extend(self.node_names(child))
+        return names
@@ -0,0 +1,88 @@
+""" Time representative GraphQL operations and write the results as JSON. """
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+from .generate_fleet import add_fleet_arguments, fleet_from_options
+
+
+class Command(BaseCommand):
+    help = """Time paged reads, filtered reads, mutations, bulk ingestion and aggregations through
+    the GraphQL view. With --scale or fleet options a synthetic fleet is generated first unless one
+    with the same seed exists. Results are written as JSON for comparison across commits."""
+
+    def add_arguments(self, parser):
+        add_fleet_arguments(parser)
+        parser.add_argument('--existing-data', action='store_true',
+                            help='Benchmark the data already loaded instead of a synthetic fleet.')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed runs of each operation.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed runs before the timed ones.')
+        parser.add_argument('--bulk-size', type=int, default=500, help='Reads per consumptionBulkCreate.')
+        parser.add_argument('--operation', action='append', dest='operations', metavar='NAME',
+                            choices=[operation.name for operation in benchmarks.OPERATIONS],
+                            help='Only run this operation. May be repeated.')
+        parser.add_argument('--group', action='append', dest='groups', choices=benchmarks.GROUPS,
+                            help='Only run operations of this group. May be repeated.')
+        parser.add_argument('--output', help='Results file. Defaults to benchmarks/<commit>.json.')
+        parser.add_argument('--compare', metavar='PATH', help='Earlier results to report changes against.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+        from water_graph.schema import schema
+
+        prefix = ''
+        scale = None
+        if not options['existing_data']:
+            fleet = fleet_from_options(options)
+            prefix = fleet.prefix
+            scale = {'customers': fleet.customers, 'meters': fleet.meters, 'years': fleet.years,
+                     'cadence': fleet.cadence, 'seed': fleet.seed, 'start': fleet.start.isoformat()}
+            if not fleet.exists():
+                self.stdout.write('Generating fleet {}...'.format(prefix))
+                fleet.generate(stdout=self.stdout)
+
+        try:
+            sample = benchmarks.Sample(prefix, bulk_size=options['bulk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        operations = [operation for operation in benchmarks.OPERATIONS
+                      if (not options['operations'] or operation.name in options['operations'])
+                      and (not options['groups'] or operation.group in options['groups'])]
+        results = {
+            'environment': benchmarks.environment(),
+            'fleet': scale,
+            'data': benchmarks.data_scale(),
+            'iterations': options['iterations'],
+            'operations': {},
+        }
+        with benchmarks.Runner(schema, iterations=options['iterations'], warmup=options['warmup']) as runner:
+            for operation in operations:
+                result = results['operations'][operation.name] = runner.run(operation, sample)
+                seconds = result['seconds']
+                self.stdout.write('{:<26} median {:>9.2f} ms  p95 {:>9.2f} ms  {:>4} queries'.format(
+                    operation.name, seconds['median'] * 1000, seconds['p95'] * 1000, result['queries']))
+                for error in result['errors']:
+                    self.stderr.write('  {}'.format(error))
+
+        path = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', '{}.json'.format((results['environment']['commit'] or 'results')[:12]))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS('Wrote {}.'.format(path)))
+
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    before = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError('Cannot read {}: {}'.format(options['compare'], e))
+            self.stdout.write('Compared with {}:'.format(before.get('environment', {}).get('commit')))
+            for name, old, new, change in benchmarks.compare(before, results):
+                self.stdout.write('{:<26} {:>9.2f} ms -> {:>9.2f} ms  {}'.format(
+                    name, old * 1000, new * 1000, '{:+.1%}'.format(change) if change is not None else ''))
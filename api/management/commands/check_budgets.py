@@ -0,0 +1,61 @@
+""" Check GraphQL operations against their SQL and latency budgets and write a report. """
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks, budgets
+
+
+class Command(BaseCommand):
+    help = """Run every benchmarked operation against the reference fleet, generating it if needed,
+    compare statements, rows and p95 with each operation's budget and write a JSON report."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed runs of each operation.')
+        parser.add_argument('--report', help='Report file. Defaults to benchmarks/budgets-<commit>.json.')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Record the captured SQL as the baseline failures are diffed against.')
+
+    def handle(self, *args, **options):
+        from water_graph.schema import schema
+
+        fleet = budgets.reference_fleet()
+        if not fleet.exists():
+            self.stdout.write('Generating the reference fleet...')
+            fleet.generate(stdout=self.stdout)
+        try:
+            sample = benchmarks.Sample(fleet.prefix)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        baseline = budgets.load_baseline()
+        measurements = {}
+        failures = []
+        with benchmarks.Runner(schema, iterations=options['iterations'], warmup=2) as runner:
+            for operation in benchmarks.OPERATIONS:
+                measurement = measurements[operation.name] = budgets.measure(runner, operation, sample)
+                problems = budgets.check(operation.name, measurement, baseline)
+                measurement['status'] = 'over' if problems else 'ok'
+                failures.extend(problems)
+                budget = measurement['budget'] or {'statements': '-', 'rows': '-', 'p95': float('nan')}
+                self.stdout.write('{:<26} {:>4}/{:<4} statements {:>6}/{:<6} rows {:>8.1f}/{:<8.1f} ms  {}'.format(
+                    operation.name, measurement['statements'], budget['statements'], measurement['rows'],
+                    budget['rows'], measurement['p95'] * 1000, budget['p95'] * 1000, measurement['status']))
+
+        environment = benchmarks.environment()
+        path = options['report'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'budgets-{}.json'.format((environment['commit'] or 'report')[:12]))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'environment': environment, 'fleet': budgets.REFERENCE_FLEET,
+                       'operations': measurements, 'failures': failures}, f, indent=2, sort_keys=True)
+        self.stdout.write('Wrote {}.'.format(path))
+
+        if options['update_baseline']:
+            budgets.write_baseline(measurements)
+            self.stdout.write('Updated {}.'.format(budgets.BASELINE))
+        if failures:
+            raise CommandError('Budgets exceeded:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All {} operations are within budget.'.format(len(measurements))))
@@ -0,0 +1,36 @@
+""" Create upcoming and expire old monthly partitions of api_consumption. """
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import partitions
+
+
+class Command(BaseCommand):
+    help = """Create monthly api_consumption partitions ahead of time and detach or drop
+    partitions older than the retention window."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='Months after the current one to create partitions for.')
+        parser.add_argument('--retain', type=int, default=None,
+                            help='Months of history to keep attached. Older partitions are detached.')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop expired partitions instead of leaving them detached.')
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError('{} is not a partitioned table; run migrations first.'.format(
+                partitions.parent_table()))
+
+        this_month = partitions.month_start(timezone.now())
+
+        for name in partitions.create_partitions(this_month, options['ahead'] + 1):
+            self.stdout.write('Created partition {}.'.format(name))
+
+        if options['retain'] is not None:
+            cutoff = partitions.add_months(this_month, -options['retain'])
+            for name in partitions.expire_partitions(cutoff, drop=options['drop']):
+                self.stdout.write('{} partition {}.'.format('Dropped' if options['drop'] else 'Detached', name))
+
+        self.stdout.write(self.style.SUCCESS('{} monthly partitions attached.'.format(
+            len(partitions.list_partitions()))))
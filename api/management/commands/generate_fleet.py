@@ -0,0 +1,68 @@
+""" Generate a deterministic synthetic fleet with years of meter reads. """
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.dateparse import parse_date
+
+from api.synthetic import CADENCES, SCALES, Fleet
+
+
+def add_fleet_arguments(parser):
+    parser.add_argument('--scale', choices=sorted(SCALES),
+                        help='Preset fleet size; --customers, --meters, --years and --cadence override it.')
+    parser.add_argument('--customers', type=int, help='Number of customers (default 100).')
+    parser.add_argument('--meters', type=int, help='Number of meters, at least one per customer (default 120).')
+    parser.add_argument('--years', type=int, help='Years of reads per meter (default 1).')
+    parser.add_argument('--cadence', choices=['mixed'] + sorted(CADENCES),
+                        help='Read cadence of every meter, or mixed (default).')
+    parser.add_argument('--start', default='2019-01-01', help='Date of the first reads.')
+    parser.add_argument('--seed', type=int, default=0, help='Fleets with the same seed and size are identical.')
+    parser.add_argument('--gap-rate', type=float, default=0.002,
+                        help='Chance per meter and day that the meter stops reporting for up to two weeks.')
+    parser.add_argument('--rollover-rate', type=float, default=0.05,
+                        help='Share of meters whose register rolls over early in their history.')
+
+
+def fleet_from_options(options):
+    sizes = dict(SCALES.get(options['scale']) or {'customers': 100, 'meters': 120, 'years': 1, 'cadence': 'mixed'})
+    for name in sizes:
+        if options[name] is not None:
+            sizes[name] = options[name]
+    if options['customers'] is not None and options['meters'] is None:
+        sizes['meters'] = max(sizes['meters'], sizes['customers'])
+    start = parse_date(options['start'])
+    if start is None:
+        raise CommandError('--start must be a date, e.g. 2019-01-01.')
+    try:
+        return Fleet(seed=options['seed'], start=start, gap_rate=options['gap_rate'],
+                     rollover_rate=options['rollover_rate'], **sizes)
+    except ValueError as e:
+        raise CommandError(str(e))
+
+
+class Command(BaseCommand):
+    help = """Create customers, meters across vendor models and their read history, all derived
+    from --seed. Reads are loaded with COPY and the usage rollups rebuilt."""
+
+    def add_arguments(self, parser):
+        add_fleet_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=50, help='Meters loaded per transaction.')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete a fleet already generated with this seed first.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('generate_fleet requires a PostgreSQL database.')
+        fleet = fleet_from_options(options)
+        if fleet.exists():
+            if not options['replace']:
+                raise CommandError('A fleet with seed {} exists. Use --replace to generate it again.'.format(
+                    fleet.seed))
+            fleet.delete()
+
+        started = time.monotonic()
+        loaded = fleet.generate(batch_size=options['batch_size'], stdout=self.stdout)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS('Generated {} customers, {} meters and {} reads in {:.1f}s.'.format(
+            fleet.customers, fleet.meters, loaded, elapsed)))
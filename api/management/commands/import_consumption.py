@@ -0,0 +1,227 @@
+""" Stream meter history files into api_consumption with PostgreSQL COPY. """
+import csv
+import gzip
+import io
+import itertools
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import response_cache, rollups
+from api.ingest import MEASURE_CODES
+from api.models import Consumption, DailyUsage, Meter, MonthlyUsage
+
+COLUMNS = ('meter_serial', 'read_time', 'reading', 'unit_of_measure')
+
+
+class CopySource(io.TextIOBase):
+    """ File-like adapter that feeds COPY FROM STDIN from an iterator of lines.
+
+    Only the line currently being read is held in memory, so a chunk of any
+    size is streamed to the server without being buffered first.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._pending = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._pending += line
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def readline(self, size=-1):
+        if not self._pending:
+            self._pending = next(self._lines, '')
+        return self.read(len(self._pending))
+
+
+def open_source(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_records(handle, fmt):
+    # Yield dicts with COLUMNS keys from a CSV (with header) or NDJSON stream.
+    if fmt == 'csv':
+        for record in csv.DictReader(handle):
+            yield record
+    else:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = """Bulk load consumption history from CSV or NDJSON files using COPY FROM STDIN.
+    Each record needs meter_serial, read_time, reading and unit_of_measure."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import; .gz files are decompressed, - reads stdin.')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                            help='Input format. Detected from the file extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Records committed per transaction.')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Number of records to skip, e.g. the last committed offset of a failed run.')
+        parser.add_argument('--skip-unknown', action='store_true',
+                            help='Skip records for unknown meters instead of aborting.')
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help='Do not maintain usage rollups while loading. '
+                                 'Run rebuild_usage_rollups afterwards.')
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help='Skip reads already stored for the same meter and read time. '
+                                 'Records are staged in a temporary table, which is slower.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('import_consumption requires a PostgreSQL database.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        # Resolve serials once up front so each record is a dict lookup.
+        meters = dict(Meter.objects.values_list('meter_serial', 'pk').iterator())
+        self.stdout.write('Loaded {} meters.'.format(len(meters)))
+
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        handle = open_source(path)
+
+        offset = options['offset']
+        self.skipped = 0
+        started = time.monotonic()
+        imported = 0
+
+        try:
+            records = itertools.islice(read_records(handle, fmt), offset, None)
+            while True:
+                chunk = itertools.islice(records, options['chunk_size'])
+                self.consumed = 0
+                self.written = 0
+                self.error = None
+                self.changed = None if options['skip_rollups'] else {}
+                lines = self.copy_lines(chunk, meters, offset, options['skip_unknown'])
+                try:
+                    with transaction.atomic():
+                        with connection.cursor() as cursor:
+                            if options['skip_duplicates']:
+                                self.copy_staged(cursor, lines)
+                            else:
+                                cursor.copy_expert(self.copy_sql(), CopySource(lines))
+                        if self.changed:
+                            rollups.refresh_ranges(self.changed)
+                except Exception as e:
+                    # Errors raised while producing lines surface wrapped by psycopg2.
+                    if self.error is not None:
+                        raise self.error
+                    raise CommandError('Import failed after offset {}: {}. Rerun with --offset {} to resume.'
+                                       .format(offset, e, offset))
+                if not self.consumed:
+                    break
+
+                offset += self.consumed
+                imported += self.consumed
+                elapsed = time.monotonic() - started
+                self.stdout.write('Committed offset {} ({:.0f} rows/sec).'.format(
+                    offset, imported / elapsed if elapsed else 0))
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+            response_cache.invalidate_models(Consumption, DailyUsage, MonthlyUsage)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS('Imported {} records ({} skipped) in {:.1f}s, {:.0f} rows/sec.'.format(
+            imported - self.skipped, self.skipped, elapsed, imported / elapsed if elapsed else 0)))
+
+    def copy_sql(self, table=None):
+        table = connection.ops.quote_name(table or Consumption._meta.db_table)
+        return 'COPY {} (meter_id, read_time, reading, unit_of_measure) FROM STDIN WITH (FORMAT csv)'.format(table)
+
+    def copy_staged(self, cursor, lines):
+        # COPY has no conflict handling, so stage the chunk and merge it.
+        cursor.execute("""
+            CREATE TEMPORARY TABLE consumption_import (
+                meter_id integer, read_time timestamp with time zone,
+                reading bigint, unit_of_measure varchar(1)
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(self.copy_sql('consumption_import'), CopySource(lines))
+        cursor.execute("""
+            INSERT INTO {} (meter_id, read_time, reading, unit_of_measure)
+            SELECT meter_id, read_time, reading, unit_of_measure FROM consumption_import
+            ON CONFLICT (meter_id, read_time) DO NOTHING
+        """.format(connection.ops.quote_name(Consumption._meta.db_table)))
+        self.skipped += self.written - cursor.rowcount
+        cursor.execute('DROP TABLE consumption_import')
+
+    def track(self, meter_id, read_time, position):
+        # Widen the meter's rollup window; kept per meter so memory stays bounded.
+        parsed = parse_datetime(read_time) if isinstance(read_time, str) else None
+        if parsed is None:
+            self.error = CommandError('Record {} has an unparseable read_time {}.'.format(position, read_time))
+            raise self.error
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        rollups.merge_range(self.changed, meter_id, parsed)
+
+    def copy_lines(self, records, meters, offset, skip_unknown):
+        # Translate records to COPY csv lines, counting everything consumed.
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for record in records:
+            position = offset + self.consumed
+            self.consumed += 1
+            try:
+                serial, read_time, reading, unit = (record[c] for c in COLUMNS)
+            except KeyError as e:
+                self.error = CommandError('Record {} is missing {}. Rerun with --offset {} to resume.'
+                                          .format(position, e, offset))
+                raise self.error
+
+            meter_id = meters.get(serial)
+            if meter_id is None:
+                if skip_unknown:
+                    self.skipped += 1
+                    continue
+                self.error = CommandError('Record {} references unknown meter {}. Rerun with --offset {} to resume.'
+                                          .format(position, serial, offset))
+                raise self.error
+            if unit not in MEASURE_CODES:
+                self.error = CommandError('Record {} has invalid unit of measure {}. Rerun with --offset {} to resume.'
+                                          .format(position, unit, offset))
+                raise self.error
+
+            writer.writerow((meter_id, read_time, reading, unit))
+            self.written += 1
+            if self.changed is not None:
+                self.track(meter_id, read_time, position)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
@@ -0,0 +1,33 @@
+""" Rebuild the daily and monthly usage rollups from Consumption. """
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import response_cache, rollups
+from api.models import DailyUsage, Meter, MonthlyUsage
+
+
+class Command(BaseCommand):
+    help = """Recompute DailyUsage and MonthlyUsage from consumption history, e.g. after a
+    backfill loaded with import_consumption --skip-rollups."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meter', action='append', dest='meters', metavar='SERIAL',
+                            help='Only rebuild this meter. May be repeated.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Meters recomputed per statement batch.')
+
+    def handle(self, *args, **options):
+        meter_ids = None
+        if options['meters']:
+            found = dict(Meter.objects.filter(meter_serial__in=options['meters']).values_list('meter_serial', 'pk'))
+            missing = set(options['meters']) - set(found)
+            if missing:
+                raise CommandError('Unknown meters: {}'.format(', '.join(sorted(missing))))
+            meter_ids = list(found.values())
+
+        started = time.monotonic()
+        count = rollups.rebuild(meter_ids, batch_size=options['batch_size'], stdout=self.stdout)
+        response_cache.invalidate_models(DailyUsage, MonthlyUsage)
+        self.stdout.write(self.style.SUCCESS('Rebuilt rollups for {} meters in {:.1f}s.'.format(
+            count, time.monotonic() - started)))
@@ -0,0 +1,43 @@
+""" Bill every customer for a period and write the bill lines as CSV. """
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.billing import bill_lines
+
+
+class Command(BaseCommand):
+    help = """Price usage for all customers over [start, end) and write one CSV row per
+    customer, meter and rate."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', help='First day of the billing period (YYYY-MM-DD).')
+        parser.add_argument('end', help='Day after the billing period ends (YYYY-MM-DD).')
+        parser.add_argument('--output', default='-', help='CSV file to write, - for stdout.')
+
+    def handle(self, *args, **options):
+        start, end = parse_date(options['start']), parse_date(options['end'])
+        if start is None or end is None or start >= end:
+            raise CommandError('start and end must be dates with start before end.')
+
+        started = time.monotonic()
+        lines = bill_lines(start, end)
+
+        handle = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+        try:
+            writer = csv.writer(handle)
+            writer.writerow(('customer_id', 'meter_id', 'rate_id', 'rate', 'unit',
+                             'first_day', 'last_day', 'usage', 'amount'))
+            writer.writerows(lines)
+        finally:
+            if handle is not sys.stdout:
+                handle.close()
+
+        unpriced = sum(1 for line in lines if line.amount is None)
+        if unpriced:
+            self.stderr.write('{} bill lines had no rate in effect.'.format(unpriced))
+        self.stderr.write(self.style.SUCCESS('Billed {} customers ({} lines) in {:.1f}s.'.format(
+            len(set(line.customer_id for line in lines)), len(lines), time.monotonic() - started)))
@@ -0,0 +1,483 @@
+""" GraphQL tracing and Prometheus metrics.
+
+``TracingMiddleware`` times field resolvers. Resolvers of root fields and
+fields with their own resolver go into the ``graphql_resolver_duration_seconds``
+histogram; fields read straight off their parent are not timed. The view
+wraps each operation in an ``OperationTrace``, which counts the SQL run on
+every connection and records the operation's duration, queries, SQL time and
+response size. The trace also keeps the ``SLOW_LOG_STATEMENTS`` slowest
+statements, with the rows each returned, for the slow operation log, and
+every statement when created with ``capture``, for the query budgets.
+
+``render`` returns the metrics in the Prometheus text format, served at
+``/metrics``. Each process keeps its own metrics. When ``METRICS_DIR`` is set,
+processes also write them there, at most every ``METRICS_FLUSH_SECONDS``, and
+``render`` adds up every process's file, so a scrape of any worker reports
+the whole server. Files are named by pid and a per-process id, so a process
+that reuses an exited one's pid does not overwrite its counts. A scrape folds
+the files of exited processes into ``retired.json``, so the directory does not
+grow with restarts and counts never drop. Processes are checked by pid, so
+``METRICS_DIR`` is shared only by processes of one host.
+
+The database pools' stats and those of the GraphQL document cache and
+persisted queries are sampled whenever the metrics are written or rendered. Their counters are kept after a process exits like the others;
+their gauges, such as the connections open, go with the process.
+
+A request carrying the ``GRAPHQL_TRACING_HEADER`` header gets Apollo tracing
+(https://github.com/apollographql/apollo-tracing) of every field under
+``extensions.tracing`` in its response.
+"""
+import bisect
+import datetime
+import fcntl
+import glob
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from promise import Promise
+
+from .documents import backend_stats
+from .loaders import is_default_resolver
+from .pooled.pool import pool_stats
+
+TIME_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """ A Prometheus histogram with labels. """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # Label values -> per-bucket counts (not cumulative), then sum.
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), list(counts)] for labels, counts in self.values.items()]
+
+    def render(self, values):
+        yield '# HELP {} {}'.format(self.name, self.documentation)
+        yield '# TYPE {} histogram'.format(self.name)
+        for labels, counts in sorted(values.items()):
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(self.name, label_text(pairs + [('le', bound)]), cumulative)
+            yield '{}_sum{} {}'.format(self.name, label_text(pairs), counts[-1])
+            yield '{}_count{} {}'.format(self.name, label_text(pairs), cumulative)
+
+
+class Counter:
+    """ A Prometheus counter with labels. """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), [count]] for labels, count in self.values.items()]
+
+    def render(self, values):
+        yield '# HELP {} {}'.format(self.name, self.documentation)
+        yield '# TYPE {} counter'.format(self.name)
+        for labels, (count,) in sorted(values.items()):
+            yield '{}{} {}'.format(self.name, label_text(zip(self.labelnames, labels)), count)
+
+
+class Sampled:
+    """ A Prometheus gauge or counter whose values are read from ``sample()`` when metrics are snapshot. """
+
+    def __init__(self, name, documentation, labelnames, sample, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.sample = sample
+        self.kind = kind
+
+    def snapshot(self):
+        return [[list(labels), [value]] for labels, value in self.sample().items()]
+
+    def render(self, values):
+        yield '# HELP {} {}'.format(self.name, self.documentation)
+        yield '# TYPE {} {}'.format(self.name, self.kind)
+        for labels, (value,) in sorted(values.items()):
+            yield '{}{} {}'.format(self.name, label_text(zip(self.labelnames, labels)), value)
+
+
+def label_text(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+RESOLVER_DURATION = Histogram('graphql_resolver_duration_seconds', 'Time spent resolving a field.', ['field'])
+OPERATION_DURATION = Histogram('graphql_operation_duration_seconds', 'Time spent on a GraphQL operation.',
+                               ['operation_type'])
+OPERATION_QUERIES = Histogram('graphql_operation_sql_queries', 'SQL queries run by a GraphQL operation.',
+                              ['operation_type'], COUNT_BUCKETS)
+OPERATION_SQL_DURATION = Histogram('graphql_operation_sql_duration_seconds',
+                                   'Time a GraphQL operation spent running SQL.', ['operation_type'])
+RESPONSE_SIZE = Histogram('graphql_response_size_bytes', 'Size of GraphQL response bodies.', ['operation_type'],
+                          SIZE_BUCKETS)
+OPERATION_ERRORS = Counter('graphql_operation_errors_total', 'GraphQL operations answered with errors.',
+                           ['operation_type'])
+
+
+
+def pool_sample(key):
+    return lambda: {(pool,): stats[key] for pool, stats in pool_stats().items()}
+
+
+def pool_metric(name, documentation, key, kind='gauge'):
+    return Sampled(name, documentation, ['pool'], pool_sample(key), kind)
+
+
+POOL_METRICS = (
+    pool_metric('database_pool_size', 'Connections a database pool keeps open.', 'size'),
+    pool_metric('database_pool_open_connections', 'Connections open in a database pool.', 'open'),
+    pool_metric('database_pool_idle_connections', 'Idle connections in a database pool.', 'idle'),
+    pool_metric('database_pool_checked_out_connections', 'Connections checked out of a database pool.',
+                'checked_out'),
+    pool_metric('database_pool_checkouts_total', 'Connections checked out of a database pool.', 'checkouts',
+                'counter'),
+    pool_metric('database_pool_connects_total', 'Connections a database pool opened.', 'connects', 'counter'),
+    pool_metric('database_pool_waits_total', 'Checkouts that waited for a connection.', 'waits', 'counter'),
+    pool_metric('database_pool_wait_seconds_total', 'Time checkouts spent waiting for a connection.', 'wait_time',
+                'counter'),
+    pool_metric('database_pool_timeouts_total', 'Checkouts that gave up waiting for a connection.', 'timeouts',
+                'counter'),
+    pool_metric('database_pool_recycled_total', 'Idle connections closed as too old to reuse.', 'recycled',
+                'counter'),
+    pool_metric('database_pool_ping_failures_total', 'Idle connections found dead when checked out.',
+                'ping_failures', 'counter'),
+)
+
+
+def document_metric(name, documentation, key, kind='gauge'):
+    def sample():
+        stats = backend_stats()
+        return {(): stats[key]} if stats else {}
+    return Sampled(name, documentation, [], sample, kind)
+
+
+DOCUMENT_METRICS = (
+    document_metric('graphql_document_cache_size', 'Documents in the GraphQL document cache.', 'size'),
+    document_metric('graphql_document_cache_max_size', 'Documents the GraphQL document cache can hold.', 'maxsize'),
+    document_metric('graphql_document_cache_hits_total', 'Documents found in the GraphQL document cache.', 'hits',
+                    'counter'),
+    document_metric('graphql_document_cache_misses_total', 'Documents parsed and validated for want of a cached one.',
+                    'misses', 'counter'),
+    document_metric('graphql_document_cache_evictions_total', 'Documents evicted from the GraphQL document cache.',
+                    'evictions', 'counter'),
+    document_metric('graphql_persisted_queries', 'Persisted queries loaded from the manifest.', 'persisted'),
+)
+
+METRICS = (RESOLVER_DURATION, OPERATION_DURATION, OPERATION_QUERIES, OPERATION_SQL_DURATION, RESPONSE_SIZE,
+           OPERATION_ERRORS) + POOL_METRICS + DOCUMENT_METRICS
+
+# Gauges describe a running process, so they are not kept for exited ones.
+GAUGES = {metric.name for metric in METRICS if getattr(metric, 'kind', None) == 'gauge'}
+
+RETIRED = 'retired.json'
+
+# One SQL statement run during an operation; ``params`` is None for executemany.
+Statement = namedtuple('Statement', 'database sql params rows duration')
+
+_flushed = 0.0
+_flush_lock = threading.Lock()
+_process = None
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def process_file():
+    """ Name of this process's metrics file: its pid and an id of its own, as pids are reused. """
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        _process = (pid, '{}-{}.json'.format(pid, uuid.uuid4().hex))
+    return _process[1]
+
+
+def flush(force=False):
+    """ Write this process's metrics to ``METRICS_DIR``, at most every ``METRICS_FLUSH_SECONDS``. """
+    global _flushed
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    with _flush_lock:
+        if not force and now - _flushed < settings.METRICS_FLUSH_SECONDS:
+            return
+        _flushed = now
+        path = os.path.join(settings.METRICS_DIR, process_file())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+
+def read(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def merge(snapshots):
+    """ Return metric name -> label values -> values, summed over ``snapshots``. """
+    totals = {metric.name: {} for metric in METRICS}
+    for process in snapshots:
+        for name, series in process.items():
+            if name not in totals:
+                continue
+            for labels, values in series:
+                labels = tuple(labels)
+                current = totals[name].get(labels)
+                totals[name][labels] = values if current is None else [a + b for a, b in zip(current, values)]
+    return totals
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def exited(names):
+    """ Return the process files in ``names`` whose process has exited or whose pid was reused. """
+    pids = {name: int(name.split('-', 1)[0]) for name in names}
+    newest = {}
+    for name in sorted(names, key=lambda name: os.path.getmtime(os.path.join(settings.METRICS_DIR, name))):
+        newest[pids[name]] = name
+    return [name for name, pid in pids.items() if newest[pid] != name or not is_running(pid)]
+
+
+def collect():
+    """ Return metric name -> label values -> values, summed over every process that wrote metrics. """
+    if not settings.METRICS_DIR:
+        return merge([snapshot()])
+
+    flush(force=True)
+    directory = settings.METRICS_DIR
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired = read(os.path.join(directory, RETIRED), {'metrics': {}, 'folded': []})
+        names = [os.path.basename(path) for path in glob.glob(os.path.join(directory, '*-*.json'))]
+        names = [name for name in names if name not in retired['folded']]
+        snapshots = {name: read(os.path.join(directory, name)) for name in names}
+        snapshots = {name: data for name, data in snapshots.items() if data is not None}
+
+        # Fold the files of exited processes into the retired totals, so the directory stays
+        # small and counts never drop. Folded names are recorded first, then the files removed.
+        stale = exited(list(snapshots))
+        if stale:
+            totals = merge([retired['metrics']] + [
+                {name: series for name, series in snapshots.pop(process).items() if name not in GAUGES}
+                for process in stale])
+            retired = {
+                'metrics': {name: [[list(labels), values] for labels, values in series.items()]
+                            for name, series in totals.items()},
+                'folded': [name for name in retired['folded'] if os.path.exists(os.path.join(directory, name))]
+                + stale,
+            }
+            path = os.path.join(directory, RETIRED)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(path + '.tmp', path)
+            for name in stale:
+                os.remove(os.path.join(directory, name))
+
+    return merge([retired['metrics']] + list(snapshots.values()))
+
+
+def render():
+    """ All metrics in the Prometheus text exposition format. """
+    totals = collect()
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(totals[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+def returned_rows(cursor):
+    # Only statements returning rows count; rowcount is -1 when it is unknown.
+    try:
+        return max(cursor.rowcount, 0) if cursor.description is not None else 0
+    except Exception:
+        return 0
+
+
+class OperationTrace:
+    """ Times one GraphQL operation and the SQL it runs; collects Apollo tracing when asked to. """
+
+    def __init__(self, tracing=False, capture=False):
+        self.operation_type = 'unknown'
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        # Set when a statement took SLOW_QUERY_SECONDS or longer.
+        self.slow = False
+        self.slowest_statements = []
+        self.order = itertools.count()
+        self.statements = [] if capture else None
+        self.resolvers = [] if tracing else None
+        self.phases = {}
+        self.errors = False
+
+    def __enter__(self):
+        self.started_at = datetime.datetime.utcnow()
+        self.started = time.perf_counter()
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self.time_sql))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+        self.duration = time.perf_counter() - self.started
+
+    def time_sql(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.sql_time += duration
+            statement = Statement(context['connection'].alias, sql, None if many else params,
+                                  returned_rows(context['cursor']), duration)
+            self.rows += statement.rows
+            self.keep(statement)
+            if self.statements is not None:
+                self.statements.append(statement)
+
+    def keep(self, statement):
+        if statement.duration >= settings.SLOW_QUERY_SECONDS:
+            self.slow = True
+        entry = (statement.duration, next(self.order), statement)
+        if len(self.slowest_statements) < settings.SLOW_LOG_STATEMENTS:
+            heapq.heappush(self.slowest_statements, entry)
+        elif statement.duration > self.slowest_statements[0][0]:
+            heapq.heapreplace(self.slowest_statements, entry)
+
+    def slowest(self):
+        """ The slowest statements kept, slowest first. """
+        return [statement for _, _, statement in sorted(self.slowest_statements, reverse=True)]
+
+    def offset(self, moment):
+        return int((moment - self.started) * 1e9)
+
+    def phase(self, name, started, finished):
+        self.phases[name] = {'startOffset': self.offset(started), 'duration': int((finished - started) * 1e9)}
+
+    def resolved(self, info, started, finished):
+        self.resolvers.append({
+            'path': list(info.path),
+            'parentType': str(info.parent_type),
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'startOffset': self.offset(started),
+            'duration': int((finished - started) * 1e9),
+        })
+
+    def record(self, response_size, errors):
+        self.errors = errors
+        labels = (self.operation_type,)
+        OPERATION_DURATION.observe(self.duration, *labels)
+        OPERATION_QUERIES.observe(self.queries, *labels)
+        OPERATION_SQL_DURATION.observe(self.sql_time, *labels)
+        RESPONSE_SIZE.observe(response_size, *labels)
+        if errors:
+            OPERATION_ERRORS.inc(*labels)
+        flush()
+
+    def apollo(self):
+        ended_at = self.started_at + datetime.timedelta(seconds=time.perf_counter() - self.started)
+        return {
+            'version': 1,
+            'startTime': self.started_at.isoformat() + 'Z',
+            'endTime': ended_at.isoformat() + 'Z',
+            'duration': int((time.perf_counter() - self.started) * 1e9),
+            **self.phases,
+            'execution': {'resolvers': self.resolvers},
+        }
+
+
+_timed_fields = {}
+
+
+def is_timed(info):
+    # Root fields and fields with their own resolver; default resolvers only read an attribute.
+    key = (info.parent_type.name, info.field_name)
+    timed = _timed_fields.get(key)
+    if timed is None:
+        field = info.parent_type.fields.get(info.field_name)
+        resolver = field and field.resolver
+        timed = _timed_fields[key] = field is not None and (
+            len(info.path) == 1 or not (resolver is None or is_default_resolver(resolver)))
+    return timed
+
+
+class TracingMiddleware:
+    """ Record resolver latency, and Apollo tracing for operations that asked for it. """
+
+    def resolve(self, next, root, info, **args):
+        trace = getattr(info.context, 'graphql_trace', None)
+        tracing = trace is not None and trace.resolvers is not None
+        if not tracing and not is_timed(info):
+            return next(root, info, **args)
+
+        started = time.perf_counter()
+
+        def done(value):
+            finished = time.perf_counter()
+            if is_timed(info):
+                RESOLVER_DURATION.observe(finished - started, '{}.{}'.format(info.parent_type.name, info.field_name))
+            if tracing:
+                trace.resolved(info, started, finished)
+            return value
+
+        result = next(root, info, **args)
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(done)
+        return done(result)
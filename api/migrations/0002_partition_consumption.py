@@ -0,0 +1,108 @@
+""" Convert api_consumption into a table range partitioned by read_time.
+
+Existing reads are copied into monthly partitions, and a default partition
+catches anything outside them. The Django model state is unchanged: the
+primary key becomes (id, read_time) because PostgreSQL requires the partition
+key in every unique constraint, and ids stay unique through the shared
+sequence. Future partitions are managed by ``manage.py consumption_partitions``.
+"""
+from django.db import migrations
+
+TABLE = 'api_consumption'
+HEAP = 'api_consumption_heap'
+SEQUENCE = 'api_consumption_id_seq'
+FK_NAME = 'api_consumption_meter_id_29d23808_fk_api_meter_id'
+INDEX_NAME = 'api_consumption_meter_id_29d23808'
+COLUMNS = 'id, read_time, reading, unit_of_measure, meter_id'
+
+
+def month_bounds(cursor):
+    # Return (suffix, start, end) for every month holding existing reads.
+    cursor.execute("""
+        SELECT to_char(m, 'YYYYMM'), m, m + interval '1 month'
+        FROM generate_series(
+            (SELECT date_trunc('month', min(read_time) AT TIME ZONE 'UTC') FROM {heap}),
+            (SELECT date_trunc('month', max(read_time) AT TIME ZONE 'UTC') FROM {heap}),
+            interval '1 month') AS m
+    """.format(heap=HEAP))
+    return cursor.fetchall()
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(TABLE, HEAP))
+        cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}_old'.format(HEAP, FK_NAME, FK_NAME))
+        cursor.execute('ALTER INDEX {} RENAME TO {}_old'.format(INDEX_NAME, INDEX_NAME))
+        cursor.execute('ALTER INDEX {0}_pkey RENAME TO {1}_pkey'.format(TABLE, HEAP))
+        cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(SEQUENCE))
+        cursor.execute("""
+            CREATE TABLE {table} (
+                id integer NOT NULL DEFAULT nextval('{sequence}'),
+                read_time timestamp with time zone NOT NULL,
+                reading bigint NOT NULL,
+                unit_of_measure varchar(1) NOT NULL,
+                meter_id integer NOT NULL,
+                CONSTRAINT {table}_pkey PRIMARY KEY (id, read_time)
+            ) PARTITION BY RANGE (read_time)
+        """.format(table=TABLE, sequence=SEQUENCE))
+        cursor.execute("""
+            ALTER TABLE {table} ADD CONSTRAINT {fk} FOREIGN KEY (meter_id)
+            REFERENCES api_meter (id) DEFERRABLE INITIALLY DEFERRED
+        """.format(table=TABLE, fk=FK_NAME))
+        cursor.execute('CREATE INDEX {} ON {} (meter_id)'.format(INDEX_NAME, TABLE))
+        cursor.execute('CREATE TABLE {0}_default PARTITION OF {0} DEFAULT'.format(TABLE))
+
+        for suffix, start, end in month_bounds(cursor):
+            cursor.execute("""
+                CREATE TABLE {table}_p{suffix} PARTITION OF {table}
+                FOR VALUES FROM (%s) TO (%s)
+            """.format(table=TABLE, suffix=suffix), [start.isoformat() + '+00', end.isoformat() + '+00'])
+
+        cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {heap}'.format(
+            table=TABLE, columns=COLUMNS, heap=HEAP))
+        cursor.execute('DROP TABLE {}'.format(HEAP))
+        cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(SEQUENCE, TABLE))
+
+
+def unpartition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(TABLE, HEAP))
+        cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}_old'.format(HEAP, FK_NAME, FK_NAME))
+        cursor.execute('ALTER INDEX {} RENAME TO {}_old'.format(INDEX_NAME, INDEX_NAME))
+        cursor.execute('ALTER INDEX {0}_pkey RENAME TO {1}_pkey'.format(TABLE, HEAP))
+        cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(SEQUENCE))
+        cursor.execute("""
+            CREATE TABLE {table} (
+                id integer NOT NULL DEFAULT nextval('{sequence}') CONSTRAINT {table}_pkey PRIMARY KEY,
+                read_time timestamp with time zone NOT NULL,
+                reading bigint NOT NULL,
+                unit_of_measure varchar(1) NOT NULL,
+                meter_id integer NOT NULL
+            )
+        """.format(table=TABLE, sequence=SEQUENCE))
+        cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {heap}'.format(
+            table=TABLE, columns=COLUMNS, heap=HEAP))
+        cursor.execute("""
+            ALTER TABLE {table} ADD CONSTRAINT {fk} FOREIGN KEY (meter_id)
+            REFERENCES api_meter (id) DEFERRABLE INITIALLY DEFERRED
+        """.format(table=TABLE, fk=FK_NAME))
+        cursor.execute('CREATE INDEX {} ON {} (meter_id)'.format(INDEX_NAME, TABLE))
+        cursor.execute('DROP TABLE {} CASCADE'.format(HEAP))
+        cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(SEQUENCE, TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:46
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_partition_consumption'),
+    ]
+
+    operations = [
+        # Identical repeated reads would block the unique constraint; conflicting
+        # readings for the same meter and time are left for an operator to resolve.
+        migrations.RunSQL(
+            """
+            DELETE FROM api_consumption a USING api_consumption b
+            WHERE a.meter_id = b.meter_id AND a.read_time = b.read_time
+              AND a.reading = b.reading AND a.unit_of_measure = b.unit_of_measure
+              AND a.id > b.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='consumption',
+            name='meter',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Meter'),
+        ),
+        migrations.AddIndex(
+            model_name='consumption',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['read_time'], name='consumption_read_time_brin'),
+        ),
+        migrations.AddConstraint(
+            model_name='consumption',
+            constraint=models.UniqueConstraint(fields=('meter', 'read_time'), name='consumption_meter_read_time_uniq'),
+        ),
+    ]
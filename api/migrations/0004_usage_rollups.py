@@ -0,0 +1,86 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The rollups as of this migration, computed here rather than by api.rollups so that
+# later changes to that module cannot change what the migration does.
+BUILD_DAILY_SQL = """
+    INSERT INTO "api_dailyusage" (meter_id, day, unit_of_measure, usage, reads)
+    SELECT meter_id, (read_time AT TIME ZONE %s)::date, unit_of_measure,
+           SUM(CASE WHEN delta < 0 THEN reading ELSE delta END), COUNT(*)
+    FROM (
+        SELECT meter_id, read_time, reading, unit_of_measure,
+               reading - LAG(reading) OVER (PARTITION BY meter_id, unit_of_measure ORDER BY read_time) AS delta
+        FROM "api_consumption"
+    ) deltas
+    WHERE delta IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+
+BUILD_MONTHLY_SQL = """
+    INSERT INTO "api_monthlyusage" (meter_id, month, unit_of_measure, usage, reads)
+    SELECT meter_id, date_trunc('month', day)::date, unit_of_measure, SUM(usage), SUM(reads)
+    FROM "api_dailyusage"
+    GROUP BY 1, 2, 3
+"""
+
+
+def build_rollups(apps, schema_editor):
+    # Populate the rollups for reads loaded before they existed.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BUILD_DAILY_SQL, [settings.TIME_ZONE])
+        cursor.execute(BUILD_MONTHLY_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_consumption_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('unit_of_measure', models.CharField(choices=[('L', 'Liter'), ('G', 'Gallon')], max_length=1)),
+                ('usage', models.BigIntegerField()),
+                ('reads', models.IntegerField()),
+                ('meter', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Meter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('unit_of_measure', models.CharField(choices=[('L', 'Liter'), ('G', 'Gallon')], max_length=1)),
+                ('usage', models.BigIntegerField()),
+                ('reads', models.IntegerField()),
+                ('meter', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Meter')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlyusage',
+            index=models.Index(fields=['month'], name='monthlyusage_month_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyusage',
+            constraint=models.UniqueConstraint(fields=('meter', 'month', 'unit_of_measure'), name='monthlyusage_meter_month_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyusage',
+            index=models.Index(fields=['day'], name='dailyusage_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyusage',
+            constraint=models.UniqueConstraint(fields=('meter', 'day', 'unit_of_measure'), name='dailyusage_meter_day_uniq'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.0.7 on 2026-10-18 07:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowOperation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('operation_type', models.CharField(max_length=12)),
+                ('operation_name', models.TextField(blank=True)),
+                ('fields', models.TextField(blank=True)),
+                ('duration', models.FloatField()),
+                ('sql_count', models.IntegerField()),
+                ('sql_duration', models.FloatField()),
+                ('query', models.TextField()),
+                ('variables', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SlowStatement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database', models.CharField(max_length=100)),
+                ('duration', models.FloatField()),
+                ('sql', models.TextField()),
+                ('params', models.TextField(blank=True)),
+                ('explain', models.TextField(blank=True)),
+                ('operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='api.SlowOperation')),
+            ],
+            options={
+                'ordering': ['-duration'],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.utils import timezone
 
@@ -25,11 +26,21 @@ class Account_Asset_Link(models.Model):
     meter = models.ForeignKey(Meter, on_delete=models.CASCADE, null=False)
 
 class Consumption(models.Model):
+    class Meta:
+        # The unique (meter, read_time) index also serves per-meter time range scans,
+        # so the meter foreign key does not need an index of its own.
+        constraints = [
+            models.UniqueConstraint(fields=['meter', 'read_time'], name='consumption_meter_read_time_uniq'),
+        ]
+        indexes = [
+            BrinIndex(fields=['read_time'], name='consumption_read_time_brin'),
+        ]
+
     MEASURE = (
         ('L', 'Liter'),
         ('G', 'Gallon')
     )
-    meter = models.ForeignKey(Meter, on_delete=models.CASCADE)
+    meter = models.ForeignKey(Meter, on_delete=models.CASCADE, db_index=False)
     read_time = models.DateTimeField(null=False, blank=False)
     reading = models.BigIntegerField(null=False, blank=False)
     unit_of_measure = models.CharField(max_length=1, choices=MEASURE)
@@ -43,3 +54,71 @@ class Rate(models.Model):
     effective_start = models.DateField(null=False, blank=False)
     effective_end = models.DateField(null=True, blank=False,)
     unit_of_measure = models.CharField(max_length=1, choices=MEASURE)
+
+class DailyUsage(models.Model):
+    """ Water used by a meter on one day, maintained from Consumption deltas. """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['meter', 'day', 'unit_of_measure'], name='dailyusage_meter_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='dailyusage_day_idx'),
+        ]
+
+    MEASURE = (
+        ('L', 'Liter'),
+        ('G', 'Gallon')
+    )
+    meter = models.ForeignKey(Meter, on_delete=models.CASCADE, db_index=False)
+    day = models.DateField(null=False, blank=False)
+    unit_of_measure = models.CharField(max_length=1, choices=MEASURE)
+    usage = models.BigIntegerField(null=False, blank=False)
+    reads = models.IntegerField(null=False, blank=False)
+
+class MonthlyUsage(models.Model):
+    """ Water used by a meter in one month, maintained from DailyUsage. """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['meter', 'month', 'unit_of_measure'], name='monthlyusage_meter_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='monthlyusage_month_idx'),
+        ]
+
+    MEASURE = (
+        ('L', 'Liter'),
+        ('G', 'Gallon')
+    )
+    meter = models.ForeignKey(Meter, on_delete=models.CASCADE, db_index=False)
+    month = models.DateField(null=False, blank=False)
+    unit_of_measure = models.CharField(max_length=1, choices=MEASURE)
+    usage = models.BigIntegerField(null=False, blank=False)
+    reads = models.IntegerField(null=False, blank=False)
+
+class SlowOperation(models.Model):
+    """ A GraphQL operation that ran longer than SLOW_OPERATION_SECONDS or ran a slow statement. """
+    class Meta:
+        ordering = ['-created']
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    operation_type = models.CharField(max_length=12)
+    operation_name = models.TextField(blank=True)
+    # Root fields with the arguments they were given, e.g. customerRead(firstName_Icontains, first).
+    fields = models.TextField(blank=True)
+    duration = models.FloatField()
+    sql_count = models.IntegerField()
+    sql_duration = models.FloatField()
+    query = models.TextField()
+    variables = models.TextField(blank=True)
+
+class SlowStatement(models.Model):
+    """ One of the slowest SQL statements of a SlowOperation, with its plan when it was sampled. """
+    class Meta:
+        ordering = ['-duration']
+
+    operation = models.ForeignKey(SlowOperation, on_delete=models.CASCADE, related_name='statements')
+    database = models.CharField(max_length=100)
+    duration = models.FloatField()
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    explain = models.TextField(blank=True)
@@ -0,0 +1,113 @@
+""" Derives queryset joins and column projection from the GraphQL selection set.
+
+``optimize`` reads the ``edges { node { ... } }`` selection of a connection
+and returns its queryset with:
+
+- ``select_related`` for every selected forward foreign key, and
+- ``.only()`` limited to the selected columns at every level.
+
+Reverse connections are left to the loaders in ``api.loaders``, which fetch
+one page per parent: a prefetch would load every child, and Django cannot
+slice one. A level that selects a field not backed by a model column is
+fetched in full.
+"""
+from django.db.models import ForeignKey, ManyToOneRel
+from graphene.utils.str_converters import to_camel_case
+from graphene_django.registry import get_global_registry
+from graphql.language.ast import Field, FragmentSpread, InlineFragment
+
+
+class Plan:
+    """ Accumulates the queryset changes for one root queryset. """
+
+    def __init__(self):
+        self.only = []
+        self.select_related = []
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def selected_fields(selection_set, info):
+    # Yield the Field nodes of a selection set, expanding fragments.
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, Field):
+            yield selection
+        elif isinstance(selection, FragmentSpread):
+            yield from selected_fields(info.fragments[selection.name.value].selection_set, info)
+        elif isinstance(selection, InlineFragment):
+            yield from selected_fields(selection.selection_set, info)
+
+
+def node_fields(connection_asts, info):
+    """ Return the fields selected on ``edges { node }`` of the given connection nodes. """
+    fields = []
+    for connection in connection_asts:
+        for edges in selected_fields(connection.selection_set, info):
+            if edges.name.value != 'edges':
+                continue
+            for node in selected_fields(edges.selection_set, info):
+                if node.name.value == 'node':
+                    fields.extend(selected_fields(node.selection_set, info))
+    return fields
+
+
+def model_fields(model):
+    # Map GraphQL field names of the model's DjangoObjectType to model fields.
+    _type = get_global_registry().get_type_for_model(model)
+    if _type is None:
+        return {}
+    by_name = {}
+    for field in model._meta.get_fields():
+        name = field.get_accessor_name() if isinstance(field, ManyToOneRel) else field.name
+        by_name[name] = field
+    mapping = {}
+    for name, type_field in _type._meta.fields.items():
+        if name in by_name:
+            mapping[getattr(type_field, 'name', None) or to_camel_case(name)] = by_name[name]
+    return mapping
+
+
+def plan_level(model, fields, info, plan, prefix=''):
+    # Add the columns, joins and prefetches needed by ``fields`` of ``model``.
+    mapping = model_fields(model)
+    only = [prefix + model._meta.pk.name]
+    projectable = True
+
+    for field in fields:
+        name = field.name.value
+        if name == '__typename':
+            continue
+        model_field = mapping.get(name)
+        if model_field is None:
+            projectable = False
+        elif isinstance(model_field, ForeignKey):
+            path = prefix + model_field.name
+            only.append(path)
+            if path not in plan.select_related:
+                plan.select_related.append(path)
+            plan_level(model_field.related_model, list(selected_fields(field.selection_set, info)),
+                       info, plan, path + '__')
+        elif isinstance(model_field, ManyToOneRel):
+            continue
+        elif model_field.concrete:
+            only.append(prefix + model_field.name)
+        else:
+            projectable = False
+
+    if not projectable:
+        only = [prefix + f.name for f in model._meta.concrete_fields]
+    plan.only.extend(only)
+
+
+def optimize(queryset, info):
+    """ Return ``queryset`` joined and projected for the selection in ``info``. """
+    plan = Plan()
+    plan_level(queryset.model, node_fields(info.field_asts, info), info, plan)
+    return plan.apply(queryset)
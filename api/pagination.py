@@ -0,0 +1,302 @@
+""" Paging and counting for relay connections.
+
+graphene-django pages with ``OFFSET`` and counts the whole filtered queryset
+to do it. Two connection fields replace that:
+
+``OffsetConnectionField`` keeps offset cursors but slices one row past the
+page to tell whether another follows, so no ``COUNT(*)`` is run unless
+``last`` is given without an offset to count back from. Without ``first`` or
+``last``, a page holds the field's ``max_limit`` nodes.
+
+``KeysetConnectionField`` orders the queryset by a declared key ending in the
+primary key, and its cursors encode that key for the edge. ``after`` and
+``before`` become a row comparison on the key, and the first key column is
+also bounded on its own so an index leading with it, or with an
+equality-filtered column followed by it, is range scanned. A page therefore
+costs the same however deep it is. Ordering is stable because the key always
+ends in the primary key.
+
+``totalCount`` is a field of ``CountedConnection`` and is only computed when
+selected. By default it is an estimate: table statistics for unfiltered
+querysets and the planner's row estimate otherwise, replaced by an exact
+count when the estimate is below ``CONNECTION_EXACT_COUNT_THRESHOLD``.
+``totalCount(exact: true)`` always counts.
+"""
+import base64
+import json
+from functools import partial
+
+import graphene
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import BooleanField, Expression, F, QuerySet
+from graphene import relay
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql_relay.connection.arrayconnection import get_offset_with_default, offset_to_cursor
+from promise import Promise
+
+PREFIX = 'keyset:'
+
+STATISTICS_SQL = """
+    SELECT SUM(c.reltuples)::bigint, bool_and(c.reltuples >= 0)
+    FROM pg_class c
+    WHERE c.relkind = 'r'
+      AND (c.oid = %(table)s::regclass OR c.oid IN (SELECT relid FROM pg_partition_tree(%(table)s::regclass)))
+"""
+
+
+def estimate_count(queryset):
+    """ Return an estimated row count for ``queryset`` without scanning it, on the database it reads from. """
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(STATISTICS_SQL, {'table': queryset.model._meta.db_table})
+            rows, analyzed = cursor.fetchone()
+            if analyzed:
+                return rows
+        sql, params = queryset.order_by().values('pk').query.get_compiler(queryset.db).as_sql()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+
+def count(queryset, exact=False):
+    """ Count ``queryset``, estimating large results unless ``exact`` is set. """
+    if not exact:
+        estimate = estimate_count(queryset)
+        if estimate >= settings.CONNECTION_EXACT_COUNT_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
+class Page(list):
+    """ A list of nodes that knows how to count the full connection it was cut from. """
+
+    def __init__(self, rows, counter):
+        super().__init__(rows)
+        self.counter = counter
+
+
+class CountedConnection(relay.Connection):
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(
+        exact=graphene.Boolean(default_value=False, description="Count every row instead of estimating."),
+        description="Number of nodes in the connection. Estimated for large results unless exact is set.",
+    )
+
+    def resolve_total_count(self, info, exact):
+        counter = getattr(self, 'counter', None)
+        if counter is not None:
+            return counter(info, exact)
+        if isinstance(self.iterable, QuerySet):
+            return count(self.iterable, exact)
+        return len(self.iterable)
+
+
+class RowComparison(Expression):
+    """ ``(col1, col2, ...) <op> (%s, %s, ...)`` usable directly in ``filter()``. """
+    conditional = True
+
+    def __init__(self, columns, operator, values):
+        super().__init__(output_field=BooleanField())
+        self.columns = columns
+        self.operator = operator
+        self.values = values
+
+    def get_source_expressions(self):
+        return self.columns
+
+    def set_source_expressions(self, exprs):
+        self.columns = exprs
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        clone = self.copy()
+        clone.is_summary = summarize
+        clone.columns = [column.resolve_expression(query, allow_joins, reuse, summarize, for_save)
+                         for column in self.columns]
+        return clone
+
+    def as_sql(self, compiler, connection):
+        columns, params = [], []
+        for column in self.columns:
+            sql, column_params = compiler.compile(column)
+            columns.append(sql)
+            params.extend(column_params)
+        params.extend(column.output_field.get_db_prep_value(value, connection)
+                      for column, value in zip(self.columns, self.values))
+        placeholders = ', '.join(['%s'] * len(self.values))
+        return '({}) {} ({})'.format(', '.join(columns), self.operator, placeholders), params
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.b64encode((PREFIX + data).encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    try:
+        data = base64.b64decode(cursor.encode()).decode()
+        if not data.startswith(PREFIX):
+            raise ValueError
+        values = json.loads(data[len(PREFIX):])
+        if len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        raise Exception('Invalid cursor: {}'.format(cursor))
+
+
+def seek(queryset, key, fields, cursor, forward):
+    # Restrict queryset to rows strictly after (forward) or before the cursor.
+    values = decode_cursor(cursor, fields)
+    operator, bound = ('>', 'gte') if forward else ('<', 'lte')
+    return queryset.filter(
+        RowComparison([F(name) for name in key], operator, values),
+        **{'{}__{}'.format(key[0], bound): values[0]}
+    )
+
+
+def paginate(queryset, connection, args, key, max_limit):
+    """ Build one page of ``connection`` from ``queryset`` ordered by ``key``. """
+    model = queryset.model
+    fields = [model._meta.pk if name in ('pk', 'id') else model._meta.get_field(name) for name in key]
+    key = [field.attname for field in fields]
+
+    # Keep the key columns loaded when the queryset was projected with only().
+    loaded, deferred = queryset.query.deferred_loading
+    if loaded and not deferred:
+        queryset = queryset.only(*(set(loaded) | set(field.name for field in fields)))
+
+    first, last = args.get('first'), args.get('last')
+    after, before = args.get('after'), args.get('before')
+    if first is not None and first < 0 or last is not None and last < 0:
+        raise Exception('first and last must be non-negative.')
+    if first is None and last is None:
+        first = max_limit
+
+    full = queryset
+    if after:
+        queryset = seek(queryset, key, fields, after, forward=True)
+    if before:
+        queryset = seek(queryset, key, fields, before, forward=False)
+
+    if first is None and last is None:
+        rows, has_next, has_previous = list(queryset.order_by(*key)), False, bool(after)
+    elif first is not None:
+        rows = list(queryset.order_by(*key)[:first + 1])
+        has_next, rows = len(rows) > first, rows[:first]
+        has_previous = bool(after)
+        if last is not None and len(rows) > last:
+            rows, has_previous = rows[-last:], True
+    else:
+        rows = list(queryset.order_by(*['-' + name for name in key])[:last + 1])
+        has_previous, rows = len(rows) > last, rows[:last][::-1]
+        has_next = bool(before)
+
+    edges = [
+        connection.Edge(node=row, cursor=encode_cursor([getattr(row, name) for name in key]))
+        for row in rows
+    ]
+    page = connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous,
+            has_next_page=has_next,
+        ),
+    )
+    page.iterable = full
+    return page
+
+
+def offset_page(connection, args, queryset):
+    """ Build one offset-cursor page of ``connection`` without counting ``queryset``. """
+    start = get_offset_with_default(args.get('after'), -1) + 1
+    stop = get_offset_with_default(args.get('before'), None)
+    first = args.get('first')
+    if first is not None:
+        stop = start + first if stop is None else min(stop, start + first)
+
+    if stop is None:
+        rows, has_next = list(queryset[start:]), False
+    else:
+        rows = list(queryset[start:stop + 1]) if stop > start else []
+        has_next, rows = len(rows) > stop - start, rows[:max(stop - start, 0)]
+
+    edges = [connection.Edge(node=row, cursor=offset_to_cursor(start + i)) for i, row in enumerate(rows)]
+    return connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=start > 0,
+            has_next_page=has_next,
+        ),
+    )
+
+
+class UncountedMixin:
+    """ Resolves offset connections over querysets without ``COUNT(*)``, a page of at most ``max_limit`` nodes. """
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver, max_limit,
+                            enforce_first_or_last, root, info, **args):
+        # Without first or last, a page holds max_limit nodes, as a keyset page does.
+        if max_limit and args.get('first') is None and args.get('last') is None:
+            args['first'] = max_limit
+        return super().connection_resolver(resolver, connection, default_manager, queryset_resolver, max_limit,
+                                           enforce_first_or_last, root, info, **args)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable):
+        iterable = maybe_queryset(iterable)
+        if isinstance(iterable, QuerySet) and args.get('last') is None:
+            page = offset_page(connection, args, iterable)
+            page.iterable = iterable
+        else:
+            page = super().resolve_connection(connection, args, iterable)
+        page.counter = getattr(iterable, 'counter', None)
+        return page
+
+
+class OffsetConnectionField(UncountedMixin, DjangoFilterConnectionField):
+    """ A filter connection field with offset cursors that does not count its queryset. """
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """ A filter connection field paged by ``key`` instead of by offset.
+
+    ``key`` names model fields; the primary key is appended when it is not
+    already last so that the order is total.
+    """
+
+    def __init__(self, type, key=('pk',), *args, **kwargs):
+        key = tuple(key)
+        if key[-1] not in ('pk', 'id'):
+            key += ('pk',)
+        self.key = key
+        super().__init__(type, *args, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        return partial(self.resolve_page, parent_resolver)
+
+    def resolve_page(self, parent_resolver, root, info, **args):
+        for name in ('first', 'last'):
+            if self.max_limit and args.get(name) is not None:
+                assert args[name] <= self.max_limit, (
+                    "Requesting {} records on the `{}` connection exceeds the `{}` limit of {} records."
+                ).format(args[name], info.field_name, name, self.max_limit)
+
+        iterable = parent_resolver(root, info, **args)
+        if iterable is None:
+            iterable = self.get_manager()
+        queryset = self.get_queryset_resolver()(self.connection_type, iterable, info, args)
+        on_resolve = lambda qs: paginate(qs, self.connection_type, args, self.key, self.max_limit)
+
+        if Promise.is_thenable(queryset):
+            return Promise.resolve(queryset).then(on_resolve)
+        return on_resolve(queryset)
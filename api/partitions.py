@@ -0,0 +1,128 @@
+""" Monthly range partition maintenance for the Consumption table.
+
+``api_consumption`` is partitioned by ``read_time`` (see migration 0002). Each
+month lives in its own ``api_consumption_pYYYYMM`` table and reads outside any
+monthly partition land in ``api_consumption_default``. These helpers create
+partitions ahead of time and detach or drop expired ones, so retention is a
+catalog change rather than a DELETE.
+"""
+import datetime
+import re
+
+from django.db import connection, transaction
+
+from .models import Consumption
+
+PARTITION_NAME = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def parent_table():
+    return Consumption._meta.db_table
+
+
+def default_partition():
+    return '{}_default'.format(parent_table())
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def partition_name(month):
+    return '{}_p{:04d}{:02d}'.format(parent_table(), month.year, month.month)
+
+
+def is_partitioned():
+    """ True when api_consumption is a partitioned table on this database. """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", [parent_table()])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions():
+    """ Return a sorted list of ``(month, table_name)`` for attached monthly partitions. """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.oid = to_regclass(%s)
+        """, [parent_table()])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1,
+                                      tzinfo=datetime.timezone.utc)
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def create_partition(month):
+    """ Create the partition for the month containing ``month`` if it is missing.
+
+    Rows already sitting in the default partition for that month are moved
+    into the new partition before it is attached. Returns the table name when
+    a partition was created, otherwise None.
+    """
+    start = month_start(month)
+    end = add_months(start, 1)
+    name = partition_name(start)
+    if name in dict((n, m) for m, n in list_partitions()):
+        return None
+
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(
+            qn(name), qn(parent_table())))
+        cursor.execute("""
+            WITH moved AS (
+                DELETE FROM {default} WHERE read_time >= %s AND read_time < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """.format(default=qn(default_partition()), name=qn(name)), [start, end])
+        cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)'.format(
+            qn(parent_table()), qn(name)), [start, end])
+    return name
+
+
+def create_partitions(start, months):
+    """ Ensure partitions exist for ``months`` consecutive months from ``start``. """
+    created = []
+    first = month_start(start)
+    for offset in range(months):
+        name = create_partition(add_months(first, offset))
+        if name:
+            created.append(name)
+    return created
+
+
+def expire_partitions(before, drop=False):
+    """ Detach every monthly partition that ends on or before ``before``.
+
+    Detached tables are kept for archiving unless ``drop`` is set.
+    Returns the list of affected table names.
+    """
+    qn = connection.ops.quote_name
+    expired = []
+    for month, name in list_partitions():
+        if add_months(month, 1) > before:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(qn(parent_table()), qn(name)))
+            if drop:
+                cursor.execute('DROP TABLE {}'.format(qn(name)))
+        expired.append(name)
+    return expired
@@ -0,0 +1,45 @@
+""" PostgreSQL backend that takes its connections from a per-process pool.
+
+Configure it with ``ENGINE = 'api.pooled'`` and an optional ``POOL`` dict in
+the database settings (``SIZE``, ``OVERFLOW``, ``TIMEOUT``, ``RECYCLE``,
+``MAX_LIFETIME`` and ``PRE_PING``, see ``api.pooled.pool``). Django opens a
+connection per thread and closes it at the end of each request; with this
+backend closing returns it to the pool, so WSGI workers and the ASGI
+handler's threads alike reuse a bounded set of connections.
+"""
+from django.db.backends.postgresql import base, creation
+
+from .pool import dispose_pools, get_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would block DROP DATABASE.
+        dispose_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}))
+        connection = self.pool.checkout()
+        # As in the postgresql backend; a pooled connection is back in its session default by now.
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # Closed inside an atomic block, the wrapper keeps the connection until the block
+                # exits, so it must not be handed to another thread in the meantime.
+                self.pool.checkin(self.connection, reuse=not self.in_atomic_block)
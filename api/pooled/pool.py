@@ -0,0 +1,221 @@
+""" A bounded, thread-safe pool of psycopg2 connections.
+
+The pool keeps up to ``size`` connections open and lets ``overflow`` more be
+opened under load; those are closed again when returned while the pool is
+above ``size``. When every connection is checked out, callers wait up to
+``timeout`` seconds for one to be returned.
+
+Idle connections are handed out most recently used first. A connection idle
+for ``recycle`` seconds or older than ``max_lifetime`` seconds is closed
+instead of reused, and one idle for at least ``pre_ping`` seconds is tested
+with ``SELECT 1`` before it is handed out, so connections dropped by the
+server or a proxy are replaced without the caller seeing an error. Zero
+disables a limit; ``pre_ping = 0`` pings on every checkout.
+"""
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """ No connection became available within the pool timeout. """
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, size=5, overflow=10, timeout=30, recycle=0, max_lifetime=0, pre_ping=0):
+        self.connect = connect
+        self.size = size
+        self.overflow = overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.idle = deque()
+        self.opened_at = {}
+        self.available = threading.Condition(threading.Lock())
+        self.open = self.checked_out = 0
+        self.checkouts = self.connects = self.waits = self.timeouts = 0
+        self.recycled = self.ping_failures = 0
+        self.wait_time = 0.0
+
+    def expired(self, connection, last_used, now):
+        if connection.closed:
+            return True
+        if self.recycle and now - last_used >= self.recycle:
+            return True
+        return bool(self.max_lifetime) and now - self.opened_at[connection] >= self.max_lifetime
+
+    def discard(self, connection):
+        # Call with the lock held.
+        self.opened_at.pop(connection, None)
+        self.open -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def checkout(self):
+        """ Return a live connection, opening one if the pool has room. """
+        while True:
+            connection, last_used = self.reserve()
+            if connection is None:
+                return self.open_connection()
+            if time.monotonic() - last_used < self.pre_ping or self.ping(connection):
+                return connection
+            with self.available:
+                self.ping_failures += 1
+                self.checked_out -= 1
+                self.discard(connection)
+                self.available.notify()
+
+    def reserve(self):
+        # Take an idle connection, or room for a new one, waiting while neither is available.
+        started = time.monotonic()
+        waited = False
+        with self.available:
+            while True:
+                now = time.monotonic()
+                while self.idle:
+                    connection, last_used = self.idle.pop()
+                    if self.expired(connection, last_used, now):
+                        self.recycled += 1
+                        self.discard(connection)
+                        continue
+                    self.take(started, waited)
+                    return connection, last_used
+                if self.open < self.size + self.overflow:
+                    self.open += 1
+                    self.take(started, waited)
+                    return None, None
+
+                remaining = self.timeout - (now - started)
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += now - started
+                    raise PoolTimeout('No database connection available within {}s.'.format(self.timeout))
+                self.available.wait(remaining)
+
+    def take(self, started, waited):
+        self.checked_out += 1
+        self.checkouts += 1
+        if waited:
+            self.wait_time += time.monotonic() - started
+
+    def open_connection(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.available:
+                self.open -= 1
+                self.checked_out -= 1
+                self.available.notify()
+            raise
+        with self.available:
+            self.connects += 1
+            self.opened_at[connection] = time.monotonic()
+        return connection
+
+    def ping(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def checkin(self, connection, reuse=True):
+        """ Return a connection, rolling back any transaction left open on it; closed unless ``reuse``. """
+        reusable = reuse and not connection.closed
+        if reusable and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+        with self.available:
+            self.checked_out -= 1
+            if reusable and self.open <= self.size:
+                self.idle.append((connection, time.monotonic()))
+            else:
+                self.discard(connection)
+            self.available.notify()
+
+    def dispose(self):
+        """ Close every idle connection. """
+        with self.available:
+            while self.idle:
+                self.discard(self.idle.pop()[0])
+
+    def stats(self):
+        with self.available:
+            return {
+                'size': self.size,
+                'overflow': self.overflow,
+                'open': self.open,
+                'idle': len(self.idle),
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'ping_failures': self.ping_failures,
+            }
+
+
+_lock = threading.Lock()
+_pools = {}
+_pid = None
+
+
+def get_pool(alias, conn_params, options):
+    """ Return this process's pool for ``alias`` and ``conn_params``, creating it from ``options``. """
+    global _pid
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _lock:
+        if _pid != os.getpid():
+            # A forked worker must not share the parent's sockets.
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                partial(psycopg2.connect, **conn_params),
+                size=options.get('SIZE', 5),
+                overflow=options.get('OVERFLOW', 10),
+                timeout=options.get('TIMEOUT', 30),
+                recycle=options.get('RECYCLE', 0),
+                max_lifetime=options.get('MAX_LIFETIME', 0),
+                pre_ping=options.get('PRE_PING', 0),
+            )
+        return pool
+
+
+def pool_stats():
+    """ Stats of every pool in this process, keyed by database alias and name. """
+    with _lock:
+        pools = list(_pools.items()) if _pid == os.getpid() else []
+    stats = {}
+    for (alias, params), pool in pools:
+        name = dict(params).get('database') or ''
+        stats['{}:{}'.format(alias, name) if name else alias] = pool.stats()
+    return stats
+
+
+def dispose_pools():
+    """ Close the idle connections of every pool in this process. """
+    with _lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.dispose()
@@ -0,0 +1,124 @@
+""" Process-local index of effective rates.
+
+Each unit of measure gets a sorted list of non-overlapping segments built
+from the Rate table, so finding the rate for a date is a binary search rather
+than a query. A rate covers ``effective_start`` through ``effective_end``
+inclusive; where rates overlap the one that started most recently wins, as in
+``api.billing``.
+
+The index is loaded on first use. Writers call ``invalidate`` once their
+transaction commits, which drops this process's copy and replaces a generation
+token in the default cache. Other workers compare their generation with the
+cached one at most every ``RATE_INDEX_CHECK_SECONDS`` and reload when it has
+moved, so the cache backend must be shared between workers for changes to
+propagate.
+"""
+import datetime
+import threading
+import time
+import uuid
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Rate
+
+GENERATION_KEY = 'api:rate_index:generation'
+
+
+class RateIndex:
+    """ Sorted rate segments per unit of measure. """
+
+    def __init__(self, rates):
+        self.units = {}
+        by_unit = {}
+        for rate in rates:
+            by_unit.setdefault(rate.unit_of_measure, []).append(rate)
+        for unit, unit_rates in by_unit.items():
+            self.units[unit] = self.segments(unit_rates)
+
+    @staticmethod
+    def segments(rates):
+        # Split the timeline at every start and day after an end, then pick the
+        # covering rate with the latest start for each piece.
+        bounds = set()
+        for rate in rates:
+            bounds.add(rate.effective_start)
+            if rate.effective_end is not None:
+                bounds.add(rate.effective_end + datetime.timedelta(days=1))
+
+        starts, covering = [], []
+        for bound in sorted(bounds):
+            active = [rate for rate in rates if rate.effective_start <= bound
+                      and (rate.effective_end is None or rate.effective_end >= bound)]
+            rate = max(active, key=lambda r: (r.effective_start, r.pk)) if active else None
+            if covering and covering[-1] is rate:
+                continue
+            starts.append(bound)
+            covering.append(rate)
+        return starts, covering
+
+    def rate_at(self, day, unit_of_measure):
+        """ Return the Rate in effect on ``day`` for the unit, or None. """
+        if isinstance(day, datetime.datetime):
+            day = day.date()
+        starts, covering = self.units.get(unit_of_measure, ((), ()))
+        i = bisect_right(starts, day) - 1
+        return covering[i] if i >= 0 else None
+
+    def rates_at(self, days, unit_of_measure):
+        """ Return the Rate in effect for each of ``days``, in order. """
+        return [self.rate_at(day, unit_of_measure) for day in days]
+
+
+_lock = threading.Lock()
+_index = None
+_generation = None
+_checked = 0.0
+
+
+def current_generation():
+    return cache.get_or_set(GENERATION_KEY, lambda: uuid.uuid4().hex, timeout=None)
+
+
+def rate_index():
+    """ Return the current RateIndex, loading or reloading it when stale. """
+    global _index, _generation, _checked
+
+    now = time.monotonic()
+    if _index is not None and now - _checked < settings.RATE_INDEX_CHECK_SECONDS:
+        return _index
+
+    with _lock:
+        generation = current_generation()
+        if _index is None or generation != _generation:
+            # From the primary: an index read from a lagging replica would be kept until the next rate write.
+            _index = RateIndex(Rate.objects.using(DEFAULT_DB_ALIAS))
+            _generation = generation
+        _checked = now
+        return _index
+
+
+def rate_at(day, unit_of_measure):
+    """ Return the Rate in effect on ``day`` for ``unit_of_measure``, or None. """
+    return rate_index().rate_at(day, unit_of_measure)
+
+
+def rates_at(days, unit_of_measure):
+    """ Return the Rate in effect on each of ``days`` for ``unit_of_measure``. """
+    return rate_index().rates_at(days, unit_of_measure)
+
+
+def reset():
+    # Drop this process's copy and tell other workers to reload theirs.
+    global _index
+    with _lock:
+        _index = None
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate():
+    """ Invalidate the index in every worker once the current transaction commits. """
+    transaction.on_commit(reset)
@@ -0,0 +1,240 @@
+""" Response cache for GraphQL query operations.
+
+Responses are keyed by the normalized document, operation name, variables
+and the caller's effective permission set, so callers with the same
+permissions share entries and nobody is served data they could not read.
+Each entry is tagged with the models it depends on: the models behind the
+Django object types it selects, plus every table its execution read. A tag
+is a version token in the default cache, which is shared by all workers;
+writing to a model replaces its token, and entries recorded against an
+older token are treated as misses. Only entries depending on the written
+models are affected.
+
+``ResponseCacheMiddleware`` watches the SQL of every unsafe request, which
+covers all GraphQL mutations and admin saves, and invalidates the models
+written. Other writers call ``invalidate_models``.
+
+Entries are stored in the ``GRAPHQL_RESPONSE_CACHE`` cache alias, which may
+be local memory or any Django backend, and live for at most
+``GRAPHQL_RESPONSE_CACHE_TTL`` seconds. Clients can ask for a shorter
+lifetime with ``Cache-Control: max-age=N`` or bypass the cache with
+``Cache-Control: no-cache``. A TTL of 0 disables the cache.
+
+Entries remember the database their data was read from. Those read from a
+replica live for at most ``REPLICA_MAX_LAG_SECONDS``, since a replica may not
+have replayed a write the tags were already bumped for, and are skipped for
+callers who read from the primary after a mutation, so they see their writes.
+"""
+import hashlib
+import json
+import re
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache as tag_cache, caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections
+from graphql.language.ast import Field, FragmentDefinition, FragmentSpread, InlineFragment, OperationDefinition
+from graphql.language.printer import print_ast
+from graphql.type.definition import GraphQLObjectType, get_named_type
+from graphql_jwt.shortcuts import get_user_by_token
+from graphql_jwt.utils import get_http_authorization
+
+from . import routers
+
+TAG_PREFIX = 'api:response:tag:'
+ENTRY_PREFIX = 'api:response:'
+
+WRITE_RE = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|COPY)\s+"?(\w+)"?', re.I)
+TABLE_RE = re.compile(r'"(\w+)"')
+
+# Reads of these apps' tables come from authenticating the request, which the permission key covers.
+UNTRACKED_APPS = ('admin', 'auth', 'contenttypes', 'sessions')
+
+
+def table_labels():
+    return {model._meta.db_table: model._meta.label_lower for model in apps.get_models()
+            if model._meta.app_label not in UNTRACKED_APPS}
+
+
+@contextmanager
+def track_tables(pattern):
+    """ Collect labels of models whose tables appear in SQL matching ``pattern``, on every connection. """
+    labels, tables = set(), table_labels()
+
+    def wrapper(execute, sql, params, many, context):
+        for table in pattern.findall(sql):
+            if table in tables:
+                labels.add(tables[table])
+        return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield labels
+
+
+def track_reads():
+    return track_tables(TABLE_RE)
+
+
+def track_writes():
+    return track_tables(WRITE_RE)
+
+
+def invalidate(labels):
+    """ Invalidate cached responses depending on any of the model ``labels``. """
+    if labels:
+        tag_cache.set_many({TAG_PREFIX + label: uuid.uuid4().hex for label in labels}, timeout=None)
+
+
+def invalidate_models(*models):
+    invalidate({model._meta.label_lower for model in models})
+
+
+def tag_versions(labels):
+    # Return the current version of each tag, creating missing ones.
+    keys = {TAG_PREFIX + label: label for label in labels}
+    found = tag_cache.get_many(list(keys))
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        tag_cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def document_models(schema, document_ast):
+    """ Return labels of the models behind the Django object types selected by the document. """
+    fragments = {d.name.value: d for d in document_ast.definitions if isinstance(d, FragmentDefinition)}
+    labels = set()
+
+    def walk(parent, selection_set, seen):
+        for selection in selection_set.selections:
+            if isinstance(selection, FragmentSpread):
+                if selection.name.value not in seen:
+                    walk(parent, fragments[selection.name.value].selection_set, seen | {selection.name.value})
+                continue
+            if isinstance(selection, InlineFragment):
+                condition = selection.type_condition
+                walk(schema.get_type(condition.name.value) if condition else parent, selection.selection_set, seen)
+                continue
+            if not isinstance(selection, Field) or not isinstance(parent, GraphQLObjectType):
+                continue
+            field = parent.fields.get(selection.name.value)
+            if field is None:
+                continue
+            named = get_named_type(field.type)
+            model = getattr(getattr(getattr(named, 'graphene_type', None), '_meta', None), 'model', None)
+            if model is not None:
+                labels.add(model._meta.label_lower)
+            if selection.selection_set:
+                walk(named, selection.selection_set, seen)
+
+    for definition in document_ast.definitions:
+        if isinstance(definition, OperationDefinition) and definition.operation == 'query':
+            walk(schema.get_query_type(), definition.selection_set, frozenset())
+    return labels
+
+
+def caller(request):
+    """ Return the user the request acts as, or None when it cannot be determined up front. """
+    token = get_http_authorization(request)
+    if token:
+        try:
+            return get_user_by_token(token, request)
+        except Exception:
+            return None
+    return getattr(request, 'user', None) or AnonymousUser()
+
+
+def permission_key(user):
+    if not user.is_active:
+        return 'inactive'
+    permissions = sorted(user.get_all_permissions())
+    return hashlib.sha256(json.dumps([user.is_superuser, permissions]).encode()).hexdigest()
+
+
+def max_age(request):
+    """ Return the lifetime for entries cached for ``request``; 0 means do not use the cache. """
+    ceiling = settings.GRAPHQL_RESPONSE_CACHE_TTL
+    directives = [d.strip() for d in request.META.get('HTTP_CACHE_CONTROL', '').lower().split(',')]
+    if 'no-cache' in directives or 'no-store' in directives:
+        return 0
+    for directive in directives:
+        if directive.startswith('max-age='):
+            try:
+                return max(0, min(ceiling, int(directive[len('max-age='):])))
+            except ValueError:
+                pass
+    return ceiling
+
+
+class ResponseCache:
+    """ Looks up and stores query responses for one request. """
+
+    def __init__(self, request, schema, document, variables, operation_name):
+        self.schema = schema
+        self.document = document
+        self.ttl = max_age(request)
+        self.key = None
+        self.versions = None
+        self.user = None
+        if self.ttl <= 0 or document.get_operation_type(operation_name) != 'query':
+            return
+        user = self.user = caller(request)
+        if user is None:
+            return
+        normalized = getattr(document, 'normalized', None)
+        if normalized is None:
+            normalized = document.normalized = print_ast(document.document_ast)
+        payload = json.dumps([normalized, operation_name, variables, permission_key(user)],
+                             cls=DjangoJSONEncoder, sort_keys=True)
+        self.key = ENTRY_PREFIX + hashlib.sha256(payload.encode()).hexdigest()
+
+    @property
+    def store(self):
+        return caches[settings.GRAPHQL_RESPONSE_CACHE]
+
+    def get(self):
+        """ Return cached response data, or None. """
+        if self.key is None:
+            return None
+        entry = self.store.get(self.key)
+        if entry is None or tag_versions(entry['tags']) != entry['tags']:
+            return None
+        if entry.get('database', DEFAULT_DB_ALIAS) != DEFAULT_DB_ALIAS and routers.is_sticky(self.user):
+            return None
+        return entry['data']
+
+    def begin(self):
+        # Record tag versions before executing, so writes made meanwhile leave the entry stale.
+        if self.key is not None:
+            self.versions = tag_versions(table_labels().values())
+
+    def set(self, data, read_labels, database=DEFAULT_DB_ALIAS):
+        if self.key is None or self.versions is None:
+            return
+        ttl = self.ttl if database == DEFAULT_DB_ALIAS else min(self.ttl, int(settings.REPLICA_MAX_LAG_SECONDS))
+        if ttl <= 0:
+            return
+        labels = read_labels | document_models(self.schema, self.document.document_ast)
+        tags = {label: self.versions[label] for label in labels if label in self.versions}
+        self.store.set(self.key, {'data': data, 'tags': tags, 'database': database}, timeout=ttl)
+
+
+class ResponseCacheMiddleware:
+    """ Invalidates cached responses for models written during unsafe requests. """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return self.get_response(request)
+        with track_writes() as labels:
+            response = self.get_response(request)
+        invalidate(labels)
+        return response
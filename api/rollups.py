@@ -0,0 +1,197 @@
+""" Incremental maintenance of the DailyUsage and MonthlyUsage rollups.
+
+A read's usage is its delta from the previous read in the same unit of
+measure, so changing a read affects the day it falls on and the days of the
+next read in each unit after it. Every
+write path (mutations, bulk ingestion, the COPY importer and the admin)
+reports the reads it touched to ``refresh_reads``, which recomputes only the
+affected days and months with a fixed number of set-based statements,
+however many reads or meters were involved.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, Min, OuterRef
+
+from .models import Consumption, DailyUsage, MonthlyUsage, Meter
+
+
+def tables():
+    qn = connection.ops.quote_name
+    return {
+        'consumption': qn(Consumption._meta.db_table),
+        'daily': qn(DailyUsage._meta.db_table),
+        'monthly': qn(MonthlyUsage._meta.db_table),
+        'meter': qn(Meter._meta.db_table),
+    }
+
+
+RANGES_SQL = """
+    SELECT changed.meter_id,
+           (changed.first_time AT TIME ZONE %(tz)s)::date,
+           (COALESCE(nxt.read_time, changed.last_time) AT TIME ZONE %(tz)s)::date + 1
+    FROM unnest(%(meters)s::integer[], %(firsts)s::timestamptz[], %(lasts)s::timestamptz[])
+        AS changed(meter_id, first_time, last_time)
+    LEFT JOIN LATERAL (
+        SELECT MAX(n.read_time) AS read_time
+        FROM unnest(%(units)s::text[]) AS u(unit_of_measure)
+        CROSS JOIN LATERAL (
+            SELECT c.read_time FROM {consumption} c
+            WHERE c.meter_id = changed.meter_id AND c.unit_of_measure = u.unit_of_measure
+              AND c.read_time > changed.last_time
+            ORDER BY c.read_time
+            LIMIT 1
+        ) n
+    ) nxt ON true
+"""
+
+LOCK_SQL = """
+    SELECT id FROM {meter} WHERE id = ANY(%(meters)s::integer[]) ORDER BY id FOR NO KEY UPDATE
+"""
+
+DAYS = "unnest(%(meters)s::integer[], %(first_days)s::date[], %(end_days)s::date[]) AS b(meter_id, first_day, end_day)"
+
+DELETE_DAILY_SQL = """
+    DELETE FROM {daily} d USING """ + DAYS + """
+    WHERE d.meter_id = b.meter_id AND d.day >= b.first_day AND d.day < b.end_day
+"""
+
+INSERT_DAILY_SQL = """
+    WITH bounds AS (
+        SELECT meter_id, first_day::timestamp AT TIME ZONE %(tz)s AS start_time,
+               end_day::timestamp AT TIME ZONE %(tz)s AS end_time
+        FROM """ + DAYS + """
+    ), reads AS (
+        SELECT c.meter_id, b.start_time, c.read_time, c.reading, c.unit_of_measure
+        FROM bounds b
+        JOIN {consumption} c
+          ON c.meter_id = b.meter_id AND c.read_time >= b.start_time AND c.read_time < b.end_time
+        UNION ALL
+        SELECT b.meter_id, b.start_time, p.read_time, p.reading, p.unit_of_measure
+        FROM bounds b
+        CROSS JOIN unnest(%(units)s::text[]) AS u(unit_of_measure)
+        CROSS JOIN LATERAL (
+            SELECT c.read_time, c.reading, c.unit_of_measure FROM {consumption} c
+            WHERE c.meter_id = b.meter_id AND c.unit_of_measure = u.unit_of_measure
+              AND c.read_time < b.start_time
+            ORDER BY c.read_time DESC
+            LIMIT 1
+        ) p
+    ), deltas AS (
+        SELECT meter_id, start_time, read_time, reading, unit_of_measure,
+               reading - LAG(reading) OVER (PARTITION BY meter_id, unit_of_measure ORDER BY read_time) AS delta
+        FROM reads
+    )
+    INSERT INTO {daily} (meter_id, day, unit_of_measure, usage, reads)
+    SELECT meter_id, (read_time AT TIME ZONE %(tz)s)::date, unit_of_measure,
+           SUM(CASE WHEN delta < 0 THEN reading ELSE delta END), COUNT(*)
+    FROM deltas
+    WHERE delta IS NOT NULL AND read_time >= start_time
+    GROUP BY 1, 2, 3
+"""
+
+DELETE_MONTHLY_SQL = """
+    DELETE FROM {monthly} m USING """ + DAYS + """
+    WHERE m.meter_id = b.meter_id
+      AND m.month >= date_trunc('month', b.first_day)::date
+      AND m.month <= date_trunc('month', b.end_day - 1)::date
+"""
+
+INSERT_MONTHLY_SQL = """
+    INSERT INTO {monthly} (meter_id, month, unit_of_measure, usage, reads)
+    SELECT d.meter_id, date_trunc('month', d.day)::date, d.unit_of_measure, SUM(d.usage), SUM(d.reads)
+    FROM {daily} d
+    JOIN """ + DAYS + """
+      ON d.meter_id = b.meter_id
+     AND d.day >= date_trunc('month', b.first_day)::date
+     AND d.day < (date_trunc('month', b.end_day - 1) + interval '1 month')::date
+    GROUP BY 1, 2, 3
+"""
+
+
+def refresh_ranges(meter_ranges):
+    """ Recompute rollups for ``{meter_id: (first_time, last_time)}`` change windows. """
+    if not meter_ranges:
+        return
+
+    meters = sorted(meter_ranges)
+    params = {
+        'tz': settings.TIME_ZONE,
+        # Deltas are taken between reads in the same unit, as rebuild's whole-history window does.
+        'units': [unit for unit, _ in Consumption.MEASURE],
+        'meters': meters,
+        'firsts': [meter_ranges[m][0] for m in meters],
+        'lasts': [meter_ranges[m][1] for m in meters],
+    }
+    names = tables()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Serialise refreshes per meter so concurrent writers cannot interleave.
+        cursor.execute(LOCK_SQL.format(**names), params)
+        cursor.execute(RANGES_SQL.format(**names), params)
+        days = cursor.fetchall()
+        params['meters'] = [row[0] for row in days]
+        params['first_days'] = [row[1] for row in days]
+        params['end_days'] = [row[2] for row in days]
+
+        cursor.execute(DELETE_DAILY_SQL.format(**names), params)
+        cursor.execute(INSERT_DAILY_SQL.format(**names), params)
+        cursor.execute(DELETE_MONTHLY_SQL.format(**names), params)
+        cursor.execute(INSERT_MONTHLY_SQL.format(**names), params)
+
+
+def merge_range(meter_ranges, meter_id, read_time):
+    # Widen the change window of meter_id to include read_time.
+    current = meter_ranges.get(meter_id)
+    if current is None:
+        meter_ranges[meter_id] = (read_time, read_time)
+    else:
+        meter_ranges[meter_id] = (min(current[0], read_time), max(current[1], read_time))
+
+
+def refresh_reads(reads):
+    """ Recompute rollups affected by reads given as ``(meter_id, read_time)`` pairs.
+
+    Pass both the old and new values when a read is moved to a different
+    meter or time, and the old values of deleted reads.
+    """
+    meter_ranges = {}
+    for meter_id, read_time in reads:
+        merge_range(meter_ranges, meter_id, read_time)
+    refresh_ranges(meter_ranges)
+
+
+def rebuild(meter_ids=None, batch_size=1000, stdout=None):
+    """ Recompute rollups from scratch, for every meter or only ``meter_ids``.
+
+    Each batch of meters has its rollups deleted and recomputed in one transaction, so reports
+    see a meter's old rollups or its new ones, never none, during the run or after it fails.
+    """
+    queryset = Consumption.objects.all() if meter_ids is None else Consumption.objects.filter(meter_id__in=meter_ids)
+    spans = queryset.values_list('meter_id').annotate(Min('read_time'), Max('read_time')).order_by('meter_id')
+
+    batch = {}
+    done = 0
+    for meter_id, first_time, last_time in spans.iterator():
+        batch[meter_id] = (first_time, last_time)
+        if len(batch) >= batch_size:
+            rebuild_batch(batch)
+            done += len(batch)
+            batch = {}
+            if stdout:
+                stdout.write('Rebuilt rollups for {} meters.'.format(done))
+    rebuild_batch(batch)
+
+    # Meters without reads keep no rollups.
+    unread = ~Exists(Consumption.objects.filter(meter_id=OuterRef('meter_id')))
+    for model in (DailyUsage, MonthlyUsage):
+        rows = model.objects.all() if meter_ids is None else model.objects.filter(meter_id__in=meter_ids)
+        rows.filter(unread).delete()
+    return done + len(batch)
+
+
+def rebuild_batch(meter_ranges):
+    """ Replace the rollups of the meters in ``meter_ranges`` with ones recomputed over their whole history. """
+    with transaction.atomic():
+        DailyUsage.objects.filter(meter_id__in=meter_ranges).delete()
+        MonthlyUsage.objects.filter(meter_id__in=meter_ranges).delete()
+        refresh_ranges(meter_ranges)
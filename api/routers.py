@@ -0,0 +1,147 @@
+""" Read-replica routing for GraphQL operations.
+
+``ReplicaMiddleware`` decides at each root field where the operation reads
+from: queries and subscriptions go to one of ``REPLICA_DATABASES``,
+mutations to the primary. ``ReplicaRouter`` then sends reads of this app's
+models to that database for the rest of the thread's request. Writes, also
+of objects read from a replica, and everything outside the ``api`` app
+(sessions, auth, the cache table) use the primary.
+
+A caller who has run a mutation reads from the primary for
+``REPLICA_STICKY_SECONDS`` afterwards, so they see their own writes. The
+mark is kept in the default cache, which must be shared between workers.
+
+Each replica's replay lag is measured at most every
+``REPLICA_LAG_CHECK_SECONDS`` per process. Replicas further behind than
+``REPLICA_MAX_LAG_SECONDS``, or that cannot be reached, are skipped; with
+none left queries read from the primary. The response cache keeps responses
+read from a replica for at most ``REPLICA_MAX_LAG_SECONDS``, and never serves
+them to a sticky caller.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core import signals
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_PREFIX = 'api:replica:sticky:'
+ROUTED_APPS = ('api',)
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_state = threading.local()
+_lock = threading.Lock()
+_lags = {}
+
+
+def route(alias):
+    """ Send this thread's reads of routed models to ``alias``. """
+    _state.alias = alias
+
+
+def reset(**kwargs):
+    _state.alias = None
+
+
+def current():
+    """ Return the database this thread's reads of routed models go to. """
+    return getattr(_state, 'alias', None) or DEFAULT_DB_ALIAS
+
+
+def replica_lag(alias):
+    """ Seconds ``alias`` is behind the primary; 0 when it is caught up or not in recovery. """
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0] or 0)
+
+
+def lag(alias):
+    # Cached per process; an unreachable replica counts as infinitely behind.
+    now = time.monotonic()
+    with _lock:
+        checked, seconds = _lags.get(alias, (None, None))
+    if checked is None or now - checked >= settings.REPLICA_LAG_CHECK_SECONDS:
+        try:
+            seconds = replica_lag(alias)
+        except Exception:
+            logger.warning('Could not measure replication lag of %s', alias, exc_info=True)
+            seconds = float('inf')
+        with _lock:
+            _lags[alias] = (now, seconds)
+    return seconds
+
+
+def choose_replica():
+    """ Return a replica within the lag limit, or the primary when there is none. """
+    replicas = [alias for alias in settings.REPLICA_DATABASES if lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+def sticky_key(user):
+    return '{}{}'.format(STICKY_PREFIX, user.pk)
+
+
+def stick(user):
+    """ Read from the primary for ``user`` for the next ``REPLICA_STICKY_SECONDS``. """
+    if user is not None and user.is_authenticated and settings.REPLICA_STICKY_SECONDS:
+        cache.set(sticky_key(user), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user):
+    return user is not None and user.is_authenticated and bool(cache.get(sticky_key(user)))
+
+
+def connect_signals():
+    # Threads are reused between requests, so a request starts and ends reading from the primary.
+    signals.request_started.connect(reset, dispatch_uid='api.routers.reset_started')
+    signals.request_finished.connect(reset, dispatch_uid='api.routers.reset_finished')
+
+
+class ReplicaRouter:
+    """ Route reads of ``api`` models to the database chosen for the current operation. """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in ROUTED_APPS:
+            return getattr(_state, 'alias', None)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica are saved to the primary.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.REPLICA_DATABASES:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """ Pick the database each GraphQL operation reads from. """
+
+    def resolve(self, next, root, info, **args):
+        if len(info.path) == 1 and settings.REPLICA_DATABASES:
+            user = getattr(info.context, 'user', None)
+            if info.operation.operation == 'mutation':
+                stick(user)
+                route(DEFAULT_DB_ALIAS)
+            elif is_sticky(user):
+                route(DEFAULT_DB_ALIAS)
+            else:
+                route(choose_replica())
+        return next(root, info, **args)
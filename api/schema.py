@@ -3,11 +3,21 @@ import graphql_jwt
 from graphql_jwt.decorators import login_required, permission_required
 from graphene import relay
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
 from graphql_relay import from_global_id
 from collections import namedtuple
 
-from .models import Customer, MeterType, Meter, Account_Asset_Link, Consumption, Rate
+from django.conf import settings
+from django.db import transaction
+
+from .models import Customer, MeterType, Meter, Account_Asset_Link, Consumption, Rate, DailyUsage, MonthlyUsage
+from . import events, rollups, rates
+from . import loaders  # noqa: F401 - batches relation fields of the types below
+from .filters import ConsumptionFilter, DailyUsageFilter, MonthlyUsageFilter
+from .ingest import bulk_create_consumption
+from .usage import meter_usage, fleet_usage
+from .billing import customer_bill
+from .optimizer import optimize
+from .pagination import CountedConnection, KeysetConnectionField, OffsetConnectionField
 
 
 def reverse_node_id(NodeId):
@@ -16,10 +26,6 @@ def reverse_node_id(NodeId):
     rid = Rid(*from_global_id(NodeId))
     return rid.id
 
-def print_user_context(info):
-    user = info.context.user
-    print('User: {}'.format(user))
-
 # region Customers
 
 
@@ -31,6 +37,7 @@ class CustomerType(DjangoObjectType):
             'last_name': ['exact', 'icontains', 'istartswith'],
         }
         interfaces = (relay.Node, )
+        connection_class = CountedConnection
 
 
 class CustomerConnection(relay.Connection):
@@ -108,6 +115,7 @@ class MeterTypeType(DjangoObjectType):
             'meter_vendor': ['exact', 'icontains', 'istartswith']
         }
         interfaces = (relay.Node,)
+        connection_class = CountedConnection
 
 
 class MeterTypeCreate(relay.ClientIDMutation):
@@ -187,6 +195,7 @@ class MeterTy(DjangoObjectType):
             'retire_date': ['exact', 'range', 'year', 'month', 'day'],
         }
         interfaces = (relay.Node,)
+        connection_class = CountedConnection
 
 
 class MeterCreate(relay.ClientIDMutation):
@@ -279,6 +288,7 @@ class AccountAssetLinkType(DjangoObjectType):
             'meter': ['exact'],
         }
         interfaces = (relay.Node,)
+        connection_class = CountedConnection
 
 
 class AssetAccountLinkCreate(relay.ClientIDMutation):
@@ -353,13 +363,9 @@ class ConsumptionType(DjangoObjectType):
         description = """
         This is the consumption history node.
         """
-        filter_fields = {
-            'meter': ['exact'],
-            'read_time': ['exact', 'range', 'year', 'month', 'day'],
-            'reading': ['exact', 'range'],
-            'unit_of_measure': ['exact'],
-        }
+        filterset_class = ConsumptionFilter
         interfaces = (relay.Node,)
+        connection_class = CountedConnection
 
 
 class ConsumptionCreate(relay.ClientIDMutation):
@@ -372,14 +378,17 @@ class ConsumptionCreate(relay.ClientIDMutation):
     consumption = graphene.Field(ConsumptionType)
 
     @classmethod
-    @permission_required('api.create_consumption')
+    @permission_required('api.add_consumption')
     def mutate_and_get_payload(cls, root, info, **kwargs):
-        consumption = Consumption.objects.create(
-            meter=kwargs['meter'],
-            read_time=kwargs['read_time'],
-            reading=kwargs['reading'],
-            unit_of_measure=kwargs['unit_of_measure'],
-        )
+        with transaction.atomic():
+            consumption = Consumption.objects.create(
+                meter_id=kwargs['meter'],
+                read_time=kwargs['read_time'],
+                reading=kwargs['reading'],
+                unit_of_measure=kwargs['unit_of_measure'],
+            )
+            rollups.refresh_reads([(consumption.meter_id, consumption.read_time)])
+            events.publish_consumption([consumption])
 
         return ConsumptionCreate(consumption=consumption)
 
@@ -400,12 +409,15 @@ class ConsumptionUpdate(relay.ClientIDMutation):
 
         rid = reverse_node_id(NodeId=kwargs['id'])
 
-        consumption = Consumption.object.get(pd=rid)
-        consumption.meter = kwargs['meter']
-        consumption.read_time = kwargs['read_time']
-        consumption.reading = kwargs['reading']
-        consumption.unit_of_measure = kwargs['unit_of_measure']
-        consumption.save()
+        with transaction.atomic():
+            consumption = Consumption.objects.get(pk=rid)
+            previous = (consumption.meter_id, consumption.read_time)
+            consumption.meter_id = kwargs['meter']
+            consumption.read_time = kwargs['read_time']
+            consumption.reading = kwargs['reading']
+            consumption.unit_of_measure = kwargs['unit_of_measure']
+            consumption.save()
+            rollups.refresh_reads([previous, (consumption.meter_id, consumption.read_time)])
 
         return ConsumptionUpdate(consumption=consumption)
 
@@ -422,17 +434,97 @@ class ConsumptionDelete(relay.ClientIDMutation):
 
         rid = reverse_node_id(NodeId=kwargs['id'])
 
-        consumption = Consumption.object.get(pk=rid)
-        consumption.delete()
+        with transaction.atomic():
+            consumption = Consumption.objects.get(pk=rid)
+            consumption.delete()
+            rollups.refresh_reads([(consumption.meter_id, consumption.read_time)])
 
         return ConsumptionDelete(consumption=consumption)
 
 
+class ConsumptionReadInput(graphene.InputObjectType):
+    """ A single meter read. Reference the meter by node ID or by serial number. """
+    meter = graphene.ID()
+    meter_serial = graphene.String()
+    read_time = graphene.DateTime(required=True)
+    reading = graphene.Int(required=True)
+    unit_of_measure = graphene.String(required=True)
+
+
+class ConsumptionRowError(graphene.ObjectType):
+    """ A rejected row from a bulk mutation, by its position in the input list. """
+    index = graphene.Int(required=True)
+    message = graphene.String(required=True)
+
+
+class ConsumptionBulkCreate(relay.ClientIDMutation):
+    class Input:
+        reads = graphene.List(graphene.NonNull(ConsumptionReadInput), required=True)
+
+    created_count = graphene.Int()
+    errors = graphene.List(graphene.NonNull(ConsumptionRowError))
+
+    @classmethod
+    @permission_required('api.add_consumption')
+    def mutate_and_get_payload(cls, root, info, **kwargs):
+        reads = kwargs['reads']
+        if len(reads) > settings.CONSUMPTION_BULK_MAX_ROWS:
+            raise Exception('A maximum of {} reads can be created per request.'.format(
+                settings.CONSUMPTION_BULK_MAX_ROWS))
+
+        created, errors = bulk_create_consumption(reads)
+
+        return ConsumptionBulkCreate(
+            created_count=len(created),
+            errors=[ConsumptionRowError(index=e.index, message=e.message) for e in errors],
+        )
+
+
 class ConsumptionTypeConnection(relay.Connection):
     class Meta:
         node = ConsumptionType
+
+
+class UsageInterval(graphene.Enum):
+    """ Bucket width for usage aggregation. """
+    HOUR = 'hour'
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
+
+class UsageBucketType(graphene.ObjectType):
+    """ Water used by a meter within one time bucket. """
+    bucket_start = graphene.DateTime(required=True)
+    usage = graphene.Float(required=True)
+    unit = graphene.String(required=True)
 # endregion ConsumptionType
 
+# region Usage Rollups
+
+
+class DailyUsageType(DjangoObjectType):
+    class Meta:
+        model = DailyUsage
+        description = """
+        Water used by a meter on one day. Maintained automatically from consumption records.
+        """
+        filterset_class = DailyUsageFilter
+        interfaces = (relay.Node,)
+        connection_class = CountedConnection
+
+
+class MonthlyUsageType(DjangoObjectType):
+    class Meta:
+        model = MonthlyUsage
+        description = """
+        Water used by a meter in one month. Maintained automatically from consumption records.
+        """
+        filterset_class = MonthlyUsageFilter
+        interfaces = (relay.Node,)
+        connection_class = CountedConnection
+# endregion Usage Rollups
+
 # region Rate
 
 
@@ -449,6 +541,7 @@ class RateType(DjangoObjectType):
             'unit_of_measure': ['exact'],
         }
         interfaces = (relay.Node,)
+        connection_class = CountedConnection
 
 
 class RateCreate(relay.ClientIDMutation):
@@ -461,7 +554,7 @@ class RateCreate(relay.ClientIDMutation):
     rate = graphene.Field(RateType)
 
     @classmethod
-    @permission_required('api.create_rate')
+    @permission_required('api.add_rate')
     def mutate_and_get_payload(cls, root, info, **kwargs):
         rate = Rate.objects.create(
             rate=kwargs['rate'],
@@ -469,6 +562,7 @@ class RateCreate(relay.ClientIDMutation):
             effective_end=kwargs['effective_end'],
             unit_of_measure=kwargs['unit_of_measure'],
         )
+        rates.invalidate()
 
         return RateCreate(rate=rate)
 
@@ -494,6 +588,7 @@ class RateUpdate(relay.ClientIDMutation):
         rate.effective_end = kwargs['effective_end']
         rate.unit_of_measure = kwargs['unit_of_measure']
         rate.save()
+        rates.invalidate()
 
         return RateUpdate(rate=rate)
 
@@ -510,8 +605,9 @@ class RateDelete(relay.ClientIDMutation):
 
         rid = reverse_node_id(NodeId=kwargs['id'])
 
-        rate = Rate.objects.get(pd=rid)
+        rate = Rate.objects.get(pk=rid)
         rate.delete()
+        rates.invalidate()
 
         return RateDelete(rate=rate)
 
@@ -521,6 +617,29 @@ class RateTypeConnection(relay.Connection):
         node = RateType
 # endregion Rate
 
+# region Billing
+
+
+class BillLineType(graphene.ObjectType):
+    """ Usage of one meter priced at one rate within a billing period. """
+    meter = graphene.Field(MeterTy)
+    rate = graphene.Decimal(description="Rate applied, or null when no rate was in effect.")
+    unit = graphene.String(required=True, description="Unit of measure the usage and rate are in.")
+    first_day = graphene.Date(required=True)
+    last_day = graphene.Date(required=True)
+    usage = graphene.Decimal(required=True)
+    amount = graphene.Decimal()
+
+
+class CustomerBillType(graphene.ObjectType):
+    """ A customer's charges for a billing period. """
+    customer = graphene.Field(CustomerType)
+    period_start = graphene.Date(required=True)
+    period_end = graphene.Date(required=True)
+    lines = graphene.List(graphene.NonNull(BillLineType))
+    total = graphene.Decimal(required=True)
+# endregion Billing
+
 # region Query
 
 
@@ -528,60 +647,154 @@ class Query(graphene.ObjectType):
     """ Graphene Schema Queries """
 
     """ Customer Queries """
-    customer_read = DjangoFilterConnectionField(CustomerType, description="""
+    customer_read = OffsetConnectionField(CustomerType, description="""
     Returns a filtered list of customers, or leave filters blank for all customers.""")
 
     @permission_required('api.view_customer')
     def resolve_customer_read(self, info, **kwargs):
-        print_user_context(info)
+        return optimize(Customer.objects.all(), info)
 
     """ Meter Type Queries """
-    metertype_read = DjangoFilterConnectionField(MeterTypeType, description="""
+    metertype_read = OffsetConnectionField(MeterTypeType, description="""
     Returns a filtered list of water meter types. ie: model/manufacturer and the meters
     system id. Leave filters blank to return all meters.""")
 
     @permission_required('api.view_metertype')
     def resolve_metertype_read(self, info, **kwargs):
-        print_user_context(info)
+        return optimize(MeterType.objects.all(), info)
 
     """ Meter Inentory Queries """
-    meter_read = DjangoFilterConnectionField(MeterTy, description="""
+    meter_read = KeysetConnectionField(MeterTy, key=('pk',), description="""
     Returns a filtered list of customer meters deployed in field. Leave filters blank to return
     all meters in inventory.
     """)
 
     @permission_required('api.view_meter')
-    def resolve_meter(self, info, **kwargs):
-        print_user_context(info)
+    def resolve_meter_read(self, info, **kwargs):
+        return optimize(Meter.objects.all(), info)
 
     """ Asset Account Linking Table Queries """
-    asset_account_link_read = DjangoFilterConnectionField(AccountAssetLinkType, description="""
+    asset_account_link_read = OffsetConnectionField(AccountAssetLinkType, description="""
     Asset account linking table, contains foreign key relationship between deployed meters
     and customers.
     """)
 
     @permission_required('api.view_account_asset_link')
-    def resolve_asset_account_link(self, info, **kwargs):
-        print_user_context(info)
+    def resolve_asset_account_link_read(self, info, **kwargs):
+        return optimize(Account_Asset_Link.objects.all(), info)
 
     """ Consumtion Information Queries """
-    consumption_read = DjangoFilterConnectionField(ConsumptionType, description="""
-    Returns a filtered list of meter consumption records. Leave filters blank to return all
-    consumption information.
+    consumption_read = KeysetConnectionField(ConsumptionType, key=('read_time', 'pk'), description="""
+    Returns a filtered list of meter consumption records ordered by read time. Leave filters blank
+    to return all consumption information. Cursors seek on (readTime, id), so deep pages cost the
+    same as the first.
     """)
 
     @permission_required('api.view_consumption')
-    def resolve_consumption(self, info, **kwargs):
-        print_user_context(info)
+    def resolve_consumption_read(self, info, **kwargs):
+        return optimize(Consumption.objects.all(), info)
+
+    consumption_usage = graphene.List(
+        graphene.NonNull(UsageBucketType),
+        meter=graphene.ID(required=True),
+        start=graphene.DateTime(required=True),
+        end=graphene.DateTime(required=True),
+        interval=UsageInterval(required=True),
+        description="""
+    Returns water usage for a meter between start and end, summed into hour, day, week or month
+    buckets. Usage is the difference between consecutive cumulative readings.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_consumption_usage(self, info, meter, start, end, interval):
+        return meter_usage(reverse_node_id(NodeId=meter), start, end, interval)
+
+    """ Usage Rollup Queries """
+    daily_usage_read = OffsetConnectionField(DailyUsageType, description="""
+    Returns a filtered list of per meter daily usage totals.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_daily_usage_read(self, info, **kwargs):
+        return DailyUsage.objects.all()
+
+    monthly_usage_read = OffsetConnectionField(MonthlyUsageType, description="""
+    Returns a filtered list of per meter monthly usage totals.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_monthly_usage_read(self, info, **kwargs):
+        return MonthlyUsage.objects.all()
+
+    fleet_usage = graphene.List(
+        graphene.NonNull(UsageBucketType),
+        start=graphene.Date(required=True),
+        end=graphene.Date(required=True),
+        interval=UsageInterval(required=True),
+        description="""
+    Returns water usage summed across all meters between start and end dates, in day, week or
+    month buckets.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_fleet_usage(self, info, start, end, interval):
+        if interval == UsageInterval.HOUR.value:
+            raise Exception('Fleet usage is available in DAY, WEEK or MONTH buckets.')
+        return fleet_usage(start, end, interval)
+
+    """ Billing Queries """
+    customer_bill = graphene.Field(
+        CustomerBillType,
+        customer=graphene.ID(required=True),
+        period_start=graphene.Date(required=True),
+        period_end=graphene.Date(required=True),
+        description="""
+    Returns a customer's bill for every linked meter from periodStart up to, but not including,
+    periodEnd. Usage is split wherever the effective rate changes.
+    """)
+
+    @permission_required(['api.view_customer', 'api.view_consumption', 'api.view_rate'])
+    def resolve_customer_bill(self, info, customer, period_start, period_end):
+        customer = Customer.objects.get(pk=reverse_node_id(NodeId=customer))
+        lines, total = customer_bill(customer.pk, period_start, period_end)
+        meters = Meter.objects.in_bulk(set(line.meter_id for line in lines))
+
+        return CustomerBillType(
+            customer=customer,
+            period_start=period_start,
+            period_end=period_end,
+            lines=[BillLineType(
+                meter=meters[line.meter_id],
+                rate=line.rate,
+                unit=line.unit,
+                first_day=line.first_day,
+                last_day=line.last_day,
+                usage=line.usage,
+                amount=line.amount,
+            ) for line in lines],
+            total=total,
+        )
 
     """ Rate Queries """
-    rate_read = DjangoFilterConnectionField(RateType, description="""
+    rate_at = graphene.Field(
+        RateType,
+        date=graphene.Date(required=True),
+        unit_of_measure=graphene.String(required=True),
+        description="""
+    Returns the rate in effect on a date for a unit of measure, or null when none applies.
+    """)
+
+    @permission_required('api.view_rate')
+    def resolve_rate_at(self, info, date, unit_of_measure):
+        return rates.rate_at(date, unit_of_measure)
+
+    rate_read = OffsetConnectionField(RateType, description="""
     Returns a filtered list of rates. Leave filters blank to return all rates.
     """)
 
     @permission_required('api.view_rate')
-    def resolve_rate(self, info, **kwargs):
-        print_user_context(info)
+    def resolve_rate_read(self, info, **kwargs):
+        return optimize(Rate.objects.all(), info)
 
 # endregion Query
 
@@ -650,6 +863,8 @@ class Mutation(graphene.ObjectType):
     consumption_update.description = "Update an existing consumption record."
     consumption_delete = ConsumptionDelete.Field()
     consumption_delete.description = "Delete a consumption record (cascading delete of all associated records)."
+    consumption_bulk_create = ConsumptionBulkCreate.Field()
+    consumption_bulk_create.description = "Create many consumption records from meter readings in one transaction."
     # endregion Consumption Mutations
 
     # region Rate Mutations
@@ -662,3 +877,51 @@ class Mutation(graphene.ObjectType):
     # endregion Rate Mutations
 
 # endregion Mutation
+
+# region Subscription
+
+
+class MeterUsageThresholdType(graphene.ObjectType):
+    """ A read at which a meter's usage since its previous read reached a threshold. """
+    consumption = graphene.Field(ConsumptionType, required=True)
+    liters_per_hour = graphene.Float(required=True, description="Usage rate since the previous read.")
+
+
+class Subscription(graphene.ObjectType):
+    """ Graphene Schema Subscriptions """
+
+    consumption_added = graphene.Field(
+        ConsumptionType,
+        meter=graphene.ID(required=True),
+        description="""
+    Pushes every new read of a meter as it is ingested.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_consumption_added(self, info, meter):
+        channel = events.consumption_channel(reverse_node_id(NodeId=meter))
+        return events.observe(info.context, channel).map(events.consumption_from_event)
+
+    meter_usage_threshold = graphene.Field(
+        MeterUsageThresholdType,
+        meter=graphene.ID(required=True),
+        liters_per_hour=graphene.Float(required=True),
+        description="""
+    Pushes each new read of a meter at which usage since the previous read averaged at least
+    litersPerHour.
+    """)
+
+    @permission_required('api.view_consumption')
+    def resolve_meter_usage_threshold(self, info, meter, liters_per_hour):
+        meter_id = reverse_node_id(NodeId=meter)
+        usage_rate = events.UsageRate(meter_id)
+
+        def measure(consumption):
+            rate = usage_rate(consumption)
+            if rate is not None and rate >= liters_per_hour:
+                return MeterUsageThresholdType(consumption=consumption, liters_per_hour=rate)
+
+        return (events.observe(info.context, events.consumption_channel(meter_id))
+                .map(events.consumption_from_event).map(measure).filter(lambda event: event is not None))
+
+# endregion Subscription
@@ -0,0 +1,237 @@
+""" Recorder of slow GraphQL operations and the SQL behind them.
+
+The view's ``OperationTrace`` of each operation times every SQL statement on
+every connection and keeps the ``SLOW_LOG_STATEMENTS`` slowest. An operation
+is recorded when it takes longer than ``SLOW_OPERATION_SECONDS``
+or runs a statement slower than ``SLOW_QUERY_SECONDS``. The record holds the
+operation's name, its root fields with the arguments they were given, so a
+slow ``customerRead`` can be traced to the filter that caused it, its
+variables with secrets redacted, and its slowest statements.
+
+A sampled ``SLOW_EXPLAIN_RATE`` of the SELECT statements of recorded queries
+is run again under ``EXPLAIN (ANALYZE, BUFFERS)``: the slow ones, or the
+slowest when the operation was slow as a whole. Analyzing executes the
+statement, so mutations, locking SELECTs and SELECTs calling functions other
+than a few side-effect-free ones are never explained, and every EXPLAIN runs
+in a transaction that is rolled back, for at most
+``SLOW_EXPLAIN_TIMEOUT_SECONDS``. Plans are taken on a thread of their own,
+so the request that was already slow is not held up by them: statements are
+queued once the operation is recorded, or once the transaction they ran in
+commits, as in an atomic batch. At most ``MAX_PENDING_EXPLAINS`` wait; more
+are not explained. A plan is saved on its statement's record and written to
+the log as a line of its own.
+
+Records are saved as ``SlowOperation`` rows, browsable in the admin, and
+written as JSON lines to ``SLOW_LOG_FILE``, which rotates at
+``SLOW_LOG_MAX_BYTES`` keeping ``SLOW_LOG_BACKUPS`` old files.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+from functools import partial
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections, transaction
+from graphql.language.ast import Field, OperationDefinition
+
+from .documents import get_backend
+from .models import SlowOperation, SlowStatement
+
+logger = logging.getLogger(__name__)
+
+SECRET_RE = re.compile(r'pass|token|secret|key|auth', re.I)
+LOCKING_RE = re.compile(r'\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b', re.I)
+SELECT_LIST_RE = re.compile(r'^\s*SELECT\b(.*?)(\bFROM\b|$)', re.I | re.S)
+CALL_RE = re.compile(r'([A-Za-z_][\w.]*)\s*\(')
+# Functions and keywords followed by a parenthesis in the select lists of ORM queries.
+PURE_CALLS = {'all', 'and', 'any', 'array_agg', 'as', 'avg', 'case', 'cast', 'coalesce', 'count', 'date_trunc',
+              'distinct', 'exists', 'extract', 'in', 'lower', 'max', 'min', 'not', 'on', 'or', 'string_agg',
+              'sum', 'then', 'upper', 'when'}
+MAX_STRING = 200
+MAX_ITEMS = 20
+
+MAX_PENDING_EXPLAINS = 100
+
+_log = None
+_log_lock = threading.Lock()
+_explains = queue.Queue(maxsize=MAX_PENDING_EXPLAINS)
+_explainer = None
+_explainer_lock = threading.Lock()
+
+
+def sanitize(value, name=''):
+    """ Return ``value`` with secrets redacted and long strings and lists cut short. """
+    if name and SECRET_RE.search(name):
+        return '[redacted]'
+    if isinstance(value, dict):
+        return {key: sanitize(item, key) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [sanitize(item) for item in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append('... {} more'.format(len(value) - MAX_ITEMS))
+        return items
+    if isinstance(value, str) and len(value) > MAX_STRING:
+        return value[:MAX_STRING] + '...'
+    return value
+
+
+def describe(schema, query, operation_name):
+    """ Return the operation's name and its root fields described as ``name(argument, ...)``. """
+    try:
+        document_ast = get_backend(schema).document_from_string(schema, query).document_ast
+    except Exception:
+        return operation_name or '', ''
+    for definition in document_ast.definitions:
+        if isinstance(definition, OperationDefinition) and (
+                operation_name is None or definition.name and definition.name.value == operation_name):
+            fields = ', '.join('{}({})'.format(node.name.value, ', '.join(a.name.value for a in node.arguments))
+                               for node in definition.selection_set.selections if isinstance(node, Field))
+            return definition.name.value if definition.name else '', fields
+    return operation_name or '', ''
+
+
+def explainable(sql):
+    """ Whether ``sql`` can be run again under EXPLAIN ANALYZE: a SELECT that neither locks rows nor calls
+    functions that could have side effects, such as ``pg_notify`` or ``nextval``. """
+    select_list = SELECT_LIST_RE.match(sql)
+    if select_list is None or LOCKING_RE.search(sql):
+        return False
+    return all(name.lower() in PURE_CALLS for name in CALL_RE.findall(select_list.group(1)))
+
+
+def explain(alias, sql, params):
+    # In a transaction or savepoint that is always rolled back, so the statement leaves nothing behind
+    # and a failing EXPLAIN cannot break a transaction still in progress.
+    try:
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            try:
+                cursor.execute('SET LOCAL statement_timeout = %s', [int(settings.SLOW_EXPLAIN_TIMEOUT_SECONDS * 1000)])
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                transaction.set_rollback(True, using=alias)
+    except Exception as e:
+        return 'EXPLAIN failed: {}'.format(e)
+
+
+def save_plan(statement, alias, sql, params):
+    """ Explain ``statement`` and save the plan on its record and in the log. """
+    plan = explain(alias, sql, params)
+    SlowStatement.objects.filter(pk=statement.pk).update(explain=plan)
+    write({'operation': statement.operation_id, 'database': alias, 'sql': sql, 'explain': plan})
+
+
+def explain_later(statement, alias, sql, params):
+    """ Queue ``statement`` for the explainer thread, starting it on first use. """
+    global _explainer
+    with _explainer_lock:
+        if _explainer is None:
+            _explainer = threading.Thread(target=run_explains, name='slow-log-explainer', daemon=True)
+            _explainer.start()
+    try:
+        _explains.put_nowait((statement, alias, sql, params))
+    except queue.Full:
+        logger.warning('Too many slow SQL statements waiting to be explained; skipping one')
+
+
+def run_explains():
+    while True:
+        job = _explains.get()
+        if job is None:
+            connections.close_all()
+            return
+        try:
+            save_plan(*job)
+        except Exception:
+            logger.exception('Could not explain a slow SQL statement')
+        finally:
+            # The thread outlives any request, so it closes its connections as a request would.
+            close_old_connections()
+
+
+def stop_explainer():
+    """ Explain the statements already queued, then stop the explainer thread and close its connections. """
+    global _explainer
+    with _explainer_lock:
+        thread, _explainer = _explainer, None
+    if thread is not None:
+        _explains.put(None)
+        thread.join()
+
+
+def get_log():
+    """ The rotating JSON lines log, or None when ``SLOW_LOG_FILE`` is not set. """
+    global _log
+    if not settings.SLOW_LOG_FILE:
+        return None
+    with _log_lock:
+        if _log is None or _log.baseFilename != os.path.abspath(settings.SLOW_LOG_FILE):
+            os.makedirs(os.path.dirname(os.path.abspath(settings.SLOW_LOG_FILE)), exist_ok=True)
+            _log = RotatingFileHandler(settings.SLOW_LOG_FILE, maxBytes=settings.SLOW_LOG_MAX_BYTES,
+                                       backupCount=settings.SLOW_LOG_BACKUPS, encoding='utf-8')
+        return _log
+
+
+def write(entry):
+    handler = get_log()
+    if handler is not None:
+        handler.emit(logging.makeLogRecord({'msg': json.dumps(entry, cls=DjangoJSONEncoder)}))
+
+
+def record(trace, schema, query, variables, operation_name):
+    """ Save the operation traced by ``trace`` if it or one of its statements was slow. """
+    if not (trace.slow or trace.duration >= settings.SLOW_OPERATION_SECONDS):
+        return None
+    try:
+        statements, sampled = [], []
+        for position, (alias, sql, params, _, duration) in enumerate(trace.slowest()):
+            statement = SlowStatement(database=alias, duration=duration, sql=sql,
+                                      params=json.dumps(sanitize(params), default=str))
+            statements.append(statement)
+            worth_explaining = duration >= settings.SLOW_QUERY_SECONDS or position == 0
+            if worth_explaining and trace.operation_type == 'query' and params is not None \
+                    and explainable(sql) and random.random() < settings.SLOW_EXPLAIN_RATE:
+                sampled.append((statement, alias, sql, params))
+
+        operation_name, fields = describe(schema, query, operation_name) if query else (operation_name or '', '')
+        operation = SlowOperation.objects.create(
+            operation_type=trace.operation_type,
+            operation_name=operation_name,
+            fields=fields,
+            duration=trace.duration,
+            sql_count=trace.queries,
+            sql_duration=trace.sql_time,
+            query=query or '',
+            variables=json.dumps(sanitize(variables or {}), default=str),
+        )
+        for statement in statements:
+            statement.operation = operation
+        SlowStatement.objects.bulk_create(statements)
+        write({
+            'id': operation.pk,
+            'created': operation.created,
+            'operation_type': operation.operation_type,
+            'operation_name': operation.operation_name,
+            'fields': operation.fields,
+            'duration': operation.duration,
+            'sql_count': operation.sql_count,
+            'sql_duration': operation.sql_duration,
+            'query': operation.query,
+            'variables': sanitize(variables or {}),
+            'statements': [{'database': s.database, 'duration': s.duration, 'sql': s.sql, 'params': s.params}
+                           for s in statements],
+        })
+        for statement, alias, sql, params in sampled:
+            # on_commit runs the callback straight away outside a transaction.
+            transaction.on_commit(partial(explain_later, statement, alias, sql, params), using=alias)
+        return operation
+    except Exception:
+        # The slow log must never fail the request it describes.
+        logger.exception('Could not record a slow GraphQL operation')
+        return None
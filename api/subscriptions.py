@@ -0,0 +1,207 @@
+""" GraphQL over WebSocket, speaking the ``graphql-ws`` protocol of subscriptions-transport-ws.
+
+A client sends ``connection_init``, optionally with an ``Authorization``
+(or ``authToken``) JWT in its payload, then one ``start`` message per
+operation. Subscriptions stream a ``data`` message per event until the
+client sends ``stop`` or disconnects; queries and mutations send one
+``data`` message followed by ``complete``. Operations over the depth, page
+size or cost limits of ``api.cost`` get an ``error`` message instead.
+
+The event loop only reads and writes the socket. Operations start on the
+handler's thread pool, and so does the work for each event. Events reach
+the connection through ``deliver``, are queued and are processed one at a
+time, in order. A connection holds at most ``SUBSCRIPTION_QUEUE_SIZE``
+unprocessed events; events beyond that are dropped for it.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.http import HttpRequest
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+from graphql.execution.middleware import MiddlewareManager
+from promise import Promise
+from rx import Observable
+
+from . import routers
+from .cost import CostAnalysis, CostError
+from .documents import get_backend
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = 'graphql-ws'
+
+
+def resolved(result):
+    # Subscription events may complete to promises when fields use DataLoaders.
+    data = result.data
+    if Promise.is_thenable(data):
+        data = data.get()
+    elif data:
+        data = {key: value.get() if Promise.is_thenable(value) else value for key, value in data.items()}
+    payload = {'data': data}
+    if result.errors:
+        payload['errors'] = [{'message': str(error)} for error in result.errors]
+    return payload
+
+
+class Connection:
+    """ One WebSocket connection and the operations running on it. """
+
+    def __init__(self, schema, executor, scope, receive, send):
+        self.schema = schema
+        self.executor = executor
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.loop = asyncio.get_event_loop()
+        self.events = asyncio.Queue(maxsize=settings.SUBSCRIPTION_QUEUE_SIZE)
+        self.outbox = deque()
+        self.operations = {}
+        self.context = None
+
+    async def send_message(self, type, id=None, payload=None):
+        message = {'type': type}
+        if id is not None:
+            message['id'] = id
+        if payload is not None:
+            message['payload'] = payload
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        accept = {'type': 'websocket.accept'}
+        if PROTOCOL in self.scope.get('subprotocols', ()):
+            accept['subprotocol'] = PROTOCOL
+        await self.send(accept)
+
+        consumer = asyncio.ensure_future(self.consume())
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                try:
+                    data = json.loads(message.get('text') or message.get('bytes') or '')
+                except ValueError:
+                    await self.send_message('connection_error', payload={'message': 'Messages must be JSON.'})
+                    continue
+                if data.get('type') == 'connection_terminate':
+                    await self.send({'type': 'websocket.close'})
+                    break
+                await self.handle(data)
+        finally:
+            consumer.cancel()
+            for disposable in self.operations.values():
+                disposable.dispose()
+
+    async def handle(self, message):
+        kind, id = message.get('type'), message.get('id')
+        if kind == 'connection_init':
+            self.context = self.build_context(message.get('payload') or {})
+            await self.send_message('connection_ack')
+        elif kind == 'start':
+            if self.context is None:
+                await self.send_message('error', id, {'message': 'Send connection_init first.'})
+            elif id in self.operations:
+                await self.send_message('error', id, {'message': 'Operation {} is already running.'.format(id)})
+            else:
+                await self.start(id, message.get('payload') or {})
+        elif kind == 'stop':
+            disposable = self.operations.pop(id, None)
+            if disposable is not None:
+                disposable.dispose()
+                await self.send_message('complete', id)
+        else:
+            await self.send_message('error', id, {'message': 'Unknown message type {}.'.format(kind)})
+
+    def build_context(self, payload):
+        request = HttpRequest()
+        request.method = 'POST'
+        request.path = self.scope['path']
+        for name, value in self.scope.get('headers', ()):
+            key = name.decode('latin1').upper().replace('-', '_')
+            request.META['HTTP_' + key] = value.decode('latin1')
+        token = payload.get('Authorization') or payload.get('authToken')
+        if token:
+            request.META['HTTP_AUTHORIZATION'] = token if ' ' in token else 'JWT ' + token
+        request.user = AnonymousUser()
+        request.deliver = self.deliver
+        return request
+
+    def execute(self, payload):
+        # Runs on the pool: resolvers of the root field check permissions here. The thread may
+        # still hold the route of its last request; ReplicaMiddleware routes from the primary.
+        routers.reset()
+        try:
+            document = get_backend(self.schema).document_from_string(self.schema, payload.get('query'))
+            # The same depth, page size and cost limits as over HTTP.
+            errors = CostAnalysis(self.schema, document.document_ast, payload.get('variables'),
+                                  payload.get('operationName')).check()
+            if errors:
+                raise CostError(' '.join(error.message for error in errors))
+            return document.execute(
+                context_value=self.context,
+                variable_values=payload.get('variables'),
+                operation_name=payload.get('operationName'),
+                # Promise-wrapped root values would hide the Observable a subscription resolves to.
+                middleware=MiddlewareManager(*instantiate_middleware(graphene_settings.MIDDLEWARE),
+                                             wrap_in_promise=False),
+                allow_subscriptions=True,
+            )
+        finally:
+            routers.reset()
+            close_old_connections()
+
+    async def start(self, id, payload):
+        try:
+            result = await self.loop.run_in_executor(self.executor, self.execute, payload)
+        except Exception as e:
+            await self.send_message('error', id, {'message': str(e)})
+            return
+
+        if not isinstance(result, Observable):
+            await self.send_message('data', id, resolved(result))
+            await self.send_message('complete', id)
+            return
+
+        self.operations[id] = result.subscribe(
+            on_next=lambda event: self.outbox.append(('data', id, resolved(event))),
+            on_error=lambda error: self.outbox.append(('error', id, {'message': str(error)})),
+            on_completed=lambda: self.outbox.append(('complete', id, None)),
+        )
+
+    def deliver(self, on_next, event):
+        """ Queue ``event`` for ``on_next``; safe to call from any thread. """
+        self.loop.call_soon_threadsafe(self.enqueue, on_next, event)
+
+    def enqueue(self, on_next, event):
+        try:
+            self.events.put_nowait((on_next, event))
+        except asyncio.QueueFull:
+            logger.warning('Dropped a subscription event for a connection that is not keeping up.')
+
+    def process(self, on_next, event):
+        # Each event gets fresh DataLoaders so related objects are read as of that event, from
+        # the primary, which committed it and which a replica may not have replayed yet.
+        self.context.dataloaders = {}
+        routers.route(DEFAULT_DB_ALIAS)
+        try:
+            on_next(event)
+        finally:
+            routers.reset()
+            close_old_connections()
+
+    async def consume(self):
+        while True:
+            on_next, event = await self.events.get()
+            await self.loop.run_in_executor(self.executor, self.process, on_next, event)
+            while self.outbox:
+                await self.send_message(*self.outbox.popleft())
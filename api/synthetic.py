@@ -0,0 +1,240 @@
+""" Deterministic synthetic fleets for benchmarks and load tests.
+
+A ``Fleet`` describes customers, meters across vendor models and years of
+per-meter reads. Everything is derived from its seed: customer names come
+from a seeded ``Faker`` and each meter draws from its own ``random.Random``,
+so a fleet is identical on every run and any one meter's history can be
+regenerated without generating the others.
+
+Meters read every 15 minutes, hourly or daily. Usage follows a per-meter
+daily volume, a summer peak and, below daily cadence, morning and evening
+peaks. Registers are cumulative and wrap to zero past their last digit, and
+a ``rollover_rate`` of meters start close enough to wrapping to do so early.
+Meters also drop off the network for days at a time: water keeps flowing
+but no reads arrive, so the first read after a gap carries all of it.
+
+Meter serials start with the fleet's ``prefix``, which is how a generated
+fleet is found again, or replaced.
+"""
+import csv
+import datetime
+import io
+import math
+import random
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+
+from . import rates, response_cache, rollups
+from .management.commands.import_consumption import CopySource
+from .models import (Account_Asset_Link, Consumption, Customer, DailyUsage, Meter, MeterType, MonthlyUsage,
+                     Rate)
+
+VENDORS = (
+    ('Badger Meter', ('Recordall M25', 'E-Series Ultrasonic')),
+    ('Itron', ('Intelis', '100W+')),
+    ('Kamstrup', ('flowIQ 2200', 'MULTICAL 21')),
+    ('Neptune', ('T-10', 'MACH 10')),
+    ('Sensus', ('iPERL', 'SR II')),
+)
+
+CADENCES = {
+    '15min': datetime.timedelta(minutes=15),
+    'hourly': datetime.timedelta(hours=1),
+    'daily': datetime.timedelta(days=1),
+}
+# Share of meters on each cadence in a mixed fleet.
+CADENCE_WEIGHTS = {'15min': 1, 'hourly': 3, 'daily': 6}
+
+# Relative use in each hour of the day, local time.
+DIURNAL = (2, 1, 1, 1, 1, 3, 8, 10, 8, 5, 4, 4, 4, 4, 3, 3, 4, 6, 8, 8, 6, 5, 4, 3)
+
+LITERS_PER_GALLON = 3.785
+GALLON_SHARE = 0.15
+REGISTER_DIGITS = {'L': 7, 'G': 6}
+MAX_GAP_DAYS = 14
+
+SCALES = {
+    'small': {'customers': 50, 'meters': 60, 'years': 1, 'cadence': 'hourly'},
+    'medium': {'customers': 1000, 'meters': 1200, 'years': 2, 'cadence': 'mixed'},
+    'large': {'customers': 10000, 'meters': 12000, 'years': 3, 'cadence': 'mixed'},
+}
+
+COPY_SQL = 'COPY {} (meter_id, read_time, reading, unit_of_measure) FROM STDIN WITH (FORMAT csv)'
+
+MeterSpec = namedtuple('MeterSpec', 'index serial vendor model customer cadence unit register initial daily_usage')
+
+
+class Fleet:
+    """ A reproducible fleet of ``customers`` and ``meters`` with ``years`` of reads from ``start``. """
+
+    def __init__(self, customers=100, meters=120, years=1, cadence='mixed', seed=0,
+                 start=datetime.date(2019, 1, 1), gap_rate=0.002, rollover_rate=0.05):
+        if meters < customers:
+            raise ValueError('A fleet needs at least one meter per customer.')
+        if cadence != 'mixed' and cadence not in CADENCES:
+            raise ValueError('Unknown cadence {}.'.format(cadence))
+        self.customers = customers
+        self.meters = meters
+        self.years = years
+        self.cadence = cadence
+        self.seed = seed
+        self.start = start
+        self.end = start.replace(year=start.year + years)
+        self.gap_rate = gap_rate
+        self.rollover_rate = rollover_rate
+        self.prefix = 'SYN{}-'.format(seed)
+
+    def names(self):
+        """ (first_name, last_name) of every customer. """
+        faker = Faker()
+        faker.seed_instance(self.seed)
+        return [(faker.first_name(), faker.last_name()) for _ in range(self.customers)]
+
+    def specs(self):
+        """ A ``MeterSpec`` for every meter. """
+        rng = random.Random('{}:fleet'.format(self.seed))
+        models = [(vendor, model) for vendor, vendor_models in VENDORS for model in vendor_models]
+        cadences = sorted(CADENCE_WEIGHTS)
+        specs = []
+        for index in range(self.meters):
+            vendor, model = rng.choice(models)
+            # Every customer gets a meter; the rest go to customers with several.
+            customer = index if index < self.customers else rng.randrange(self.customers)
+            if self.cadence == 'mixed':
+                cadence = rng.choices(cadences, weights=[CADENCE_WEIGHTS[c] for c in cadences])[0]
+            else:
+                cadence = self.cadence
+            unit = 'G' if rng.random() < GALLON_SHARE else 'L'
+            daily_usage = rng.lognormvariate(math.log(350), 0.5)
+            if unit == 'G':
+                daily_usage /= LITERS_PER_GALLON
+            register = 10 ** REGISTER_DIGITS[unit]
+            if rng.random() < self.rollover_rate:
+                initial = register - int(daily_usage * rng.uniform(1, 60))
+            else:
+                initial = rng.randrange(register)
+            serial = '{}{}-{:07d}'.format(self.prefix, vendor[:3].upper(), index)
+            specs.append(MeterSpec(index, serial, vendor, model, customer, cadence, unit, register, initial,
+                                   daily_usage))
+        return specs
+
+    def reads(self, spec):
+        """ Yield (read_time, reading, unit_of_measure) for one meter, read times naive UTC. """
+        rng = random.Random('{}:meter:{}'.format(self.seed, spec.index))
+        step = CADENCES[spec.cadence]
+        tz = timezone.get_current_timezone()
+        moment = timezone.make_aware(datetime.datetime.combine(self.start, datetime.time.min), tz)
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+        end = timezone.make_aware(datetime.datetime.combine(self.end, datetime.time.min), tz)
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+        # Local hour of day is taken at a fixed offset; daylight saving does not matter here.
+        offset = tz.utcoffset(moment)
+        share = step.total_seconds() / 3600 / sum(DIURNAL)
+
+        total = float(spec.initial)
+        day = None
+        gap_until = None
+        while moment < end:
+            local = moment + offset
+            if local.toordinal() != day:
+                day = local.toordinal()
+                season = 1 + 0.25 * math.sin(2 * math.pi * (local.timetuple().tm_yday - 105) / 365.25)
+                daily = spec.daily_usage * season
+                if (gap_until is None or day >= gap_until) and rng.random() < self.gap_rate:
+                    gap_until = day + rng.randint(1, MAX_GAP_DAYS)
+            if step >= CADENCES['daily']:
+                total += daily * rng.uniform(0.6, 1.4)
+            else:
+                total += daily * DIURNAL[local.hour] * share * rng.uniform(0.6, 1.4)
+            if gap_until is None or day >= gap_until:
+                yield moment, int(total) % spec.register, spec.unit
+            moment += step
+
+    def exists(self):
+        return Meter.objects.filter(meter_serial__startswith=self.prefix).exists()
+
+    def delete(self):
+        """ Delete the fleet's customers and meters, with their reads and rollups. """
+        meters = Meter.objects.filter(meter_serial__startswith=self.prefix)
+        with transaction.atomic():
+            Customer.objects.filter(account_asset_link__meter__in=meters).delete()
+            meters.delete()
+        response_cache.invalidate_models(Customer, Meter, Account_Asset_Link, Consumption, DailyUsage,
+                                         MonthlyUsage)
+
+    def generate(self, batch_size=50, stdout=None):
+        """ Create the fleet and load its reads; return the number of reads. A failed run leaves nothing behind. """
+        try:
+            return self.load(self.create(stdout=stdout), batch_size=batch_size, stdout=stdout)
+        except BaseException:
+            self.delete()
+            raise
+
+    def create(self, stdout=None):
+        """ Create the fleet's customers, meter types, meters and account links; return meter ids by index. """
+        specs = self.specs()
+        with transaction.atomic():
+            types = {}
+            for vendor, model in sorted(set((spec.vendor, spec.model) for spec in specs)):
+                types[vendor, model] = MeterType.objects.get_or_create(meter_vendor=vendor, meter_model=model)[0]
+            customers = Customer.objects.bulk_create(
+                Customer(first_name=first, last_name=last) for first, last in self.names())
+            meters = Meter.objects.bulk_create(
+                Meter(meter_type=types[spec.vendor, spec.model], meter_serial=spec.serial) for spec in specs)
+            Account_Asset_Link.objects.bulk_create(
+                Account_Asset_Link(customer=customers[spec.customer], meter=meter)
+                for spec, meter in zip(specs, meters))
+            created_rates = self.create_rates()
+        if created_rates:
+            rates.invalidate()
+        response_cache.invalidate_models(Customer, MeterType, Meter, Account_Asset_Link, Rate)
+        if stdout:
+            stdout.write('Created {} customers and {} meters.'.format(len(customers), len(meters)))
+        return [meter.pk for meter in meters]
+
+    def create_rates(self):
+        # Bills need rates; a database that already has some keeps its own.
+        if Rate.objects.exists():
+            return []
+        return Rate.objects.bulk_create(
+            # Prices rise 3% a year.
+            Rate(rate=round(rate * 1.03 ** (year - self.start.year), 4),
+                 effective_start=datetime.date(year, 1, 1), effective_end=datetime.date(year, 12, 31),
+                 unit_of_measure=unit)
+            for year in range(self.start.year, self.end.year + 1)
+            for unit, rate in (('L', 0.0021), ('G', 0.0080)))
+
+    def load(self, meter_ids, batch_size=50, stdout=None):
+        """ COPY every meter's reads, ``batch_size`` meters per transaction, then rebuild their rollups. """
+        specs = self.specs()
+        loaded = 0
+        table = connection.ops.quote_name(Consumption._meta.db_table)
+        for first in range(0, len(specs), batch_size):
+            batch = specs[first:first + batch_size]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.copy_expert(COPY_SQL.format(table), CopySource(self.copy_lines(batch, meter_ids)))
+            loaded += self.copied
+            if stdout:
+                stdout.write('Loaded {} reads for {} of {} meters.'.format(
+                    loaded, first + len(batch), len(specs)))
+        rollups.rebuild(meter_ids)
+        response_cache.invalidate_models(Consumption, DailyUsage, MonthlyUsage)
+        return loaded
+
+    def copy_lines(self, specs, meter_ids):
+        # COPY csv lines for the reads of ``specs``, counted in ``copied``.
+        self.copied = 0
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for spec in specs:
+            meter_id = meter_ids[spec.index]
+            for read_time, reading, unit in self.reads(spec):
+                writer.writerow((meter_id, read_time.isoformat() + '+00', reading, unit))
+                self.copied += 1
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+
@@ -1,7 +1,18 @@
 import pytest
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.test import RequestFactory
 
 @pytest.fixture(scope='session')
 def django_db_setup(django_db_setup, django_db_blocker):
     with django_db_blocker.unblock():
         call_command('loaddata', 'fixtures.json')
+        call_command('rebuild_usage_rollups')
+
+
+@pytest.fixture
+def context():
+    """ A GraphQL request context for a superuser. """
+    request = RequestFactory().post('/graphql/')
+    request.user = get_user_model()(is_active=True, is_superuser=True)
+    return request
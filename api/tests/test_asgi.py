@@ -0,0 +1,126 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from api import routers
+from api.asgi import GraphQLASGIHandler
+from api.views import CachedGraphQLView
+
+
+def request(handler, path, body=b'', method='POST'):
+    """ Return a coroutine function sending one HTTP request to ``handler``, and the messages it sends back. """
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+    }
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await handler(scope, receive, send)
+
+    return run, sent
+
+
+def response(sent):
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def serve(handler, *requests):
+    runs = [request(handler, *args) for args in requests]
+
+    async def gather():
+        await asyncio.gather(*(run() for run, _ in runs))
+
+    asyncio.run(gather())
+    return [response(sent) for _, sent in runs]
+
+
+QUERY = json.dumps({'query': '{ __typename }'}).encode()
+
+
+@pytest.fixture
+def handler(settings):
+    settings.GRAPHQL_RESPONSE_CACHE_TTL = 0
+    return GraphQLASGIHandler(threads=2, max_pending=2)
+
+
+@pytest.mark.django_db
+class TestGraphQLASGIHandler:
+
+    def test_graphql_runs_on_pool(self, handler, monkeypatch):
+        threads = []
+        execute = CachedGraphQLView.execute_graphql_request
+
+        def record(self, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return execute(self, *args, **kwargs)
+
+        monkeypatch.setattr(CachedGraphQLView, 'execute_graphql_request', record)
+
+        [(status, body)] = serve(handler, ('/graphql/', QUERY))
+
+        assert status == 200
+        assert json.loads(body)['data'] == {'__typename': 'Query'}
+        assert threads[0].startswith('graphql')
+
+    def test_slow_requests_run_concurrently(self, handler, monkeypatch):
+        # Both requests must be inside the view at once to pass the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+        execute = CachedGraphQLView.execute_graphql_request
+
+        def slow(self, *args, **kwargs):
+            barrier.wait()
+            return execute(self, *args, **kwargs)
+
+        monkeypatch.setattr(CachedGraphQLView, 'execute_graphql_request', slow)
+
+        responses = serve(handler, ('/graphql/', QUERY), ('/graphql/', QUERY))
+
+        assert [status for status, _ in responses] == [200, 200]
+
+    def test_rejects_beyond_max_pending(self, handler):
+        handler.max_pending = 0
+
+        [(status, _)] = serve(handler, ('/graphql/', QUERY))
+
+        assert status == 503
+
+    def test_routes_do_not_outlive_the_request(self, handler, settings, monkeypatch):
+        # The primary stands in for a replica, so the query is routed but still reads real tables.
+        settings.REPLICA_DATABASES = ['default']
+        monkeypatch.setattr(routers, '_lags', {})
+        monkeypatch.setattr(routers, 'replica_lag', lambda alias: 0.0)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/graphql/', 'query_string': b'',
+                 'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')]}
+        query = json.dumps({'query': '{ meterRead(first: 1) { edges { node { id } } } }'}).encode()
+        routed, route = [], routers.route
+        monkeypatch.setattr(routers, 'route', lambda alias: routed.append(alias) or route(alias))
+
+        handler.respond(scope, io.BytesIO(query))
+
+        assert routed == ['default']
+        assert getattr(routers._state, 'alias', None) is None
+
+    def test_other_paths_use_django(self, handler):
+        [(status, _)] = serve(handler, ('/admin/login/', b'', 'GET'))
+
+        assert status == 200
+
+
+def test_entry_point_sets_its_settings():
+    environ = {name: value for name, value in os.environ.items() if name != 'DJANGO_SETTINGS_MODULE'}
+    imported = subprocess.run([sys.executable, '-c', 'import water_graph.asgi'], env=environ,
+                              capture_output=True, text=True, timeout=60)
+
+    assert imported.returncode == 0, imported.stderr
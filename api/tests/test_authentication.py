@@ -0,0 +1,61 @@
+import time
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from graphql_jwt.exceptions import JSONWebTokenExpired
+from graphql_jwt.shortcuts import get_token, get_user_by_token
+from api import authentication
+
+
+@pytest.fixture
+def user(monkeypatch, settings):
+    settings.AUTH_CACHE_CHECK_SECONDS = 3600
+    monkeypatch.setattr(authentication, '_tokens', None)
+    monkeypatch.setattr(authentication, '_users', None)
+    user = get_user_model().objects.create_user('reader', password='reader')
+    user.user_permissions.add(Permission.objects.get(codename='view_meter'))
+    return user
+
+
+@pytest.mark.django_db
+class TestAuthenticationCache:
+
+    def test_seen_token_needs_no_queries(self, user, django_assert_num_queries):
+        token = get_token(user)
+        get_user_by_token(token).has_perm('api.view_meter')
+
+        with django_assert_num_queries(0):
+            cached = get_user_by_token(token)
+            assert cached.has_perm('api.view_meter')
+            assert not cached.has_perm('api.add_meter')
+
+    def test_each_request_gets_its_own_user(self, user):
+        token = get_token(user)
+
+        assert get_user_by_token(token) is not get_user_by_token(token)
+
+    def test_cached_token_expires(self, user, monkeypatch):
+        token = get_token(user)
+        expires = authentication.decode_token(token)['exp']
+        monkeypatch.setattr(time, 'time', lambda: expires + 1)
+
+        with pytest.raises(JSONWebTokenExpired):
+            get_user_by_token(token)
+
+    def test_permission_change_invalidates(self, user):
+        token = get_token(user)
+        assert not get_user_by_token(token).has_perm('api.add_meter')
+
+        group = Group.objects.create(name='editors')
+        group.permissions.add(Permission.objects.get(codename='add_meter'))
+        user.groups.add(group)
+
+        assert get_user_by_token(token).has_perm('api.add_meter')
+
+    def test_login_does_not_invalidate(self, user, django_assert_num_queries):
+        token = get_token(user)
+        get_user_by_token(token)
+        user.save(update_fields=['last_login'])
+
+        with django_assert_num_queries(0):
+            get_user_by_token(token)
@@ -0,0 +1,117 @@
+import json
+import pytest
+from api.models import MeterType
+
+METER_TYPES = '{ metertypeRead(first: 10) { edges { node { meterModel } } } }'
+METER_TYPE_CREATE = """
+    mutation { metertypeCreate(input: {meterModel: "Batched", meterVendor: "Batched"}) { metertype { meterModel } } }
+"""
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+@pytest.fixture(autouse=True)
+def responses(settings):
+    settings.GRAPHQL_RESPONSE_CACHE_TTL = 60
+
+
+@pytest.fixture
+def admin_client(client, admin_user):
+    client.force_login(admin_user, backend=MODEL_BACKEND)
+    return client
+
+
+def post(client, body, **extra):
+    return client.post('/graphql/', json.dumps(body), content_type='application/json', **extra)
+
+
+def models(result):
+    return [edge['node']['meterModel'] for edge in result['data']['metertypeRead']['edges']]
+
+
+@pytest.mark.django_db
+class TestBatch:
+
+    def test_operations_run_in_order(self, admin_client):
+        before = models(post(admin_client, {'query': METER_TYPES}).json())
+
+        response = post(admin_client, [
+            {'id': 'before', 'query': METER_TYPES},
+            {'id': 'create', 'query': METER_TYPE_CREATE},
+            {'id': 'after', 'query': METER_TYPES},
+        ])
+
+        assert response.status_code == 200
+        results = response.json()
+        assert [result['id'] for result in results] == ['before', 'create', 'after']
+        assert [result['status'] for result in results] == [200, 200, 200]
+        assert models(results[0]) == before
+        assert results[1]['data']['metertypeCreate']['metertype']['meterModel'] == 'Batched'
+        # The query after the mutation is neither served from the cache nor from a loader.
+        assert 'Batched' not in before and 'Batched' in models(results[2])
+
+    def test_errors_do_not_stop_a_batch(self, admin_client):
+        results = post(admin_client, [{'query': '{ nope }'}, {'query': METER_TYPE_CREATE}]).json()
+
+        assert results[0]['status'] == 400
+        assert results[1]['status'] == 200
+        assert MeterType.objects.filter(meter_model='Batched').exists()
+
+    def test_atomic_batch_is_rolled_back(self, admin_client, settings):
+        results = post(admin_client, [
+            {'query': METER_TYPE_CREATE},
+            {'query': '{ nope }'},
+            {'query': METER_TYPES},
+        ], **{'HTTP_' + settings.GRAPHQL_BATCH_ATOMIC_HEADER.upper().replace('-', '_'): '1'}).json()
+
+        assert not MeterType.objects.filter(meter_model='Batched').exists()
+        assert results[0]['errors'] == [{'message': 'Rolled back: operation 1 of the batch failed.'}]
+        assert results[1]['status'] == 400
+        assert results[2] == {'errors': [{'message': 'Not run: operation 1 of the batch failed.'}],
+                              'id': None, 'status': 400}
+
+    def test_batches_are_limited(self, admin_client, settings):
+        settings.GRAPHQL_BATCH_MAX_OPERATIONS = 2
+
+        response = post(admin_client, [{'query': METER_TYPES}] * 3)
+        assert response.status_code == 400
+        assert response.json()['errors'][0]['message'] == 'A batch may hold at most 2 operations, but received 3.'
+        assert post(admin_client, []).status_code == 400
+        assert post(admin_client, ['{ nope }']).status_code == 400
+
+        settings.GRAPHQL_BATCH_MAX_OPERATIONS = 0
+        assert post(admin_client, [{'query': METER_TYPES}]).status_code == 400
+
+    def test_single_operations_are_unchanged(self, admin_client):
+        result = post(admin_client, {'query': METER_TYPES}).json()
+
+        assert 'id' not in result and 'status' not in result
+        assert 'metertypeRead' in result['data']
+
+    def test_unrunnable_operations_fail_alone(self, admin_client, settings):
+        results = post(admin_client, [
+            {'id': 'empty', 'query': ''},
+            {'id': 'unknown', 'extensions': {'persistedQuery': {'sha256Hash': 'unknown'}}},
+            {'id': 'read', 'query': METER_TYPES},
+        ]).json()
+
+        assert results[0] == {'errors': [{'message': 'Must provide query string.'}], 'id': 'empty', 'status': 400}
+        assert results[1] == {'errors': [{'message': 'PersistedQueryNotFound'}], 'id': 'unknown', 'status': 400}
+        assert results[2]['status'] == 200
+
+        results = post(admin_client, [{'query': METER_TYPE_CREATE}, {'query': ''}, {'query': METER_TYPES}],
+                       **{'HTTP_' + settings.GRAPHQL_BATCH_ATOMIC_HEADER.upper().replace('-', '_'): '1'}).json()
+        assert not MeterType.objects.filter(meter_model='Batched').exists()
+        assert [result['status'] for result in results] == [200, 400, 400]
+        assert results[2]['errors'] == [{'message': 'Not run: operation 1 of the batch failed.'}]
+
+    def test_batches_share_a_cost_budget(self, admin_client, settings):
+        cost = post(admin_client, {'query': METER_TYPES}).json()['extensions']['cost']['requested']
+        settings.GRAPHQL_BATCH_MAX_COST = cost * 2
+
+        results = post(admin_client, [{'query': METER_TYPES}] * 3).json()
+
+        assert [result['status'] for result in results] == [200, 200, 400]
+        assert results[1]['extensions']['cost']['batchRequested'] == cost * 2
+        assert results[2]['errors'][0]['message'] == \
+            'Operation cost {} would take the batch to a cost of {}, over its maximum of {}.'.format(
+                cost, cost * 3, cost * 2)
@@ -0,0 +1,87 @@
+import datetime
+import json
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from api.benchmarks import compare, percentile
+from api.models import Account_Asset_Link, Consumption, DailyUsage, Meter
+from api.synthetic import Fleet
+
+FLEET = ['--customers', '3', '--meters', '4', '--years', '1', '--cadence', 'daily', '--seed', '7', '--gap-rate', '0']
+
+
+class TestFleet:
+
+    def test_fleets_are_deterministic(self):
+        one, two = Fleet(customers=4, meters=6, seed=3), Fleet(customers=4, meters=6, seed=3)
+
+        assert one.names() == two.names()
+        assert one.specs() == two.specs()
+        spec = one.specs()[5]
+        assert list(one.reads(spec)) == list(two.reads(spec))
+        assert one.specs() != Fleet(customers=4, meters=6, seed=4).specs()
+
+    def test_every_customer_has_a_meter(self):
+        specs = Fleet(customers=5, meters=9).specs()
+
+        assert sorted(set(spec.customer for spec in specs)) == [0, 1, 2, 3, 4]
+        assert all(spec.serial.startswith('SYN0-') for spec in specs)
+
+    def test_reads_roll_over_and_have_gaps(self):
+        fleet = Fleet(customers=1, meters=1, cadence='hourly', gap_rate=0.05, rollover_rate=1)
+        reads = list(fleet.reads(fleet.specs()[0]))
+
+        assert reads[0][0] == datetime.datetime(2019, 1, 1)
+        steps = [b[0] - a[0] for a, b in zip(reads, reads[1:])]
+        assert min(steps) == datetime.timedelta(hours=1)
+        assert max(steps) > datetime.timedelta(days=1)
+        assert sum(b[1] < a[1] for a, b in zip(reads, reads[1:])) == 1
+
+
+@pytest.mark.django_db
+class TestGenerateFleet:
+
+    def test_generate(self):
+        call_command('generate_fleet', *FLEET)
+
+        meters = Meter.objects.filter(meter_serial__startswith='SYN7-')
+        assert meters.count() == 4
+        assert Account_Asset_Link.objects.filter(meter__in=meters).values('customer').distinct().count() == 3
+        assert Consumption.objects.filter(meter__in=meters).count() == 4 * 365
+        assert DailyUsage.objects.filter(meter__in=meters).exists()
+
+        with pytest.raises(CommandError, match='--replace'):
+            call_command('generate_fleet', *FLEET)
+        call_command('generate_fleet', *FLEET, '--replace')
+        assert Consumption.objects.filter(meter__meter_serial__startswith='SYN7-').count() == 4 * 365
+
+
+@pytest.mark.django_db
+class TestBenchmarkGraphQL:
+
+    def test_results_are_written_and_compared(self, tmp_path, capsys):
+        first, second = tmp_path / 'first.json', tmp_path / 'second.json'
+        call_command('benchmark_graphql', *FLEET, '--iterations', '2', '--warmup', '0', '--output', str(first))
+        call_command('benchmark_graphql', *FLEET, '--iterations', '1', '--warmup', '0', '--output', str(second),
+                     '--group', 'paged reads', '--compare', str(first))
+
+        results = json.loads(first.read_text())
+        assert results['fleet']['meters'] == 4
+        assert set(results['environment']) >= {'commit', 'created', 'python', 'django'}
+        for name, result in results['operations'].items():
+            assert result['errors'] == [], name
+            assert result['iterations'] == 2
+            assert result['seconds']['min'] <= result['seconds']['p95'] <= result['seconds']['max']
+        assert results['operations']['consumption_bulk_create']['queries'] > 0
+        assert 'consumption_pages' in capsys.readouterr().out
+        # Mutations are rolled back.
+        assert Consumption.objects.filter(meter__meter_serial__startswith='SYN7-').count() == 4 * 365
+        assert set(json.loads(second.read_text())['operations']) == {
+            'consumption_page', 'consumption_pages', 'meter_page'}
+
+    def test_percentile_and_compare(self):
+        assert percentile(list(range(1, 101)), 95) == 95
+        assert percentile([1.0], 95) == 1.0
+        before = {'operations': {'a': {'seconds': {'median': 0.2}}}}
+        after = {'operations': {'a': {'seconds': {'median': 0.1}}, 'b': {'seconds': {'median': 1}}}}
+        assert list(compare(before, after)) == [('a', 0.2, 0.1, -0.5)]
@@ -0,0 +1,48 @@
+import datetime
+import pytest
+from decimal import Decimal
+from api.billing import bill_lines, customer_bill, LITERS_PER_GALLON
+from api.models import DailyUsage, Rate
+
+
+@pytest.mark.django_db
+class TestBilling:
+
+    def test_customer_bill_prices_usage(self, django_db_setup):
+        # Joe Smith (customer 1) is linked to meter 2; November is billed at rate 2.
+        start, end = datetime.date(2019, 11, 1), datetime.date(2019, 12, 1)
+        usage = sum(DailyUsage.objects.filter(meter_id=2, day__gte=start, day__lt=end)
+                    .values_list('usage', flat=True))
+
+        lines, total = customer_bill(1, start, end)
+
+        assert len(lines) == 1
+        assert lines[0].meter_id == 2
+        assert lines[0].usage == usage
+        assert total == (usage * Decimal('0.1000')).quantize(Decimal('0.01'))
+
+    def test_usage_split_at_rate_change(self, django_db_setup):
+        Rate.objects.filter(effective_end=None).update(effective_end=datetime.date(2019, 11, 15))
+        Rate.objects.create(rate=Decimal('0.5000'), effective_start=datetime.date(2019, 11, 16),
+                            effective_end=None, unit_of_measure='G')
+
+        lines = bill_lines(datetime.date(2019, 11, 1), datetime.date(2019, 12, 1), [1])
+
+        assert [(line.rate_id, line.last_day) for line in lines] == [
+            (2, datetime.date(2019, 11, 15)),
+            (lines[1].rate_id, datetime.date(2019, 11, 30)),
+        ]
+        assert lines[1].first_day == datetime.date(2019, 11, 16)
+        gallons = lines[1]
+        liters = sum(DailyUsage.objects.filter(meter_id=2, day__gte=gallons.first_day,
+                                               day__lte=gallons.last_day).values_list('usage', flat=True))
+        assert gallons.unit == 'G'
+        assert float(gallons.usage) == pytest.approx(float(liters / LITERS_PER_GALLON))
+
+    def test_days_without_rate_are_unpriced(self, django_db_setup):
+        Rate.objects.all().delete()
+
+        lines = bill_lines(datetime.date(2019, 11, 1), datetime.date(2019, 12, 1))
+
+        assert lines
+        assert all(line.amount is None for line in lines)
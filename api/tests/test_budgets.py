@@ -0,0 +1,62 @@
+import pytest
+from api import budgets
+from api.benchmarks import OPERATIONS, Runner, Sample
+from water_graph.schema import schema
+
+
+@pytest.fixture(scope='module')
+def measurements(django_db_setup, django_db_blocker):
+    """ Every operation measured against the reference fleet, which is removed afterwards. """
+    with django_db_blocker.unblock():
+        fleet = budgets.reference_fleet()
+        try:
+            fleet.generate()
+            sample = Sample(fleet.prefix)
+            # Only statements and rows are checked here, so one timed run is enough.
+            with Runner(schema, iterations=1, warmup=1) as runner:
+                results = {operation.name: budgets.measure(runner, operation, sample) for operation in OPERATIONS}
+        finally:
+            fleet.delete()
+    return results
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name', [operation.name for operation in OPERATIONS])
+def test_operation_is_within_budget(measurements, name):
+    failures = budgets.check(name, measurements[name], budgets.load_baseline(), latency=False)
+
+    assert not failures, '\n'.join(failures)
+
+
+class TestCheck:
+
+    def test_failures_show_the_sql_diff(self):
+        measurement = {
+            'budget': {'statements': 2, 'rows': 100, 'p95': 0.1},
+            'statements': 3, 'rows': 20, 'p95': 0.05, 'errors': [],
+            'sql': ['SELECT "api_meter"."id" FROM "api_meter" LIMIT 101',
+                    'SELECT "api_metertype"."id" FROM "api_metertype" WHERE "api_metertype"."id" = %s',
+                    'SELECT "api_metertype"."id" FROM "api_metertype" WHERE "api_metertype"."id" = %s'],
+        }
+        baseline = {'meter_page': measurement['sql'][:1] + [
+            'SELECT "api_metertype"."id" FROM "api_metertype" WHERE "api_metertype"."id" IN (%s, ...)']}
+
+        failures = budgets.check('meter_page', measurement, baseline)
+
+        assert failures[0] == 'meter_page ran 3 SQL statements, over its budget of 2.'
+        diff = failures[1].splitlines()
+        assert '-' + baseline['meter_page'][1] in diff
+        assert diff.count('+' + measurement['sql'][1]) == 2
+
+    def test_latency_is_optional(self):
+        measurement = {'budget': {'statements': 2, 'rows': 100, 'p95': 0.1},
+                       'statements': 2, 'rows': 20, 'p95': 0.5, 'errors': [], 'sql': []}
+
+        assert budgets.check('meter_page', measurement, {}) == [
+            'meter_page took 500.0 ms at p95, over its budget of 100.0 ms.']
+        assert budgets.check('meter_page', measurement, {}, latency=False) == []
+
+    def test_normalize(self):
+        assert budgets.normalize('INSERT INTO t (a, b)\n  VALUES (%s, %s), (%s, %s), (%s, %s)') == \
+            'INSERT INTO t (a, b) VALUES (%s, ...), ...'
+        assert budgets.normalize('SELECT 1 WHERE id IN (%s, %s, %s)') == 'SELECT 1 WHERE id IN (%s, ...)'
@@ -0,0 +1,114 @@
+import datetime
+import json
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from api import partitions
+from api.models import Consumption
+
+
+CSV_READS = """meter_serial,read_time,reading,unit_of_measure
+1234nsdfnl12313,2020-03-01T00:00:00Z,504300,L
+kzx1234sss3778022,2020-03-01T00:00:00Z,497000,L
+unknown-meter,2020-03-01T00:00:00Z,10,L
+kzx1234sss3778022,2020-03-01T01:00:00Z,497100,L
+"""
+
+
+@pytest.mark.django_db
+class TestImportConsumption:
+
+    def test_import_csv(self, django_db_setup, tmp_path):
+        path = tmp_path / 'reads.csv'
+        path.write_text(CSV_READS)
+        count = Consumption.objects.count()
+
+        call_command('import_consumption', str(path), '--chunk-size', '2', '--skip-unknown')
+
+        assert Consumption.objects.count() == count + 3
+        assert Consumption.objects.filter(meter__meter_serial='kzx1234sss3778022',
+                                          read_time__year=2020).count() == 2
+
+    def test_import_resumes_from_offset(self, django_db_setup, tmp_path):
+        path = tmp_path / 'reads.csv'
+        path.write_text(CSV_READS)
+        count = Consumption.objects.count()
+
+        with pytest.raises(CommandError, match='--offset 2'):
+            call_command('import_consumption', str(path), '--chunk-size', '2')
+        assert Consumption.objects.count() == count + 2
+
+        call_command('import_consumption', str(path), '--offset', '3')
+        assert Consumption.objects.count() == count + 3
+
+    def test_import_skips_duplicates(self, django_db_setup, tmp_path):
+        path = tmp_path / 'reads.csv'
+        path.write_text(CSV_READS)
+        call_command('import_consumption', str(path), '--skip-unknown')
+        count = Consumption.objects.count()
+
+        call_command('import_consumption', str(path), '--skip-unknown', '--skip-duplicates')
+
+        assert Consumption.objects.count() == count
+
+    def test_import_ndjson(self, django_db_setup, tmp_path):
+        path = tmp_path / 'reads.ndjson'
+        path.write_text('\n'.join(json.dumps({
+            'meter_serial': '1234nsdfnl12313',
+            'read_time': '2020-03-01T0{}:00:00Z'.format(hour),
+            'reading': 504300 + hour,
+            'unit_of_measure': 'L',
+        }) for hour in range(5)))
+        count = Consumption.objects.count()
+
+        call_command('import_consumption', str(path))
+
+        assert Consumption.objects.count() == count + 5
+
+
+@pytest.mark.django_db
+class TestConsumptionPartitions:
+
+    def test_partitions_created_ahead(self, django_db_setup):
+        call_command('consumption_partitions', '--ahead', '2')
+
+        assert len(partitions.list_partitions()) >= 3
+
+    def test_create_partition_moves_default_rows(self, django_db_setup):
+        month = datetime.datetime(2019, 11, 1, tzinfo=datetime.timezone.utc)
+        count = Consumption.objects.filter(read_time__year=2019, read_time__month=11).count()
+
+        partitions.create_partition(month)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM api_consumption_p201911')
+            assert cursor.fetchone()[0] == count
+        assert Consumption.objects.filter(read_time__year=2019, read_time__month=11).count() == count
+
+    def test_expire_partitions(self, django_db_setup):
+        start = datetime.datetime(2019, 11, 1, tzinfo=datetime.timezone.utc)
+        partitions.create_partitions(start, 2)
+        count = Consumption.objects.count()
+        december = Consumption.objects.filter(read_time__year=2019, read_time__month=12).count()
+
+        expired = partitions.expire_partitions(datetime.datetime(2019, 12, 1, tzinfo=datetime.timezone.utc),
+                                               drop=True)
+
+        assert [name for name in expired if name.endswith('201911')]
+        assert Consumption.objects.count() == december
+        assert december < count
+
+
+@pytest.mark.django_db
+class TestBenchmarkConsumptionIndexes:
+
+    def test_reports_before_and_after_plans(self, django_db_setup, capsys):
+        call_command('benchmark_consumption_indexes', '--json')
+
+        results = json.loads(capsys.readouterr().out)
+        assert results['statements']
+        for entry in results['statements']:
+            assert entry['before']['cost'] > 0
+            assert entry['after']['cost'] > 0
+        assert Consumption.objects.count() > 0
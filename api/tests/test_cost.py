@@ -0,0 +1,94 @@
+import json
+import pytest
+from graphql.language.parser import parse
+from api.cost import CostAnalysis
+from water_graph.schema import schema
+
+NESTED = 'query { meterRead { edges { node { consumptionSet { edges { node { reading } } } } } } }'
+
+
+def analyze(query, variables=None):
+    return CostAnalysis(schema, parse(query), variables)
+
+
+def nodes(value):
+    """ Count the objects under ``node`` keys of a response. """
+    if isinstance(value, list):
+        return sum(nodes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nodes(item) + (key == 'node') for key, item in value.items())
+    return 0
+
+
+def post(client, query, variables=None):
+    return client.post('/graphql/', json.dumps({'query': query, 'variables': variables}),
+                       content_type='application/json')
+
+
+class TestCostAnalysis:
+
+    def test_connections_multiply_their_nodes(self):
+        cost = analyze('query($n: Int) { consumptionRead(first: $n) { edges { node { reading meter { meterSerial } } } } }',
+                       {'n': 10})
+
+        # The connection, ten reads and their ten meters.
+        assert (cost.cost, cost.depth) == (21, 5)
+        assert cost.check() == []
+
+    def test_unbounded_connections_cost_a_full_page(self):
+        assert analyze('{ consumptionRead { edges { node { reading } } } }').cost == 101
+        assert analyze(NESTED).cost == 1 + 100 + 100 * 101
+
+    def test_fragments_are_counted(self):
+        cost = analyze("""
+            query { meterRead(first: 5) { ...Meters } }
+            fragment Meters on MeterTyConnection { totalCount edges { node { id } } }
+        """)
+
+        assert cost.cost == 1 + 10 + 5
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('query', [
+        '{ meterRead(first: 2) { edges { node { consumptionSet { edges { node { reading } } } } } } }',
+        '{ customerRead { edges { node { accountAssetLinkSet { edges { node { id } } } } } } }',
+        '{ dailyUsageRead { edges { node { day } } } }',
+    ])
+    def test_connections_without_first_return_at_most_their_cost(self, django_db_setup, context, query):
+        result = schema.execute(query, context_value=context)
+
+        assert result.errors is None
+        assert 0 < nodes(result.data) <= analyze(query).cost
+
+    def test_usage_lists_are_sized_by_their_range(self):
+        cost = analyze("""{ consumptionUsage(meter: "TWV0ZXJUeToy", start: "2020-01-01T00:00:00",
+                                             end: "2020-01-07T00:00:00", interval: DAY) { usage } }""")
+
+        assert cost.cost == 7 * 10
+
+    def test_limits(self, settings):
+        settings.GRAPHQL_MAX_DEPTH = 3
+
+        errors = analyze('{ consumptionRead(last: 500) { edges { node { meter { id } } } } }').check()
+
+        assert [str(error) for error in errors] == [
+            'Requesting 500 records on the `consumptionRead` connection exceeds the `last` limit of 100 records.',
+            'Operation depth 5 exceeds the maximum depth of 3.',
+        ]
+
+
+@pytest.mark.django_db
+class TestCostLimits:
+
+    def test_cost_is_reported(self, admin_client):
+        response = post(admin_client, '{ meterRead(first: 2) { edges { node { meterSerial } } } }')
+
+        assert response.json()['extensions']['cost'] == {'requested': 3, 'maximum': 5000, 'depth': 4, 'maxDepth': 10}
+
+    def test_over_budget_operations_are_rejected(self, admin_client):
+        response = post(admin_client, NESTED)
+
+        assert response.status_code == 400
+        assert 'data' not in response.json()
+        assert response.json()['errors'][0]['message'].startswith(
+            'Operation cost 10201 exceeds the maximum cost of 5000.')
+        assert response.json()['extensions']['cost']['requested'] == 10201
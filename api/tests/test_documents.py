@@ -0,0 +1,68 @@
+import json
+import pytest
+from api import documents
+from api.documents import document_id
+
+QUERY = 'query Ping { __typename }'
+
+
+@pytest.fixture
+def backend(monkeypatch, settings, tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps({document_id(QUERY): QUERY}))
+    settings.GRAPHQL_PERSISTED_QUERIES = str(manifest)
+    settings.GRAPHQL_DOCUMENT_CACHE_SIZE = 2
+    monkeypatch.setattr(documents, '_backend', None)
+
+
+def post(client, body):
+    return client.post('/graphql/', json.dumps(body), content_type='application/json')
+
+
+@pytest.mark.django_db
+class TestCachedGraphQLView:
+
+    def test_repeated_query_is_a_hit(self, client, backend):
+        for _ in range(3):
+            response = post(client, {'query': '{ __typename }'})
+            assert response.json()['data'] == {'__typename': 'Query'}
+
+        stats = documents._backend.stats()
+        assert (stats['hits'], stats['misses']) == (2, 1)
+
+    def test_stats_are_exported_as_metrics(self, client, backend):
+        for _ in range(2):
+            post(client, {'query': '{ __typename }'})
+
+        text = client.get('/metrics').content.decode().splitlines()
+
+        assert 'graphql_document_cache_hits_total 1' in text
+        assert 'graphql_document_cache_max_size 2' in text
+        assert 'graphql_persisted_queries 1' in text
+
+    def test_invalid_query_is_not_cached(self, client, backend):
+        response = post(client, {'query': '{ noSuchField }'})
+
+        assert response.status_code == 400
+        assert documents._backend.stats()['size'] == 0
+
+    def test_persisted_query(self, client, backend):
+        body = {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': document_id(QUERY)}}}
+
+        response = post(client, body)
+
+        assert response.json()['data'] == {'__typename': 'Query'}
+        assert documents._backend.stats()['persisted'] == 1
+
+    def test_unknown_persisted_query(self, client, backend):
+        body = {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': '0' * 64}}}
+
+        response = post(client, body)
+
+        assert response.status_code == 400
+        assert 'PersistedQueryNotFound' in response.content.decode()
+
+    def test_persisted_only(self, client, backend, settings):
+        settings.GRAPHQL_PERSISTED_ONLY = 1
+
+        assert post(client, {'query': '{ __typename }'}).status_code == 400
@@ -0,0 +1,22 @@
+import django_filters
+import graphene
+from graphene_django.forms.converter import convert_form_field
+from water_graph.schema import schema
+
+
+def argument_type(field, argument):
+    return str(schema.get_query_type().fields[field].args[argument].type)
+
+
+class TestRangeFilters:
+
+    def test_declared_ranges_take_a_string(self):
+        assert argument_type('consumptionRead', 'readTime_Range') == 'String'
+        assert argument_type('dailyUsageRead', 'day_Range') == 'String'
+
+    def test_other_csv_filters_keep_their_type(self):
+        class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+            pass
+
+        assert isinstance(convert_form_field(NumberInFilter(field_name='reading').field), graphene.Float)
+        assert argument_type('consumptionRead', 'reading_Range') == 'Int'
@@ -4,6 +4,9 @@ import graphene
 import graphql_jwt.testcases
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission, AnonymousUser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from api.models import Consumption, DailyUsage
 
 
 @pytest.mark.django_db(transaction=True)
@@ -512,3 +515,281 @@ class TestAccountAssetLink(graphql_jwt.testcases.JSONWebTokenTestCase):
     def test_deleteAccountAssetLink(self):
         """ Test deleting an asset account link."""
         pass
+
+
+class TestConsumption(graphql_jwt.testcases.JSONWebTokenTestCase):
+    """ Consumption End Point Tests"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='test')
+
+        permission_view = Permission.objects.get(name='Can view consumption')
+        permission_add = Permission.objects.get(name='Can add consumption')
+        permission_update = Permission.objects.get(name='Can change consumption')
+        permission_delete = Permission.objects.get(name='Can delete consumption')
+        self.user.user_permissions.add(permission_add)
+        self.user.user_permissions.add(permission_view)
+        self.user.user_permissions.add(permission_update)
+        self.user.user_permissions.add(permission_delete)
+
+        self.client = graphql_jwt.testcases.JSONWebTokenClient()
+        self.client.authenticate(self.user)
+
+    # region Authenticated Consumption Tests
+    def test_create_and_delete_consumption(self):
+        """ Test creating and deleting a read keeps the daily rollup current. """
+
+        query_create = """
+            mutation ConsumptionCreate($input: ConsumptionCreateInput!){
+                consumptionCreate(input: $input){
+                    consumption{
+                        id
+                    }
+                }
+            }
+        """
+        last = Consumption.objects.filter(meter_id=1).latest('read_time')
+        variables = {
+            "input": {
+                "meter": 1,
+                "readTime": "2020-01-02T00:00:00+00:00",
+                "reading": last.reading + 75,
+                "unitOfMeasure": "L",
+            }
+        }
+
+        result = self.client.execute(query_create, variables)
+        assert result.errors is None
+        assert DailyUsage.objects.get(meter_id=1, day='2020-01-02').usage == 75
+
+        query_delete = """
+            mutation ConsumptionDelete($input: ConsumptionDeleteInput!){
+                consumptionDelete(input: $input){
+                    consumption{
+                        readTime
+                    }
+                }
+            }
+        """
+        variables = {"input": {"id": result.data['consumptionCreate']['consumption']['id']}}
+
+        result = self.client.execute(query_delete, variables)
+        assert result.errors is None
+        assert not DailyUsage.objects.filter(meter_id=1, day='2020-01-02').exists()
+
+    def test_read_consumption_range(self):
+        """ Test reading a meter's consumption between two read times. """
+
+        query = """
+            query ConsumptionRead($meter: ID!, $range: String!){
+                consumptionRead(meter: $meter, readTime_Range: $range){
+                    edges{
+                        node{
+                            readTime
+                            reading
+                        }
+                    }
+                }
+            }
+        """
+
+        variables = {
+            "meter": "TWV0ZXJUeToy",
+            "range": "2019-11-02T01:00:00+00:00,2019-11-02T05:00:00+00:00",
+        }
+
+        result = self.client.execute(query, variables=variables)
+        assert result.errors is None
+        assert len(result.data['consumptionRead']['edges']) == 5
+
+    def test_read_consumption_joins_relations(self):
+        """ Test related meters and meter types are joined into the page query. """
+
+        query = """
+            query {
+                consumptionRead(first: 100){
+                    edges{
+                        node{
+                            meter{
+                                meterSerial
+                                meterType{
+                                    meterVendor
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            result = self.client.execute(query)
+        assert result.errors is None
+        assert len(result.data['consumptionRead']['edges']) == 100
+        statements = [q['sql'] for q in captured.captured_queries]
+        assert not [sql for sql in statements if sql.startswith('SELECT') and ' FROM "api_meter' in sql]
+        page = [sql for sql in statements if 'LIMIT 101' in sql]
+        assert len(page) == 1 and 'INNER JOIN "api_metertype"' in page[0]
+
+    def test_consumption_usage(self):
+        """ Test daily usage is the difference between end of day readings. """
+
+        query = """
+            query ConsumptionUsage($meter: ID!, $start: DateTime!, $end: DateTime!){
+                consumptionUsage(meter: $meter, start: $start, end: $end, interval: DAY){
+                    bucketStart
+                    usage
+                    unit
+                }
+            }
+        """
+
+        variables = {
+            "meter": "TWV0ZXJUeToy",
+            "start": "2019-11-03T00:00:00+00:00",
+            "end": "2019-11-05T00:00:00+00:00",
+        }
+
+        result = self.client.execute(query, variables=variables)
+        assert result.errors is None
+        buckets = result.data['consumptionUsage']
+        assert [b['bucketStart'] for b in buckets] == ['2019-11-03T00:00:00+00:00', '2019-11-04T00:00:00+00:00']
+
+        readings = dict(Consumption.objects.filter(
+            meter_id=2, read_time__hour=23, read_time__range=('2019-11-02', '2019-11-05')
+        ).values_list('read_time__day', 'reading'))
+        assert buckets[0]['usage'] == readings[3] - readings[2]
+        assert buckets[1]['usage'] == readings[4] - readings[3]
+        assert buckets[0]['unit'] == 'L'
+
+    def test_bulk_create_consumption(self):
+        """ Test creating many consumption records in one mutation. """
+
+        query = """
+            mutation ConsumptionBulkCreate($input: ConsumptionBulkCreateInput!){
+                consumptionBulkCreate(input: $input){
+                    createdCount
+                    errors{
+                        index
+                        message
+                    }
+                }
+            }
+        """
+
+        variables = {
+            "input": {
+                "reads": [
+                    {
+                        "meterSerial": "kzx1234sss3778022",
+                        "readTime": "2020-02-01T00:00:00+00:00",
+                        "reading": 500000,
+                        "unitOfMeasure": "L",
+                    },
+                    {
+                        "meter": "TWV0ZXJUeToy",
+                        "readTime": "2020-02-01T01:00:00+00:00",
+                        "reading": 500100,
+                        "unitOfMeasure": "L",
+                    },
+                    {
+                        "meterSerial": "does-not-exist",
+                        "readTime": "2020-02-01T01:00:00+00:00",
+                        "reading": 1,
+                        "unitOfMeasure": "L",
+                    },
+                    {
+                        "meterSerial": "kzx1234sss3778022",
+                        "readTime": "2020-02-01T02:00:00+00:00",
+                        "reading": 500200,
+                        "unitOfMeasure": "X",
+                    },
+                    {
+                        "meterSerial": "kzx1234sss3778022",
+                        "readTime": "2019-11-02T01:00:00+00:00",
+                        "reading": 833,
+                        "unitOfMeasure": "L",
+                    },
+                ]
+            }
+        }
+
+        result = self.client.execute(query, variables=variables)
+        assert result.errors is None
+        assert result.data['consumptionBulkCreate']['createdCount'] == 2
+        errors = result.data['consumptionBulkCreate']['errors']
+        assert [e['index'] for e in errors] == [2, 3, 4]
+
+    # endregion Authenticated Consumption Tests
+
+
+class TestCustomerBill(graphql_jwt.testcases.JSONWebTokenTestCase):
+    """ Billing End Point Tests"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='test')
+
+        for name in ('Can view customer', 'Can view consumption', 'Can view rate'):
+            self.user.user_permissions.add(Permission.objects.get(name=name))
+
+        self.client = graphql_jwt.testcases.JSONWebTokenClient()
+        self.client.authenticate(self.user)
+
+    def test_customer_bill(self):
+        """ Test a customer's November usage is billed at the November rate. """
+
+        query = """
+            query CustomerBill($customer: ID!, $start: Date!, $end: Date!){
+                customerBill(customer: $customer, periodStart: $start, periodEnd: $end){
+                    lines{
+                        meter{
+                            meterSerial
+                        }
+                        rate
+                        usage
+                        amount
+                    }
+                    total
+                }
+            }
+        """
+
+        variables = {"customer": "Q3VzdG9tZXJUeXBlOjE=", "start": "2019-11-01", "end": "2019-12-01"}
+
+        result = self.client.execute(query, variables=variables)
+        assert result.errors is None
+        bill = result.data['customerBill']
+        assert [line['meter']['meterSerial'] for line in bill['lines']] == ['kzx1234sss3778022']
+        assert bill['lines'][0]['rate'] == '0.1000'
+        assert bill['total'] == bill['lines'][0]['amount']
+
+
+class TestRate(graphql_jwt.testcases.JSONWebTokenTestCase):
+    """ Rate End Point Tests"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='test')
+        self.user.user_permissions.add(Permission.objects.get(name='Can view rate'))
+
+        self.client = graphql_jwt.testcases.JSONWebTokenClient()
+        self.client.authenticate(self.user)
+
+    def test_rate_at(self):
+        """ Test looking up the rate in effect on a date. """
+
+        query = """
+            query RateAt($date: Date!){
+                rateAt(date: $date, unitOfMeasure: "L"){
+                    rate
+                    effectiveStart
+                }
+            }
+        """
+
+        result = self.client.execute(query, variables={"date": "2019-10-15"})
+        assert result.errors is None
+        assert result.data['rateAt'] == {"rate": 0.08, "effectiveStart": "2019-10-01"}
+
+        result = self.client.execute(query, variables={"date": "2019-09-15"})
+        assert result.errors is None
+        assert result.data['rateAt'] is None
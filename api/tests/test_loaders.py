@@ -0,0 +1,102 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from graphene_django.settings import graphene_settings
+from water_graph.schema import schema
+from api.models import Consumption
+
+
+@pytest.mark.django_db
+class TestRelatedLoader:
+
+    def test_reverse_pages_load_in_one_query(self, django_db_setup, context):
+        query = """
+            query {
+                meterRead{
+                    edges{
+                        node{
+                            meterSerial
+                            consumptionSet(first: 2, after: "YXJyYXljb25uZWN0aW9uOjA="){
+                                pageInfo{
+                                    hasNextPage
+                                }
+                                edges{
+                                    node{
+                                        reading
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        assert len([q for q in captured.captured_queries if 'api_consumption' in q['sql']]) == 1
+
+        for edge in result.data['meterRead']['edges']:
+            meter = edge['node']
+            expected = Consumption.objects.filter(meter__meter_serial=meter['meterSerial']).order_by('pk')[1:3]
+            page = meter['consumptionSet']
+            assert [e['node']['reading'] for e in page['edges']] == [c.reading for c in expected]
+            assert page['pageInfo']['hasNextPage'] is True
+
+    def test_filtered_reverse_connection_is_not_batched(self, django_db_setup, context):
+        query = """
+            query {
+                meterRead{
+                    edges{
+                        node{
+                            consumptionSet(reading: 833){
+                                edges{
+                                    node{
+                                        reading
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+
+        result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        readings = [e['node']['reading'] for m in result.data['meterRead']['edges']
+                    for e in m['node']['consumptionSet']['edges']]
+        assert readings == [833]
+
+    def test_unbounded_reverse_pages_hold_max_limit(self, django_db_setup, context):
+        query = """
+            query {
+                meterRead(first: 2){
+                    edges{
+                        node{
+                            meterSerial
+                            all: consumptionSet{ pageInfo{ hasNextPage } edges{ node{ reading } } }
+                            last: consumptionSet(last: 2){ edges{ node{ reading } } }
+                        }
+                    }
+                }
+            }
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        fetches = [q['sql'] for q in captured.captured_queries
+                   if 'api_consumption' in q['sql'] and 'COUNT' not in q['sql']]
+        assert fetches and all('LIMIT' in sql for sql in fetches)
+
+        limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        for edge in result.data['meterRead']['edges']:
+            meter = edge['node']
+            readings = Consumption.objects.filter(meter__meter_serial=meter['meterSerial']).order_by('pk')
+            assert readings.count() > limit
+            assert [e['node']['reading'] for e in meter['all']['edges']] == [c.reading for c in readings[:limit]]
+            assert meter['all']['pageInfo']['hasNextPage'] is True
+            assert [e['node']['reading'] for e in meter['last']['edges']] == [
+                c.reading for c in readings.reverse()[:2]][::-1]
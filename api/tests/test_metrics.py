@@ -0,0 +1,133 @@
+import json
+import os
+import subprocess
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from api import metrics
+from api.metrics import Counter, Histogram
+
+QUERY = '{ meterRead(first: 2) { edges { node { meterSerial meterType { meterModel } } } } }'
+
+
+def post(client, **headers):
+    return client.post('/graphql/', json.dumps({'query': QUERY}), content_type='application/json', **headers)
+
+
+def sample(text, line):
+    """ Return the value of the sample starting with ``line`` in a metrics page. """
+    for row in text.splitlines():
+        if row.startswith(line + ' '):
+            return float(row.rsplit(' ', 1)[1])
+    return None
+
+
+class TestExposition:
+
+    def test_histogram(self):
+        histogram = Histogram('demo_seconds', 'Demo.', ['field'], buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'Query.x"y')
+
+        assert list(histogram.render(dict((tuple(l), v) for l, v in histogram.snapshot()))) == [
+            '# HELP demo_seconds Demo.',
+            '# TYPE demo_seconds histogram',
+            'demo_seconds_bucket{field="Query.x\\"y",le="0.1"} 2',
+            'demo_seconds_bucket{field="Query.x\\"y",le="1"} 3',
+            'demo_seconds_bucket{field="Query.x\\"y",le="+Inf"} 4',
+            'demo_seconds_sum{field="Query.x\\"y"} 3.65',
+            'demo_seconds_count{field="Query.x\\"y"} 4',
+        ]
+
+    @pytest.fixture
+    def errors(self, settings, tmp_path, monkeypatch):
+        errors = Counter('demo_errors_total', 'Demo.', ['operation_type'])
+        errors.inc('query')
+        monkeypatch.setattr(metrics, 'METRICS', (errors,))
+        settings.METRICS_DIR = str(tmp_path)
+        return errors
+
+    def test_processes_are_summed(self, errors, tmp_path):
+        (tmp_path / '{}-a.json'.format(os.getppid())).write_text(json.dumps({'demo_errors_total': [[['query'], [2]]]}))
+
+        assert sample(metrics.render(), 'demo_errors_total{operation_type="query"}') == 3
+
+    def test_exited_processes_are_retired(self, errors, tmp_path):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        (tmp_path / '{}-a.json'.format(exited.pid)).write_text(json.dumps({'demo_errors_total': [[['query'], [2]]]}))
+        # A file left by an earlier process with this process's pid.
+        reused = tmp_path / '{}-b.json'.format(os.getpid())
+        reused.write_text(json.dumps({'demo_errors_total': [[['query'], [4]]]}))
+        os.utime(reused, (0, 0))
+
+        assert sample(metrics.render(), 'demo_errors_total{operation_type="query"}') == 7
+        assert sorted(path.name for path in tmp_path.glob('*.json')) == [metrics.process_file(), 'retired.json']
+        errors.inc('query')
+        assert sample(metrics.render(), 'demo_errors_total{operation_type="query"}') == 8
+
+    def test_gauges_of_exited_processes_are_dropped(self, errors, tmp_path, monkeypatch):
+        pool = metrics.Sampled('demo_connections', 'Demo.', ['pool'], lambda: {('default',): 1})
+        monkeypatch.setattr(metrics, 'METRICS', (errors, pool))
+        monkeypatch.setattr(metrics, 'GAUGES', {pool.name})
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        (tmp_path / '{}-a.json'.format(exited.pid)).write_text(json.dumps({
+            'demo_errors_total': [[['query'], [2]]], 'demo_connections': [[['default'], [5]]]}))
+
+        text = metrics.render()
+
+        assert '# TYPE demo_connections gauge' in text
+        assert sample(text, 'demo_connections{pool="default"}') == 1
+        assert sample(text, 'demo_errors_total{operation_type="query"}') == 3
+
+
+@pytest.fixture
+def staff_client(client):
+    user = get_user_model().objects.create_superuser('metrics', 'metrics@example.com', 'metrics')
+    client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+    return client
+
+
+@pytest.mark.django_db
+class TestTracing:
+
+    def test_operations_and_resolvers_are_measured(self, staff_client):
+        before = metrics.render()
+        post(staff_client)
+        after = staff_client.get('/metrics').content.decode()
+
+        count = 'graphql_operation_duration_seconds_count{operation_type="query"}'
+        assert sample(after, count) == (sample(before, count) or 0) + 1
+        assert sample(after, 'graphql_resolver_duration_seconds_count{field="Query.meterRead"}')
+        assert sample(after, 'graphql_operation_sql_queries_count{operation_type="query"}')
+        assert 'field="MeterTy.meterSerial"' not in after
+
+    def test_apollo_tracing_on_request(self, staff_client):
+        assert 'tracing' not in post(staff_client).json()['extensions']
+
+        tracing = post(staff_client, HTTP_X_GRAPHQL_TRACING='1').json()['extensions']['tracing']
+
+        assert tracing['version'] == 1
+        assert tracing['duration'] >= tracing['execution']['resolvers'][0]['duration']
+        paths = [resolver['path'] for resolver in tracing['execution']['resolvers']]
+        assert ['meterRead'] in paths
+        assert ['meterRead', 'edges', 0, 'node', 'meterSerial'] in paths
+
+    def test_slowest_statements_are_kept(self, staff_client, settings):
+        settings.SLOW_LOG_STATEMENTS = 2
+        trace = post(staff_client).wsgi_request.graphql_trace
+
+        slowest = trace.slowest()
+        assert trace.queries > 2 and len(slowest) == 2
+        assert slowest[0].duration >= slowest[1].duration
+        assert trace.rows >= 2 and not trace.slow
+
+    def test_database_pools_are_exported(self, staff_client):
+        post(staff_client)
+        text = staff_client.get('/metrics').content.decode()
+
+        pool = 'default:' + connection.settings_dict['NAME']
+        assert sample(text, 'database_pool_checkouts_total{{pool="{}"}}'.format(pool)) >= 1
+        assert sample(text, 'database_pool_open_connections{{pool="{}"}}'.format(pool)) >= 1
+        assert '# TYPE database_pool_open_connections gauge' in text
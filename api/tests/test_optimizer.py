@@ -0,0 +1,50 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from water_graph.schema import schema
+
+
+@pytest.mark.django_db
+class TestOptimizer:
+
+    def test_nested_query_uses_fixed_statements(self, django_db_setup, context):
+        query = """
+            fragment Meter on MeterTy {
+                meterSerial
+                meterType{
+                    meterVendor
+                }
+            }
+            query {
+                customerRead{
+                    edges{
+                        node{
+                            lastName
+                            accountAssetLinkSet{
+                                edges{
+                                    node{
+                                        meter{
+                                            ...Meter
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        statements = [q['sql'] for q in captured.captured_queries]
+        # Customers, then one statement each for the links, their meters and the meter types.
+        assert len(statements) == 4
+        assert '"api_customer"."first_name"' not in statements[0]
+        assert ['"api_account_asset_link"' in statements[1], '"api_meter"' in statements[2],
+                '"api_metertype"' in statements[3]] == [True, True, True]
+        serials = sorted(link['node']['meter']['meterSerial']
+                         for customer in result.data['customerRead']['edges']
+                         for link in customer['node']['accountAssetLinkSet']['edges'])
+        assert serials == ['1234nsdfnl12313', 'kzx1234sss3778022']
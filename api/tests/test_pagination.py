@@ -0,0 +1,134 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from graphene_django.settings import graphene_settings
+from water_graph.schema import schema
+from api.models import Consumption, DailyUsage
+
+QUERY = """
+    query Page($first: Int, $after: String, $last: Int, $before: String){
+        consumptionRead(meter: "TWV0ZXJUeToy", first: $first, after: $after, last: $last, before: $before){
+            pageInfo{
+                hasNextPage
+                hasPreviousPage
+                startCursor
+                endCursor
+            }
+            edges{
+                node{
+                    readTime
+                }
+            }
+        }
+    }
+"""
+
+
+def execute(context, **variables):
+    result = schema.execute(QUERY, variable_values=variables, context_value=context)
+    assert result.errors is None, result.errors
+    return result.data['consumptionRead']
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+
+    def test_pages_forward_in_read_time_order(self, django_db_setup, context):
+        expected = [r.isoformat() for r in Consumption.objects.filter(meter_id=2)
+                    .order_by('read_time', 'id').values_list('read_time', flat=True)[:10]]
+
+        first = execute(context, first=4)
+        second = execute(context, first=4, after=first['pageInfo']['endCursor'])
+        third = execute(context, first=2, after=second['pageInfo']['endCursor'])
+
+        seen = [e['node']['readTime'] for page in (first, second, third) for e in page['edges']]
+        assert seen == expected
+        assert first['pageInfo']['hasPreviousPage'] is False
+        assert second['pageInfo']['hasPreviousPage'] is True
+        assert third['pageInfo']['hasNextPage'] is True
+
+    def test_pages_backward(self, django_db_setup, context):
+        forward = execute(context, first=6)
+        back = execute(context, last=3, before=forward['pageInfo']['endCursor'])
+
+        assert [e['node']['readTime'] for e in back['edges']] == \
+            [e['node']['readTime'] for e in forward['edges'][2:5]]
+        assert back['pageInfo']['hasPreviousPage'] is True
+        assert back['pageInfo']['hasNextPage'] is True
+
+    def test_last_page(self, django_db_setup, context):
+        last = Consumption.objects.filter(meter_id=2).latest('read_time')
+
+        page = execute(context, last=1)
+
+        assert page['edges'][0]['node']['readTime'] == last.read_time.isoformat()
+        assert page['pageInfo']['hasPreviousPage'] is True
+        assert execute(context, first=5, after=page['pageInfo']['endCursor'])['edges'] == []
+
+    def test_invalid_cursor(self, django_db_setup, context):
+        result = schema.execute(QUERY, variable_values={'first': 1, 'after': 'YXJyYXljb25uZWN0aW9uOjA='},
+                                context_value=context)
+        assert 'Invalid cursor' in str(result.errors[0])
+
+
+@pytest.mark.django_db
+class TestTotalCount:
+
+    def test_first_page_does_not_count(self, django_db_setup, context):
+        query = '{ consumptionRead(first: 5){ edges{ node{ id } } } }'
+
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        assert not [q for q in captured.captured_queries if 'COUNT(' in q['sql'].upper()]
+
+    def test_exact_count(self, django_db_setup, context):
+        query = '{ consumptionRead(meter: "TWV0ZXJUeToy"){ totalCount(exact: true) } }'
+
+        result = schema.execute(query, context_value=context)
+        assert result.errors is None
+        assert result.data['consumptionRead']['totalCount'] == Consumption.objects.filter(meter_id=2).count()
+
+    def test_estimated_count(self, django_db_setup, context, settings):
+        settings.CONNECTION_EXACT_COUNT_THRESHOLD = 0
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_consumption')
+
+        result = schema.execute('{ consumptionRead{ totalCount } }', context_value=context)
+        assert result.errors is None
+        assert result.data['consumptionRead']['totalCount'] == pytest.approx(Consumption.objects.count(), rel=0.1)
+
+    def test_offset_connection_pages_without_count(self, django_db_setup, context):
+        query = """
+            query Customers($after: String){
+                customerRead(first: 1, after: $after){
+                    totalCount
+                    pageInfo{
+                        hasNextPage
+                        endCursor
+                    }
+                }
+            }
+        """
+
+        first = schema.execute(query, context_value=context).data['customerRead']
+        second = schema.execute(query, variable_values={'after': first['pageInfo']['endCursor']},
+                                context_value=context).data['customerRead']
+
+        assert first['totalCount'] == 2
+        assert first['pageInfo']['hasNextPage'] is True
+        assert second['pageInfo']['hasNextPage'] is False
+
+    def test_offset_connection_pages_are_capped(self, django_db_setup, context):
+        with CaptureQueriesContext(connection) as captured:
+            result = schema.execute('{ dailyUsageRead{ pageInfo{ hasNextPage } edges{ node{ day } } } }',
+                                    context_value=context)
+        assert result.errors is None
+
+        limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        rows = DailyUsage.objects.count()
+        page = result.data['dailyUsageRead']
+        assert len(page['edges']) == min(rows, limit)
+        assert page['pageInfo']['hasNextPage'] is (rows > limit)
+        fetch, = [q['sql'] for q in captured.captured_queries if '"api_dailyusage"' in q['sql']]
+        assert fetch.endswith('LIMIT {}'.format(limit + 1))
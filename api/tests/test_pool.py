@@ -0,0 +1,151 @@
+import threading
+import time
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from psycopg2 import extensions
+from api.pooled.pool import ConnectionPool, PoolTimeout, pool_stats
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.alive = True
+        self.rollbacks = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, sql):
+                if not connection.alive:
+                    raise extensions.QueryCanceledError('server closed the connection')
+        return Cursor()
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def pool(**options):
+    return ConnectionPool(FakeConnection, **options)
+
+
+class TestConnectionPool:
+
+    def test_reuses_returned_connections(self):
+        p = pool(size=2)
+        first = p.checkout()
+        p.checkin(first)
+
+        assert p.checkout() is first
+        assert (p.stats()['connects'], p.stats()['checkouts']) == (1, 2)
+
+    def test_rolls_back_open_transactions_on_checkin(self):
+        p = pool()
+        conn = p.checkout()
+        conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        p.checkin(conn)
+
+        assert conn.rollbacks == 1
+        assert p.checkout() is conn
+
+    def test_shrinks_back_to_size_on_checkin(self):
+        p = pool(size=1, overflow=1)
+        first, second = p.checkout(), p.checkout()
+        p.checkin(first)
+        p.checkin(second)
+
+        assert first.closed and not second.closed
+        assert p.stats()['open'] == 1
+
+    def test_waits_for_a_returned_connection(self):
+        p = pool(size=1, overflow=0, timeout=1)
+        conn = p.checkout()
+        threading.Timer(0.1, p.checkin, [conn]).start()
+
+        assert p.checkout() is conn
+        assert p.stats()['waits'] == 1
+        assert p.stats()['wait_time'] >= 0.1
+
+    def test_times_out_when_exhausted(self):
+        p = pool(size=1, overflow=0, timeout=0.05)
+        p.checkout()
+
+        with pytest.raises(PoolTimeout):
+            p.checkout()
+        assert (p.stats()['timeouts'], p.stats()['checked_out']) == (1, 1)
+
+    def test_recycles_idle_and_old_connections(self):
+        p = pool(recycle=0.05)
+        conn = p.checkout()
+        p.checkin(conn)
+        time.sleep(0.06)
+        assert p.checkout() is not conn and conn.closed
+
+        p = pool(max_lifetime=0.05)
+        conn = p.checkout()
+        time.sleep(0.06)
+        p.checkin(conn)
+        assert p.checkout() is not conn
+        assert p.stats()['recycled'] == 1
+
+    def test_replaces_connections_that_fail_pre_ping(self):
+        p = pool(pre_ping=0)
+        conn = p.checkout()
+        p.checkin(conn)
+        conn.alive = False
+
+        assert p.checkout() is not conn
+        assert p.stats()['ping_failures'] == 1
+        assert p.stats()['open'] == 1
+
+
+@pytest.mark.django_db
+class TestPooledBackend:
+
+    def test_closed_connections_return_to_the_pool(self):
+        wrapper = connections['default'].__class__(connection.settings_dict, alias='pool-test')
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.close()
+        wrapper.ensure_connection()
+
+        assert wrapper.connection is raw
+        assert pool_stats()['pool-test:' + connection.settings_dict['NAME']]['checkouts'] == 2
+        wrapper.close()
+
+    def test_connections_closed_in_a_transaction_are_discarded(self, monkeypatch):
+        wrapper = connections['default'].__class__(connection.settings_dict, alias='pool-atomic-test')
+        monkeypatch.setattr(connections._connections, 'pool-atomic-test', wrapper, raising=False)
+        with transaction.atomic(using='pool-atomic-test'):
+            raw = wrapper.connection
+            wrapper.close()
+        wrapper.ensure_connection()
+
+        assert raw.closed
+        assert wrapper.connection is not raw
+        wrapper.close()
+
+    def test_stats_view(self, client):
+        user = get_user_model().objects.create_superuser('pool', 'pool@example.com', 'pool')
+        client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+
+        response = client.get('/graphql/stats/pool/')
+
+        assert response.status_code == 200
+        assert all('checked_out' in stats for stats in response.json().values())
@@ -0,0 +1,55 @@
+import datetime
+import uuid
+import pytest
+from decimal import Decimal
+from django.core.cache import cache
+from api import rates, routers
+from api.models import Rate
+
+
+@pytest.fixture
+def fresh_index(settings):
+    settings.RATE_INDEX_CHECK_SECONDS = 0
+    rates.reset()
+    yield
+    rates.reset()
+
+
+@pytest.mark.django_db
+class TestRateIndex:
+
+    def test_rate_at(self, django_db_setup, fresh_index):
+        assert rates.rate_at(datetime.date(2019, 9, 30), 'L') is None
+        assert rates.rate_at(datetime.date(2019, 10, 31), 'L').rate == Decimal('0.0800')
+        assert rates.rate_at(datetime.date(2019, 11, 1), 'L').rate == Decimal('0.1000')
+        assert rates.rate_at(datetime.date(2030, 1, 1), 'L').rate == Decimal('0.1000')
+        assert rates.rate_at(datetime.date(2019, 11, 1), 'G') is None
+
+    def test_overlaps_and_gaps(self, django_db_setup, fresh_index):
+        Rate.objects.filter(effective_end=None).update(effective_end=datetime.date(2019, 12, 31))
+        override = Rate.objects.create(rate=Decimal('0.2000'), effective_start=datetime.date(2019, 11, 10),
+                                       effective_end=datetime.date(2019, 11, 20), unit_of_measure='L')
+        rates.reset()
+
+        days = [datetime.date(2019, 11, 9), datetime.date(2019, 11, 10), datetime.date(2019, 11, 20),
+                datetime.date(2019, 11, 21), datetime.date(2020, 1, 1)]
+        found = rates.rates_at(days, 'L')
+
+        assert [r.pk if r else None for r in found] == [2, override.pk, override.pk, 2, None]
+
+    def test_reload_when_another_worker_invalidates(self, django_db_setup, fresh_index):
+        assert rates.rate_at(datetime.date(2019, 11, 1), 'L').rate == Decimal('0.1000')
+        Rate.objects.filter(pk=2).update(rate=Decimal('0.1200'))
+
+        assert rates.rate_at(datetime.date(2019, 11, 1), 'L').rate == Decimal('0.1000')
+
+        cache.set(rates.GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        assert rates.rate_at(datetime.date(2019, 11, 1), 'L').rate == Decimal('0.1200')
+
+    def test_loads_from_the_primary(self, django_db_setup, fresh_index):
+        # An alias that is not configured fails any read routed to it.
+        routers.route('lagging-replica')
+        try:
+            assert rates.rate_at(datetime.date(2019, 11, 1), 'L').rate == Decimal('0.1000')
+        finally:
+            routers.reset()
@@ -0,0 +1,95 @@
+import json
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.test import Client
+from api.models import Customer
+
+CUSTOMERS = '{ customerRead(first: 1) { edges { node { firstName } } } }'
+METER_TYPE_CREATE = """
+    mutation { metertypeCreate(input: {meterModel: "Cached", meterVendor: "Cached"}) { metertype { id } } }
+"""
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+@pytest.fixture(autouse=True)
+def responses(settings):
+    settings.GRAPHQL_RESPONSE_CACHE_TTL = 60
+    caches[settings.GRAPHQL_RESPONSE_CACHE].clear()
+
+
+@pytest.fixture
+def admin_client(client, admin_user):
+    # The JWT backend comes first and cannot restore session users.
+    client.force_login(admin_user, backend=MODEL_BACKEND)
+    return client
+
+
+def post(client, query, **extra):
+    return client.post('/graphql/', json.dumps({'query': query}), content_type='application/json', **extra)
+
+
+def first_name(client, **extra):
+    return post(client, CUSTOMERS, **extra).json()['data']['customerRead']['edges'][0]['node']['firstName']
+
+
+def rename(name):
+    # Writes outside a request are invisible to the cache, so a changed name shows a miss.
+    Customer.objects.update(first_name=name)
+
+
+@pytest.mark.django_db
+class TestResponseCache:
+
+    def test_repeated_query_is_a_hit(self, admin_client):
+        original = first_name(admin_client)
+        rename('Cached')
+
+        assert first_name(admin_client) == original
+
+    def test_permission_sets_do_not_share_entries(self, admin_client):
+        first_name(admin_client)
+        rename('Cached')
+        user = get_user_model().objects.create_user('viewer', password='viewer')
+        user.user_permissions.add(Permission.objects.get(codename='view_customer'))
+        client = Client()
+        client.force_login(user, backend=MODEL_BACKEND)
+
+        assert first_name(client) == 'Cached'
+
+    def test_mutation_invalidates_dependent_entries(self, admin_client):
+        first_name(admin_client)
+        post(admin_client, 'mutation { customerCreate(input: {firstName: "Ann", lastName: "Lee"}) { clientMutationId } }')
+        rename('Invalidated')
+
+        assert first_name(admin_client) == 'Invalidated'
+
+    def test_mutation_keeps_unrelated_entries(self, admin_client):
+        original = first_name(admin_client)
+        rename('Cached')
+        assert 'errors' not in post(admin_client, METER_TYPE_CREATE).json()
+
+        assert first_name(admin_client) == original
+
+    def test_admin_save_invalidates(self, admin_client):
+        first_name(admin_client)
+        rename('Admin')
+        customer = Customer.objects.first()
+        admin_client.post('/admin/api/customer/{}/change/'.format(customer.pk),
+                          {'first_name': 'Admin', 'last_name': customer.last_name})
+
+        assert first_name(admin_client) == 'Admin'
+
+    def test_no_cache_request_bypasses(self, admin_client):
+        first_name(admin_client)
+        rename('Fresh')
+
+        assert first_name(admin_client, HTTP_CACHE_CONTROL='no-cache') == 'Fresh'
+
+    def test_ttl_ceiling(self, admin_client, settings):
+        settings.GRAPHQL_RESPONSE_CACHE_TTL = 0
+        first_name(admin_client)
+        rename('Fresh')
+
+        assert first_name(admin_client) == 'Fresh'
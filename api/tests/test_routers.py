@@ -0,0 +1,121 @@
+import json
+import pytest
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from api import routers
+
+QUERY = '{ meterRead(first: 1) { edges { node { meterSerial } } } }'
+MUTATION = 'mutation { customerCreate(input: {firstName: "Rae", lastName: "Plica"}) { customer { id } } }'
+
+
+@pytest.fixture(scope='module')
+def replica(django_db_setup, django_db_blocker):
+    """ A second, empty local database standing in for a replica of the test database. """
+    django_settings.DATABASES['replica'] = dict(connections['default'].settings_dict,
+                                                NAME='water_works_replica', TEST={})
+    with django_db_blocker.unblock():
+        connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        yield 'replica'
+        connections['replica'].creation.destroy_test_db('water_works_replica', verbosity=0)
+    del django_settings.DATABASES['replica']
+    del connections._connections.replica
+
+
+@pytest.fixture
+def client(client, replica, settings, monkeypatch):
+    settings.REPLICA_DATABASES = [replica]
+    settings.GRAPHQL_RESPONSE_CACHE_TTL = 0
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    monkeypatch.setattr(routers, '_lags', {})
+    user = get_user_model().objects.create_superuser('replica', 'replica@example.com', 'replica')
+    client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+    return client
+
+
+def post(client, query):
+    response = client.post('/graphql/', json.dumps({'query': query}), content_type='application/json')
+    return response.json()
+
+
+def databases_used(client, query):
+    """ Run ``query`` and return the aliases that ran queries on api tables, with the response. """
+    with CaptureQueriesContext(connections['default']) as primary, \
+            CaptureQueriesContext(connections['replica']) as replica:
+        result = post(client, query)
+    used = {alias for alias, queries in (('default', primary), ('replica', replica))
+            if any('"api_' in q['sql'] for q in queries.captured_queries)}
+    return used, result
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+class TestReplicaRouting:
+
+    def test_queries_read_from_the_replica(self, client):
+        used, result = databases_used(client, QUERY)
+
+        assert used == {'replica'}
+        # The stand-in replica has no rows; the primary has the fixtures.
+        assert result['data']['meterRead']['edges'] == []
+
+    def test_mutations_write_to_the_primary_and_stick(self, client):
+        used, result = databases_used(client, MUTATION)
+        assert used == {'default'}
+        assert 'errors' not in result
+
+        used, result = databases_used(client, QUERY)
+        assert used == {'default'}
+        assert result['data']['meterRead']['edges']
+
+    def test_reports_and_counts_read_from_the_replica(self, client):
+        used, result = databases_used(client, """{
+            fleetUsage(start: "2019-01-01", end: "2020-01-01", interval: MONTH) { usage }
+            meterRead(first: 1) { totalCount }
+        }""")
+
+        assert used == {'replica'}
+        assert result['data'] == {'fleetUsage': [], 'meterRead': {'totalCount': 0}}
+
+    def test_cached_replica_responses_are_not_served_after_a_mutation(self, client, settings):
+        settings.GRAPHQL_RESPONSE_CACHE, settings.GRAPHQL_RESPONSE_CACHE_TTL = 'default', 60
+        cache.clear()
+        assert post(client, QUERY)['data']['meterRead']['edges'] == []
+        used, result = databases_used(client, QUERY)
+        assert used == set() and result['data']['meterRead']['edges'] == []
+
+        post(client, MUTATION)
+        used, result = databases_used(client, QUERY)
+
+        assert used == {'default'}
+        assert result['data']['meterRead']['edges']
+
+    def test_replica_responses_are_cached_up_to_the_lag_limit(self, client, settings):
+        settings.GRAPHQL_RESPONSE_CACHE, settings.GRAPHQL_RESPONSE_CACHE_TTL = 'default', 60
+        cache.clear()
+        settings.REPLICA_MAX_LAG_SECONDS = 0.5
+
+        post(client, QUERY)
+        used, _ = databases_used(client, QUERY)
+
+        assert used == {'replica'}
+
+    def test_lagging_replicas_are_skipped(self, client, monkeypatch):
+        monkeypatch.setattr(routers, 'replica_lag', lambda alias: 60.0)
+
+        used, _ = databases_used(client, QUERY)
+
+        assert used == {'default'}
+
+    def test_unreachable_replicas_are_skipped(self, replica, settings, monkeypatch):
+        settings.REPLICA_DATABASES = [replica]
+        monkeypatch.setattr(routers, '_lags', {})
+        assert routers.replica_lag(replica) == 0
+        assert routers.choose_replica() == replica
+
+        def unreachable(alias):
+            raise ConnectionError(alias)
+        monkeypatch.setattr(routers, 'replica_lag', unreachable)
+        monkeypatch.setattr(routers, '_lags', {})
+        assert routers.choose_replica() == 'default'
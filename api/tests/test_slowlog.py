@@ -0,0 +1,130 @@
+import json
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from api import rollups, slowlog
+from api.models import SlowOperation, SlowStatement
+from api.slowlog import explainable, sanitize
+
+QUERY = 'query Find($name: String) { customerRead(firstName_Icontains: $name, first: 5) { edges { node { id } } } }'
+MUTATION = 'mutation { customerCreate(input: {firstName: "Slow", lastName: "Log"}) { customer { id } } }'
+
+
+@pytest.fixture
+def staff_client(client):
+    user = get_user_model().objects.create_superuser('slow', 'slow@example.com', 'slow')
+    client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+    return client
+
+
+@pytest.fixture
+def slow(settings, tmp_path, monkeypatch):
+    settings.SLOW_QUERY_SECONDS = 0
+    # The explainer thread's connection cannot see this test's rows, so plans are taken on this one.
+    monkeypatch.setattr(slowlog, 'explain_later', slowlog.save_plan)
+    settings.SLOW_EXPLAIN_RATE = 1
+    settings.SLOW_LOG_FILE = str(tmp_path / 'logs' / 'slow.log')
+    return tmp_path / 'logs' / 'slow.log'
+
+
+def post(client, variables, query=QUERY):
+    return client.post('/graphql/', json.dumps({'query': query, 'variables': variables}),
+                       content_type='application/json')
+
+
+def commit():
+    """ Run the callbacks waiting for the test's transaction to commit. """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+class TestSanitize:
+
+    def test_redacts_secrets_and_truncates(self):
+        assert sanitize({'input': {'password': 'x', 'name': 'a' * 300, 'ids': list(range(25))}}) == {'input': {
+            'password': '[redacted]', 'name': 'a' * 200 + '...', 'ids': list(range(20)) + ['... 5 more']}}
+
+
+class TestExplainable:
+
+    def test_plain_selects(self):
+        assert explainable('SELECT COUNT(*) AS "__count" FROM "api_customer" WHERE UPPER("first_name") LIKE %s')
+        assert explainable('SELECT DISTINCT ON ("id") "id", EXISTS(SELECT 1 FROM "api_meter") FROM "api_customer"')
+
+    def test_writes_locks_and_function_calls(self):
+        assert not explainable('UPDATE "api_customer" SET "first_name" = %s')
+        assert not explainable('SELECT "id" FROM "api_meter" WHERE "id" = %s FOR UPDATE')
+        assert not explainable(rollups.LOCK_SQL)
+        assert not explainable('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload')
+        assert not explainable("SELECT nextval('api_customer_id_seq')")
+
+
+@pytest.mark.django_db
+class TestSlowOperations:
+
+    def test_fast_operations_are_not_recorded(self, staff_client):
+        post(staff_client, {'name': 'jo'})
+
+        assert not SlowOperation.objects.exists()
+
+    def test_records_operation_statements_and_plans(self, staff_client, slow):
+        post(staff_client, {'name': 'jo', 'token': 'secret'})
+
+        operation = SlowOperation.objects.get()
+        assert (operation.operation_type, operation.operation_name) == ('query', 'Find')
+        assert operation.fields == 'customerRead(firstName_Icontains, first)'
+        assert json.loads(operation.variables) == {'name': 'jo', 'token': '[redacted]'}
+        statement = operation.statements.get(sql__contains='"api_customer"')
+        # The test runs in a transaction, so the statement is explained once it commits.
+        assert 'UPPER' in statement.sql and statement.explain == ''
+        commit()
+        statement.refresh_from_db()
+        assert 'Buffers' in statement.explain
+
+        entry, *plans = [json.loads(line) for line in slow.read_text().splitlines()]
+        assert entry['id'] == operation.pk and entry['fields'] == operation.fields
+        assert entry['statements'][0]['sql']
+        plan, = [plan for plan in plans if plan['sql'] == statement.sql]
+        assert plan['operation'] == operation.pk and 'Buffers' in plan['explain']
+
+    def test_mutations_are_not_explained(self, staff_client, slow):
+        post(staff_client, {}, MUTATION)
+        commit()
+
+        operation = SlowOperation.objects.get()
+        assert operation.operation_type == 'mutation'
+        assert operation.statements.exists()
+        assert not operation.statements.exclude(explain='').exists()
+
+    def test_admin_pages(self, staff_client, slow):
+        post(staff_client, {'name': 'jo'})
+        commit()
+        operation = SlowOperation.objects.get()
+
+        assert staff_client.get('/admin/api/slowoperation/').status_code == 200
+        page = staff_client.get('/admin/api/slowoperation/{}/change/'.format(operation.pk))
+        assert page.status_code == 200
+        assert 'customerRead(firstName_Icontains, first)' in page.content.decode()
+        assert 'Buffers' in page.content.decode()
+
+
+@pytest.mark.django_db
+class TestExplain:
+
+    def test_explains_are_bounded(self, settings):
+        settings.SLOW_EXPLAIN_TIMEOUT_SECONDS = 0.01
+
+        assert slowlog.explain('default', 'SELECT pg_sleep(%s)', [1]).startswith('EXPLAIN failed: canceling')
+        assert connection.cursor().execute('SELECT 1') is None
+
+    def test_plans_are_taken_on_the_explainer_thread(self, settings, tmp_path):
+        settings.SLOW_LOG_FILE = str(tmp_path / 'slow.log')
+        statement = SlowStatement(database='default', sql='SELECT "id" FROM "api_customer" WHERE "id" > %s')
+        try:
+            slowlog.explain_later(statement, 'default', statement.sql, [0])
+        finally:
+            slowlog.stop_explainer()
+
+        assert 'Buffers' in json.loads((tmp_path / 'slow.log').read_text())['explain']
+        assert slowlog._explainer is None
@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import json
+import time
+import psycopg2
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token, get_user_by_token
+from api import authentication, events, routers
+from api.asgi import GraphQLASGIHandler
+from api.subscriptions import Connection
+
+METER = 'TWV0ZXJUeToy'
+CHANNEL = events.consumption_channel(2)
+START = timezone.make_aware(datetime.datetime(2000, 1, 1))
+
+
+def read(pk, hours, reading):
+    return {'id': pk, 'meter_id': 2, 'read_time': START + datetime.timedelta(hours=hours),
+            'reading': reading, 'unit_of_measure': 'L'}
+
+
+@pytest.fixture(autouse=True)
+def broker(settings):
+    # A LISTEN thread would keep a connection to the test database open; TestListener starts its own.
+    settings.SUBSCRIPTION_BROKER = 'local'
+
+
+@pytest.fixture
+def token(monkeypatch, settings):
+    # Pool threads use their own connections, which cannot see this test's user,
+    # so resolve the token once here to leave the user in the authentication cache.
+    # A database cache would block them on this test's uncommitted cache rows.
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    settings.AUTH_CACHE_CHECK_SECONDS = 3600
+    monkeypatch.setattr(authentication, '_users', None)
+    user = get_user_model().objects.create_superuser('live', 'live@example.com', 'live')
+    token = get_token(user)
+    get_user_by_token(token)
+    return token
+
+
+def subscribe(token, query, reads):
+    """ Subscribe over a WebSocket, publish ``reads`` and return the messages received for them. """
+    handler = GraphQLASGIHandler(threads=2, max_pending=2)
+    scope = {'type': 'websocket', 'path': '/graphql/', 'headers': [], 'subprotocols': ['graphql-ws']}
+
+    async def scenario():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(handler(scope, inbox.get, outbox.put))
+
+        async def exchange(message):
+            await inbox.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+            return json.loads((await asyncio.wait_for(outbox.get(), 5))['text'])
+
+        await inbox.put({'type': 'websocket.connect'})
+        assert (await outbox.get()) == {'type': 'websocket.accept', 'subprotocol': 'graphql-ws'}
+        assert (await exchange({'type': 'connection_init', 'payload': {'Authorization': 'JWT ' + token}})) == {
+            'type': 'connection_ack'}
+        await inbox.put({'type': 'websocket.receive', 'text': json.dumps(
+            {'id': '1', 'type': 'start', 'payload': {'query': query}})})
+        for _ in range(500):
+            if events._listeners.get(CHANNEL) or not outbox.empty():
+                break
+            await asyncio.sleep(0.01)
+
+        events.dispatch((CHANNEL, event) for event in reads)
+        received = []
+        while True:
+            try:
+                message = await asyncio.wait_for(outbox.get(), 1)
+            except asyncio.TimeoutError:
+                break
+            received.append(json.loads(message['text']))
+
+        await inbox.put({'type': 'websocket.disconnect'})
+        await task
+        return received
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.django_db
+class TestSubscriptions:
+
+    def test_consumption_added(self, token):
+        query = 'subscription { consumptionAdded(meter: "%s") { reading meter { meterSerial } } }' % METER
+
+        received = subscribe(token, query, [read(900001, 0, 5)])
+
+        assert received == [{'type': 'data', 'id': '1', 'payload': {'data': {
+            'consumptionAdded': {'reading': 5, 'meter': {'meterSerial': 'kzx1234sss3778022'}}}}}]
+        assert not events._listeners.get(CHANNEL)
+
+    def test_meter_usage_threshold(self, token):
+        query = """subscription {
+            meterUsageThreshold(meter: "%s", litersPerHour: 100) { litersPerHour consumption { reading } }
+        }""" % METER
+
+        received = subscribe(token, query, [
+            read(900001, 0, 1000), read(900002, 1, 1500), read(900003, 2, 1510), read(900004, 2.5, 1610),
+        ])
+
+        assert [message['payload']['data']['meterUsageThreshold'] for message in received] == [
+            {'litersPerHour': 500.0, 'consumption': {'reading': 1500}},
+            {'litersPerHour': 200.0, 'consumption': {'reading': 1610}},
+        ]
+
+    def test_cost_limits_apply(self, token, settings):
+        settings.GRAPHQL_MAX_DEPTH = 1
+        query = 'subscription { consumptionAdded(meter: "%s") { meter { meterSerial } } }' % METER
+
+        received = subscribe(token, query, [read(900001, 0, 5)])
+
+        assert received == [{'type': 'error', 'id': '1', 'payload': {
+            'message': 'Operation depth 3 exceeds the maximum depth of 1.'}}]
+        assert not events._listeners.get(CHANNEL)
+
+    def test_requires_permission(self, token):
+        query = 'subscription { consumptionAdded(meter: "%s") { reading } }' % METER
+
+        received = subscribe('invalid', query, [])
+
+        assert received[0]['payload']['errors']
+        assert received[1] == {'type': 'complete', 'id': '1'}
+
+
+@pytest.mark.django_db
+class TestConnection:
+
+    def test_events_are_processed_from_the_primary(self):
+        async def connect():
+            return Connection(None, None, {'path': '/graphql/'}, None, None)
+        connection = asyncio.run(connect())
+        connection.context = connection.build_context({})
+        routers.route('replica')
+        seen = []
+
+        connection.process(lambda event: seen.append(routers.current()), {})
+
+        assert seen == ['default']
+        assert getattr(routers._state, 'alias', None) is None
+
+
+@pytest.mark.django_db
+class TestNotify:
+
+    def test_notifications_are_batched(self):
+        messages = [(CHANNEL, read(pk, pk, pk)) for pk in range(200)]
+
+        payloads = events.payloads(messages)
+        with CaptureQueriesContext(connection) as queries:
+            events.notify(messages)
+
+        assert 1 < len(payloads) < 10
+        assert all(len(payload.encode()) < 8000 for payload in payloads)
+        assert sum(len(json.loads(payload)) for payload in payloads) == 200
+        assert len([q for q in queries.captured_queries if 'pg_notify' in q['sql']]) == 1
+
+
+class TestListener:
+
+    def test_notifications_reach_listeners(self, settings):
+        settings.SUBSCRIPTION_BROKER = 'postgres'
+        received = []
+        stop = events.listen(CHANNEL, received.append)
+        sender = psycopg2.connect(**connection.get_connection_params())
+        sender.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            # The listener connects in the background, so notify until it hears.
+            for _ in range(100):
+                with sender.cursor() as cursor:
+                    cursor.execute('SELECT pg_notify(%s, %s)', [events.NOTIFY_CHANNEL, json.dumps([[CHANNEL, 'ping']])])
+                time.sleep(0.05)
+                if received:
+                    break
+        finally:
+            stop()
+            sender.close()
+            events.stop_listener()
+
+        assert received[0] == 'ping'
+        assert events._listener is None
@@ -0,0 +1,142 @@
+""" Usage aggregation over cumulative meter readings.
+
+Meters report a cumulative ``reading``; usage is the difference between a read
+and the one before it. A read lower than its predecessor means the register
+rolled over or was replaced, so the new reading itself is counted as usage.
+Each delta is attributed to the bucket containing the later read.
+
+Day, week and month buckets over whole days are answered from the
+DailyUsage and MonthlyUsage rollups maintained by ``api.rollups``; anything
+finer is computed from the raw reads.
+"""
+import datetime
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from .models import Consumption, DailyUsage, MonthlyUsage
+
+UsageBucket = namedtuple('UsageBucket', 'bucket_start usage unit')
+
+INTERVALS = ('hour', 'day', 'week', 'month')
+
+USAGE_SQL = """
+    WITH reads AS (
+        SELECT read_time, reading, unit_of_measure
+        FROM {table}
+        WHERE meter_id = %(meter)s AND read_time >= %(start)s AND read_time < %(end)s
+        UNION ALL
+        SELECT p.read_time, p.reading, p.unit_of_measure
+        FROM unnest(%(units)s::text[]) AS u(unit_of_measure)
+        CROSS JOIN LATERAL (
+            SELECT read_time, reading, unit_of_measure
+            FROM {table}
+            WHERE meter_id = %(meter)s AND unit_of_measure = u.unit_of_measure AND read_time < %(start)s
+            ORDER BY read_time DESC
+            LIMIT 1
+        ) p
+    ), deltas AS (
+        SELECT read_time, reading, unit_of_measure,
+               reading - LAG(reading) OVER (PARTITION BY unit_of_measure ORDER BY read_time) AS delta
+        FROM reads
+    )
+    SELECT date_trunc(%(interval)s, read_time AT TIME ZONE %(tz)s) AT TIME ZONE %(tz)s AS bucket_start,
+           SUM(CASE WHEN delta < 0 THEN reading ELSE delta END) AS usage,
+           unit_of_measure
+    FROM deltas
+    WHERE delta IS NOT NULL AND read_time >= %(start)s
+    GROUP BY 1, 3
+    ORDER BY 1, 3
+"""
+
+
+ROLLUP_SQL = """
+    SELECT date_trunc(%(interval)s, {column}::timestamp) AT TIME ZONE %(tz)s AS bucket_start,
+           SUM(usage) AS usage,
+           unit_of_measure
+    FROM {table}
+    WHERE {meter_filter} {column} >= %(start)s AND {column} < %(end)s
+    GROUP BY 1, 3
+    ORDER BY 1, 3
+"""
+
+
+def local_date(value):
+    # Return the project-local date of value when it falls exactly on midnight.
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    value = timezone.localtime(value)
+    if value.time() != datetime.time(0):
+        return None
+    return value.date()
+
+
+def rollup_usage(meter_id, start_day, end_day, interval):
+    """ Sum rollup rows over ``[start_day, end_day)`` into interval buckets.
+
+    Month buckets over whole months read MonthlyUsage; everything else reads
+    DailyUsage. When ``meter_id`` is None the whole fleet is summed.
+    """
+    if interval == 'hour':
+        raise ValueError('Rollups do not hold hourly usage.')
+
+    if interval == 'month' and start_day.day == 1 and end_day.day == 1:
+        model, column = MonthlyUsage, 'month'
+    else:
+        model, column = DailyUsage, 'day'
+
+    connection = connections[router.db_for_read(model)]
+    sql = ROLLUP_SQL.format(
+        table=connection.ops.quote_name(model._meta.db_table),
+        column=column,
+        meter_filter='meter_id = %(meter)s AND' if meter_id is not None else '',
+    )
+    params = {
+        'meter': meter_id,
+        'start': start_day,
+        'end': end_day,
+        'interval': interval,
+        'tz': settings.TIME_ZONE,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [UsageBucket(*row) for row in cursor.fetchall()]
+
+
+def fleet_usage(start_day, end_day, interval):
+    """ Return usage summed across every meter for ``[start_day, end_day)``. """
+    if interval not in INTERVALS:
+        raise ValueError('Unsupported interval: {}'.format(interval))
+    return rollup_usage(None, start_day, end_day, interval)
+
+
+def meter_usage(meter_id, start, end, interval):
+    """ Return a list of UsageBucket for one meter over ``[start, end)``.
+
+    Buckets are truncated to ``interval`` in the project time zone and only
+    buckets containing reads are returned. Whole-day ranges of day or longer
+    buckets come from the rollups; otherwise the raw reads are aggregated in
+    a single SQL statement.
+    """
+    if interval not in INTERVALS:
+        raise ValueError('Unsupported interval: {}'.format(interval))
+
+    start_day, end_day = local_date(start), local_date(end)
+    if interval != 'hour' and start_day and end_day:
+        return rollup_usage(meter_id, start_day, end_day, interval)
+
+    connection = connections[router.db_for_read(Consumption)]
+    sql = USAGE_SQL.format(table=connection.ops.quote_name(Consumption._meta.db_table))
+    params = {
+        'meter': meter_id,
+        'start': start,
+        'end': end,
+        'interval': interval,
+        'tz': settings.TIME_ZONE,
+        'units': [unit for unit, _ in Consumption.MEASURE],
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [UsageBucket(*row) for row in cursor.fetchall()]
@@ -1,3 +1,283 @@
-from django.shortcuts import render
+import json
+import time
+from contextlib import nullcontext
 
-# Create your views here.
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+
+from . import routers, slowlog
+from .cost import CostAnalysis, CostError
+from .documents import get_backend
+from .metrics import OperationTrace, render
+from .pooled.pool import pool_stats
+from .response_cache import ResponseCache, track_reads
+
+
+class CachedGraphQLView(GraphQLView):
+    """ GraphQLView that reuses parsed documents, accepts persisted query hashes, limits the cost of operations,
+    caches query responses and runs batches of operations posted as a JSON array. """
+
+    # Set once a batch has run a mutation, whose writes the response cache only learns of after the request.
+    wrote = False
+    # Cost of the operations of a batch accepted so far.
+    batch_cost = 0
+    # Whether traces keep every SQL statement, as the query budgets need.
+    capture_statements = False
+
+    def __init__(self, capture_statements=False, **kwargs):
+        # GraphQLView accepts only its own options.
+        super().__init__(**kwargs)
+        self.capture_statements = capture_statements
+
+    @method_decorator(ensure_csrf_cookie)
+    def dispatch(self, request, *args, **kwargs):
+        # As GraphQLView.dispatch, but batches are recognised by their body rather than
+        # configured, so GraphiQL and single operations keep working on the same route.
+        try:
+            if request.method.lower() not in ('get', 'post'):
+                raise HttpError(HttpResponseNotAllowed(['GET', 'POST'], 'GraphQL only supports GET and POST requests.'))
+
+            data = self.parse_body(request)
+            if self.batch:
+                result, status_code = self.get_batch_response(request, data)
+            else:
+                show_graphiql = self.graphiql and self.can_display_graphiql(request, data)
+                if show_graphiql:
+                    return self.render_graphiql(
+                        request, graphiql_version=self.graphiql_version, react_version=self.react_version)
+                result, status_code = self.get_response(request, data, show_graphiql)
+
+            return HttpResponse(status=status_code, content=result, content_type='application/json')
+
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+
+    def parse_body(self, request):
+        if self.get_content_type(request) != 'application/json' or not request.body.lstrip().startswith(b'['):
+            return super().parse_body(request)
+
+        limit = settings.GRAPHQL_BATCH_MAX_OPERATIONS
+        if not limit:
+            raise HttpError(HttpResponseBadRequest('Batched operations are not accepted.'))
+        self.batch = True
+        data = super().parse_body(request)
+        if len(data) > limit:
+            raise HttpError(HttpResponseBadRequest(
+                'A batch may hold at most {} operations, but received {}.'.format(limit, len(data))))
+        if not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(HttpResponseBadRequest('Every operation in a batch must be a JSON object.'))
+        return data
+
+    def get_batch_response(self, request, data):
+        """ Run the operations in ``data`` in order on ``request``, so they share its user and DataLoaders.
+
+        The operations share a cost budget of ``GRAPHQL_BATCH_MAX_COST``: one that would take the batch's total
+        cost over it is rejected. An operation that cannot be run, such as one naming an unknown persisted query,
+        fails alone with its own status.
+
+        With the atomic header, the batch runs in one transaction. The first operation with errors rolls
+        it back; the operations after it are not run, and the others report that their writes were undone.
+        """
+        header = settings.GRAPHQL_BATCH_ATOMIC_HEADER
+        atomic = bool(header) and header in request.headers
+        responses, statuses = [], []
+        failed = None
+        with transaction.atomic() if atomic else nullcontext():
+            for index, entry in enumerate(data):
+                if failed is not None:
+                    responses.append(self.json_encode(request, {
+                        'errors': [{'message': 'Not run: operation {} of the batch failed.'.format(failed)}],
+                        'id': entry.get('id'), 'status': 400,
+                    }))
+                    statuses.append(400)
+                    continue
+                try:
+                    result, status_code = self.get_response(request, entry)
+                    errors = request.graphql_trace.errors
+                except HttpError as e:
+                    status_code = e.response.status_code
+                    result = self.json_encode(request, {
+                        'errors': [self.format_error(e)], 'id': entry.get('id'), 'status': status_code})
+                    errors = True
+                responses.append(result)
+                statuses.append(status_code)
+                trace = request.graphql_trace
+                if atomic and errors:
+                    failed = index
+                    transaction.set_rollback(True)
+                elif not errors and trace.operation_type == 'mutation':
+                    self.wrote = True
+                    # Later operations must not see objects loaded before the write.
+                    for loader in getattr(request, 'dataloaders', {}).values():
+                        loader.clear_all()
+
+        if failed is not None:
+            for index in range(failed):
+                response = json.loads(responses[index])
+                response.setdefault('errors', []).append(
+                    {'message': 'Rolled back: operation {} of the batch failed.'.format(failed)})
+                responses[index] = self.json_encode(request, response)
+
+        return '[{}]'.format(','.join(responses)), max(statuses)
+
+    def check_batch_cost(self, cost, extensions):
+        """ Add the operation's cost to the batch's, or return an error when it would exceed the budget. """
+        limit = settings.GRAPHQL_BATCH_MAX_COST
+        extensions['cost'].update(batchRequested=self.batch_cost + cost.cost, batchMaximum=limit)
+        if limit and self.batch_cost + cost.cost > limit:
+            return [CostError('Operation cost {} would take the batch to a cost of {}, over its maximum of {}.'.format(
+                cost.cost, self.batch_cost + cost.cost, limit))]
+        self.batch_cost += cost.cost
+        return []
+
+    def get_backend(self, request):
+        return get_backend(self.schema)
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        persisted = (extensions or {}).get('persistedQuery') or {}
+
+        if persisted.get('sha256Hash'):
+            document = get_backend(self.schema).persisted.get(persisted['sha256Hash'])
+            if document is None:
+                raise HttpError(HttpResponseBadRequest('PersistedQueryNotFound'))
+            query = document.document_string
+        elif query and settings.GRAPHQL_PERSISTED_ONLY:
+            raise HttpError(HttpResponseBadRequest('Only persisted queries are accepted.'))
+
+        return query, variables, operation_name, id
+
+    def get_response(self, request, data, show_graphiql=False):
+        # As GraphQLView.get_response, but the response carries the result's extensions
+        # and the operation is traced.
+        header = settings.GRAPHQL_TRACING_HEADER
+        trace = request.graphql_trace = OperationTrace(tracing=bool(header) and header in request.headers,
+                                                       capture=self.capture_statements)
+        with trace:
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        status_code = 200
+        if execution_result:
+            if trace.resolvers is not None:
+                execution_result.extensions['tracing'] = trace.apollo()
+            response = {}
+
+            if execution_result.errors:
+                response['errors'] = [self.format_error(e) for e in execution_result.errors]
+
+            if execution_result.invalid:
+                status_code = 400
+            else:
+                response['data'] = execution_result.data
+
+            if execution_result.extensions:
+                response['extensions'] = execution_result.extensions
+
+            if self.batch:
+                response['id'] = id
+                response['status'] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+            trace.record(len(result), bool(execution_result.errors))
+            slowlog.record(trace, self.schema, query, variables, operation_name)
+        else:
+            result = None
+
+        return result, status_code
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        trace = request.graphql_trace
+        started = time.perf_counter()
+        try:
+            document = self.get_backend(request).document_from_string(self.schema, query)
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        finally:
+            # The document backend parses and validates in one step, and caches both.
+            parsed = time.perf_counter()
+            trace.phase('parsing', started, parsed)
+            trace.phase('validation', parsed, parsed)
+
+        operation_type = document.get_operation_type(operation_name)
+        trace.operation_type = operation_type or 'unknown'
+        if request.method.lower() == 'get' and operation_type and operation_type != 'query':
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'], 'Can only perform a {} operation from a POST request.'.format(operation_type)))
+
+        cost = CostAnalysis(self.schema, document.document_ast, variables, operation_name)
+        extensions = {'cost': cost.extension()}
+        errors = cost.check()
+        if self.batch and not errors:
+            errors = self.check_batch_cost(cost, extensions)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True, extensions=extensions)
+
+        cache = ResponseCache(request, self.schema, document, variables, operation_name)
+        # A traced operation is executed so that its resolvers can be timed.
+        cached = cache.get() if trace.resolvers is None and not self.wrote else None
+        if cached is not None:
+            return ExecutionResult(data=cached, extensions=extensions)
+        cache.begin()
+
+        try:
+            with track_reads() as tables:
+                result = document.execute(
+                    root=self.get_root_value(request),
+                    variables=variables,
+                    operation_name=operation_name,
+                    context=self.get_context(request),
+                    middleware=self.get_middleware(request),
+                    **({'executor': self.executor} if self.executor else {})
+                )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+        if not result.errors and not result.invalid:
+            cache.set(result.data, tables, routers.current())
+        result.extensions.update(extensions)
+        return result
+
+
+@staff_member_required
+def document_cache_stats(request):
+    """ Hit rate and evictions of this process's GraphQL document cache. """
+    from water_graph.schema import schema
+    return JsonResponse(get_backend(schema).stats())
+
+
+@staff_member_required
+def database_pool_stats(request):
+    """ Connections open, checked out and waited for in this process's database pools. """
+    return JsonResponse(pool_stats())
+
+
+def metrics(request):
+    """ GraphQL metrics of the server, in the Prometheus text format. """
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -9,7 +9,18 @@ python manage.py collectstatic --noinput
 # Apply database migrations
 echo "Apply database migrations"
 python manage.py migrate
+python manage.py createcachetable
 
-# Start server
+# Keep monthly consumption partitions ahead of incoming reads
+echo "Create consumption partitions"
+python manage.py consumption_partitions --ahead 3
+
+# Start server. With SERVER=asgi, gunicorn runs uvicorn workers on water_graph.asgi, which
+# serves GraphQL from GRAPHQL_ASGI_THREADS threads per worker, so slow readers share a
+# process instead of each holding a whole WSGI worker.
 echo "Starting server"
-gunicorn water_graph.wsgi:application --workers 3 --bind 0.0.0.0:$PORT
\ No newline at end of file
+if [ "$SERVER" = "asgi" ]; then
+    gunicorn water_graph.asgi:application --workers 3 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
+else
+    gunicorn water_graph.wsgi:application --workers 3 --bind 0.0.0.0:$PORT
+fi
\ No newline at end of file
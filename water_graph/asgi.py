@@ -2,6 +2,7 @@
 ASGI config for water_graph project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+GraphQL requests are served from a bounded thread pool; see ``api.asgi``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +10,9 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
+# Set before importing api.asgi, which reads the settings when imported.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'water_graph.settings')
 
+from api.asgi import get_asgi_application  # noqa: E402
+
 application = get_asgi_application()
@@ -7,5 +7,8 @@ class Query(api.schema.Query, graphene.ObjectType):
 class Mutation(api.schema.Mutation, graphene.ObjectType):
     pass
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(api.schema.Subscription, graphene.ObjectType):
+    pass
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
 
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.response_cache.ResponseCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'water_graph.urls'
@@ -80,16 +81,45 @@ WSGI_APPLICATION = 'water_graph.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'api.pooled',
         'NAME': 'water_works',
         'USER': 'water_works_user',
         'PASSWORD': 'water_works',
         # 'HOST': 'localhost',
         'HOST': 'db',
         'PORT': '5432',
+        # Per worker process: SIZE connections are kept open and up to OVERFLOW more opened
+        # under load; checkouts wait TIMEOUT seconds. Connections idle RECYCLE seconds or
+        # open MAX_LIFETIME seconds are closed; ones idle PRE_PING seconds are tested first.
+        'POOL': {
+            'SIZE': int(os.environ.get('DB_POOL_SIZE', default=8)),
+            'OVERFLOW': int(os.environ.get('DB_POOL_OVERFLOW', default=8)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', default=30)),
+            'RECYCLE': float(os.environ.get('DB_POOL_RECYCLE', default=300)),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', default=3600)),
+            'PRE_PING': float(os.environ.get('DB_POOL_PRE_PING', default=10)),
+        },
     }
 }
 
+# Read replicas, as comma-separated host[:port][/name] entries; each gets the primary's other
+# settings and the alias replicaN. See api.routers for how operations are routed.
+REPLICA_DATABASES = []
+for number, address in enumerate(filter(None, os.environ.get('DB_REPLICAS', default='').split(',')), 1):
+    host, _, name = address.strip().partition('/')
+    host, _, port = host.partition(':')
+    REPLICA_DATABASES.append('replica{}'.format(number))
+    DATABASES[REPLICA_DATABASES[-1]] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                                            NAME=name or DATABASES['default']['NAME'])
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+# Callers read from the primary for REPLICA_STICKY_SECONDS after a mutation. Replicas more
+# than REPLICA_MAX_LAG_SECONDS behind are skipped; lag is measured every REPLICA_LAG_CHECK_SECONDS.
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', default=10))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', default=5))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', default=1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -141,7 +171,10 @@ AUTHENTICATION_BACKENDS = (
 
 GRAPHENE = {
     'SCHEMA': 'water_graph.schema.schema',
+    # The last middleware runs first, so routing sees the user the JWT middleware set.
     'MIDDLEWARE': [
+        'api.metrics.TracingMiddleware',
+        'api.routers.ReplicaMiddleware',
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
     ]
 }
@@ -150,4 +183,96 @@ GRAPHQL_JWT = {
     'JWT_ALLOW_ARGUMENT': True,
     'JWT_VERIFY_EXPIRATION': True,
     'JWT_EXPIRATION_DELTA': timedelta(minutes=240),
-}
\ No newline at end of file
+    'JWT_DECODE_HANDLER': 'api.authentication.decode_token',
+    'JWT_GET_USER_BY_NATURAL_KEY_HANDLER': 'api.authentication.get_user_by_natural_key',
+}
+
+# Verified tokens and users with their permissions are cached per process. Workers
+# look for user, group and permission changes at most every AUTH_CACHE_CHECK_SECONDS.
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', default=10000))
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', default=1000))
+AUTH_CACHE_CHECK_SECONDS = float(os.environ.get('AUTH_CACHE_CHECK_SECONDS', default=1))
+
+# Consumption ingestion
+CONSUMPTION_BULK_MAX_ROWS = int(os.environ.get('CONSUMPTION_BULK_MAX_ROWS', default=50000))
+CONSUMPTION_BULK_BATCH_SIZE = int(os.environ.get('CONSUMPTION_BULK_BATCH_SIZE', default=1000))
+
+# Caching. The default cache must be shared by every worker, since it carries
+# invalidation of process-local indexes such as the rate index.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', default='water_graph_cache'),
+    },
+    'responses': {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', default='water_graph_responses'),
+    },
+}
+
+# Rates
+RATE_INDEX_CHECK_SECONDS = float(os.environ.get('RATE_INDEX_CHECK_SECONDS', default=1))
+
+# Connections. totalCount estimates at or above this many rows are returned as is;
+# smaller results are counted exactly.
+CONNECTION_EXACT_COUNT_THRESHOLD = int(os.environ.get('CONNECTION_EXACT_COUNT_THRESHOLD', default=1000))
+
+# GraphQL documents. Parsed and validated documents are cached per process; persisted
+# queries are loaded from a JSON manifest of {sha256: query} or an Apollo manifest.
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE', default=500))
+GRAPHQL_PERSISTED_QUERIES = os.environ.get('GRAPHQL_PERSISTED_QUERIES', default=None)
+GRAPHQL_PERSISTED_ONLY = int(os.environ.get('GRAPHQL_PERSISTED_ONLY', default=0))
+
+# Operations nesting fields deeper than GRAPHQL_MAX_DEPTH or costing more than GRAPHQL_MAX_COST,
+# roughly the objects they resolve, are rejected before execution; see api.cost. 0 disables a limit.
+GRAPHQL_MAX_DEPTH = int(os.environ.get('GRAPHQL_MAX_DEPTH', default=10))
+GRAPHQL_MAX_COST = int(os.environ.get('GRAPHQL_MAX_COST', default=5000))
+
+# Metrics served at /metrics. With METRICS_DIR set, every process writes its metrics there
+# at most every METRICS_FLUSH_SECONDS and /metrics reports their sum, folding the files of
+# exited processes into one; the processes sharing a METRICS_DIR must run on one host.
+# Requests carrying the GRAPHQL_TRACING_HEADER header get Apollo tracing in their response
+# extensions.
+METRICS_DIR = os.environ.get('METRICS_DIR', default=None)
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', default=1))
+GRAPHQL_TRACING_HEADER = os.environ.get('GRAPHQL_TRACING_HEADER', default='X-GraphQL-Tracing')
+
+# Slow operation log. Operations slower than SLOW_OPERATION_SECONDS, or running a statement
+# slower than SLOW_QUERY_SECONDS, are recorded with their SLOW_LOG_STATEMENTS slowest
+# statements, a SLOW_EXPLAIN_RATE sample of them with EXPLAIN ANALYZE plans, taken after the
+# request on a thread of their own and cancelled after SLOW_EXPLAIN_TIMEOUT_SECONDS. Records
+# are browsable in the admin and appended to SLOW_LOG_FILE; an empty path disables the file.
+SLOW_OPERATION_SECONDS = float(os.environ.get('SLOW_OPERATION_SECONDS', default=1))
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', default=0.25))
+SLOW_LOG_STATEMENTS = int(os.environ.get('SLOW_LOG_STATEMENTS', default=10))
+SLOW_EXPLAIN_RATE = float(os.environ.get('SLOW_EXPLAIN_RATE', default=0.1))
+SLOW_EXPLAIN_TIMEOUT_SECONDS = float(os.environ.get('SLOW_EXPLAIN_TIMEOUT_SECONDS', default=5))
+SLOW_LOG_FILE = os.environ.get('SLOW_LOG_FILE', default=os.path.join(BASE_DIR, 'logs', 'slow_operations.log'))
+SLOW_LOG_MAX_BYTES = int(os.environ.get('SLOW_LOG_MAX_BYTES', default=10 * 1024 * 1024))
+SLOW_LOG_BACKUPS = int(os.environ.get('SLOW_LOG_BACKUPS', default=5))
+
+# Query response cache. Entries live in the GRAPHQL_RESPONSE_CACHE alias for at most
+# GRAPHQL_RESPONSE_CACHE_TTL seconds; 0 disables the cache.
+GRAPHQL_RESPONSE_CACHE = os.environ.get('GRAPHQL_RESPONSE_CACHE', default='responses')
+GRAPHQL_RESPONSE_CACHE_TTL = int(os.environ.get('GRAPHQL_RESPONSE_CACHE_TTL', default=60))
+
+# Batches. A POST whose JSON body is an array runs its operations in order on one request,
+# sharing its user and DataLoaders; at most GRAPHQL_BATCH_MAX_OPERATIONS of them, 0 disables
+# batching. Operations that would take the summed cost of a batch over GRAPHQL_BATCH_MAX_COST
+# are rejected; 0 disables the limit. Batches sent with the GRAPHQL_BATCH_ATOMIC_HEADER header
+# run in one transaction, rolled back when any operation fails.
+GRAPHQL_BATCH_MAX_OPERATIONS = int(os.environ.get('GRAPHQL_BATCH_MAX_OPERATIONS', default=50))
+GRAPHQL_BATCH_MAX_COST = int(os.environ.get('GRAPHQL_BATCH_MAX_COST', default=20000))
+GRAPHQL_BATCH_ATOMIC_HEADER = os.environ.get('GRAPHQL_BATCH_ATOMIC_HEADER', default='X-GraphQL-Batch-Atomic')
+
+# ASGI. GraphQL requests run on this many threads per process, each holding at most one
+# database connection; requests beyond GRAPHQL_ASGI_MAX_PENDING are answered 503.
+GRAPHQL_ASGI_THREADS = int(os.environ.get('GRAPHQL_ASGI_THREADS', default=16))
+GRAPHQL_ASGI_MAX_PENDING = int(os.environ.get('GRAPHQL_ASGI_MAX_PENDING', default=256))
+
+# Subscriptions. 'postgres' uses LISTEN/NOTIFY so every server process hears new reads,
+# whichever worker ingested them; 'local' fans them out within one process and only suits
+# a single worker. Each WebSocket connection queues at most SUBSCRIPTION_QUEUE_SIZE
+# unprocessed events.
+SUBSCRIPTION_BROKER = os.environ.get('SUBSCRIPTION_BROKER', default='postgres')
+SUBSCRIPTION_QUEUE_SIZE = int(os.environ.get('SUBSCRIPTION_QUEUE_SIZE', default=1000))
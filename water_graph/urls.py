@@ -17,11 +17,14 @@ from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 from graphql_jwt.decorators import jwt_cookie
-from graphene_django.views import GraphQLView
+from api.views import CachedGraphQLView, database_pool_stats, document_cache_stats, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     # path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True)), name='graphql')
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True)), name='graphql')
+    path('graphql/', csrf_exempt(CachedGraphQLView.as_view(graphiql=True)), name='graphql'),
+    path('graphql/stats/documents/', document_cache_stats, name='graphql-document-stats'),
+    path('graphql/stats/pool/', database_pool_stats, name='database-pool-stats'),
+    path('metrics', metrics, name='metrics'),
 ]
 